@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+from .config import settings
+
+# In-process cache for read endpoints (expense list, summary, view page).
+#
+# Entries are tagged with the write generation they were computed under. Every
+# write in crud.py calls bump_generation() after committing, which makes all
+# older entries stale at once; stale entries are dropped lazily on lookup or
+# by LRU eviction. The generation is per process, which matches the single
+# uvicorn worker we deploy; with several workers each would need its own
+# invalidation channel.
+
+_lock = threading.Lock()
+_generation = 0
+# Generations restart at 0 with the process; the start time keeps tags unique
+_epoch = time.time_ns()
+
+
+def generation() -> int:
+    return _generation
+
+
+def generation_etag() -> str:
+    """Weak ETag that changes with every write, for responses built from many rows"""
+    return f'W/"g{_epoch:x}-{_generation}"'
+
+
+def bump_generation():
+    global _generation
+    with _lock:
+        _generation += 1
+
+
+def make_key(namespace: str, **params) -> Tuple:
+    """Normalized key: parameter order and None values don't matter"""
+    return (namespace,) + tuple(sorted((k, str(v)) for k, v in params.items() if v is not None))
+
+
+class QueryCache:
+    """LRU of computed responses, bounded to max_entries"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != _generation:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, computed_at: int) -> Any:
+        """
+        Store value computed under generation computed_at (read it before
+        querying, so a write that lands mid-query leaves the entry stale).
+        """
+        if self.max_entries <= 0:
+            return value
+        with self._lock:
+            self._entries[key] = (computed_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "generation": _generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+query_cache = QueryCache(settings.QUERY_CACHE_SIZE)
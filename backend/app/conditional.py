@@ -0,0 +1,154 @@
+import re
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+import aiofiles
+import aiofiles.os
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Conditional (ETag / Last-Modified -> 304) and Range (-> 206) handling for
+# file downloads and JSON reads. Starlette's FileResponse sets validators but
+# never answers If-None-Match or Range itself.
+
+# Content-addressed files: the URL changes whenever the content does
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Files that could change under the same URL: cache, but revalidate every time
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def is_not_modified(request: Request, etag: str, mtime: Optional[float] = None) -> bool:
+    """True if the client's cached copy is current (If-None-Match wins over If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(etag: str, cache_control: str, last_modified: Optional[str] = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return Response(status_code=304, headers=headers)
+
+
+def version_etag(updated_at: datetime) -> str:
+    """Weak ETag for a JSON representation of a row, from its updated_at"""
+    return f'W/"{updated_at:%Y%m%d%H%M%S%f}"'
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) of a single "bytes=" range, or None to send the
+    whole file (no header, or a form we don't serve such as multiple ranges).
+    Raises ValueError if the range can't be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} outside 0-{size - 1}")
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """Streams [start, end] of a file in chunks"""
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict, media_type: Optional[str]):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(self.start)
+            remaining = self.end - self.start + 1
+            more_body = True
+            while more_body:
+                chunk = await f.read(min(self.chunk_size, remaining)) if remaining > 0 else b""
+                remaining -= len(chunk)
+                more_body = remaining > 0 and bool(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+async def serve_file(
+    request: Request,
+    path: str,
+    media_type: Optional[str],
+    cache_control: str,
+    etag: Optional[str] = None
+) -> Response:
+    """
+    Respond with a stored file: 304 if the client's copy is current, 206 for a
+    satisfiable Range, 416 for an unsatisfiable one, else the whole file.
+    etag defaults to one derived from mtime and size.
+    """
+    stat_result = await aiofiles.os.stat(path)
+    etag = etag or f'"{int(stat_result.st_mtime):x}-{stat_result.st_size:x}"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return not_modified_response(etag, cache_control, last_modified)
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    size = stat_result.st_size
+
+    # If-Range: only honour Range while the client's partial copy is still current
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range") if not if_range or if_range.strip() == etag else None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", **headers})
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(path, start, end, status_code, headers, media_type)
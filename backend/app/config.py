@@ -5,6 +5,28 @@ import sys
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./data/expense_notes.db"
+
+    # SQLite connection tuning, applied as PRAGMAs on every new connection
+    SQLITE_JOURNAL_MODE: str = "WAL"  # WAL lets readers run alongside a writer
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # NORMAL is durable enough under WAL
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # Wait for locks instead of "database is locked"
+    SQLITE_CACHE_SIZE_KB: int = 65536  # Page cache per connection (64MB)
+    SQLITE_MMAP_SIZE: int = 268435456  # 256MB memory-mapped I/O, 0 disables
+    SQLITE_TEMP_STORE: str = "MEMORY"
+
+    # Connection pool (shared by all request threads of one worker process)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30  # Seconds to wait for a free connection
+
+    # In-process cache of list/summary/view responses (see cache.py), 0 disables
+    QUERY_CACHE_SIZE: int = 256
+
+    # Admin change feed (see events.py): events kept for Last-Event-ID resume,
+    # idle keepalive interval and the reconnect delay suggested to browsers
+    EVENT_BUFFER_SIZE: int = 500
+    EVENT_KEEPALIVE_SECONDS: int = 15
+    EVENT_RETRY_MS: int = 3000
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 480
@@ -15,22 +37,49 @@ class Settings(BaseSettings):
     SMTP_PASSWORD: Optional[str] = None
     SMTP_FROM_EMAIL: Optional[str] = None
     SMTP_FROM_NAME: str = "Expense Notes System"
+    SMTP_POOL_SIZE: int = 5  # Authenticated sessions kept open and reused (at most NOTIFY_CONCURRENCY are used)
+    SMTP_IDLE_TIMEOUT: int = 120  # Seconds before an unused session is closed instead of reused
+    SMTP_TIMEOUT: int = 30
     ADMIN_EMAIL: Optional[str] = None
     ADMIN_PASSWORD: str  # Required: admin login password
 
     MAX_FILE_SIZE: int = 10485760  # 10MB
+    MAX_REQUEST_SIZE: int = 104857600  # 100MB, whole multipart request (all files)
     UPLOAD_DIR: str = "./uploads"
-    ALLOWED_EXTENSIONS: str = "jpg,jpeg,png,pdf"
+    ALLOWED_EXTENSIONS: str = "jpg,jpeg,png,heic,heif,pdf"
+
+    # Photo normalization on upload: auto-orient, strip EXIF/GPS, cap size, recompress
+    IMAGE_MAX_EDGE: int = 2560  # Longest edge in pixels
+    IMAGE_NORMALIZE_QUALITY: int = 85
+    IMAGE_MAX_PIXELS: int = 50000000  # Reject larger images (decompression bombs)
+    KEEP_ORIGINAL_UPLOADS: bool = False  # Also store the untouched upload
+
+    # Thumbnails and previews for ?size= on the file endpoints (see images.py)
+    IMAGE_WORKERS: int = 2  # Processes rendering derivatives
+    IMAGE_QUALITY: int = 80  # WebP/JPEG quality of derivatives
+    REPORT_WORKERS: int = 2  # Processes rendering PDF reports
 
     FRONTEND_URL: str = "http://localhost:3000"
 
     # Public access token verification (Ed25519) - REQUIRED
-    ACCESS_TOKEN_PUBLIC_KEY: str  # Base64-encoded Ed25519 public key
+    # Base64-encoded Ed25519 public key, or "<kid>:<key>,<kid>:<key>" to accept
+    # several while rotating the bot's key (see token_verification.Keyring)
+    ACCESS_TOKEN_PUBLIC_KEY: str
     ACCESS_TOKEN_REQUIRED: bool = True  # Default to secure
+    ACCESS_TOKEN_CACHE_SIZE: int = 1024  # Verified tokens remembered until they expire
 
     # Bot notification settings - REQUIRED for DMs
     BOT_NOTIFY_URL: str  # e.g., http://hsg-bot:5000/notify
     BOT_NOTIFY_SECRET: str  # Shared secret with bot
+    NOTIFY_CONCURRENCY: int = 5  # Parallel email/DM sends by the outbox dispatcher
+
+    # Notification outbox (see outbox.py)
+    OUTBOX_POLL_SECONDS: int = 30  # Check for due messages at least this often
+    OUTBOX_SEND_TIMEOUT: int = 30  # Seconds before a send counts as failed
+    OUTBOX_MAX_ATTEMPTS: int = 8  # Then the message is dead-lettered
+    OUTBOX_RETRY_BASE_SECONDS: int = 30  # Doubles with each failed attempt...
+    OUTBOX_RETRY_MAX_SECONDS: int = 3600  # ...up to this
+    OUTBOX_RETENTION_DAYS: int = 30  # Sent messages are deleted after this
 
     @model_validator(mode='after')
     def validate_required_settings(self):
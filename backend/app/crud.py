@@ -1,19 +1,127 @@
+import base64
+import json
 import logging
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session, load_only, noload
+from decimal import Decimal
+from sqlalchemy import desc, or_, and_, literal_column, text, table, column, func, cast, Integer, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional
-from .models import ExpenseNote
-from .schemas import ExpenseNoteCreate, ExpenseNoteUpdate
+from typing import Iterator, List, Optional, Set, Tuple
+from .models import (
+    ExpenseNote, ExpenseFile, ExpenseRollup, MemberLedger, StoredBlob, OutboxMessage,
+    OUTBOX_EMAIL_NEW_EXPENSE, OUTBOX_EMAIL_STATUS_UPDATE, OUTBOX_DM_SUBMITTED, OUTBOX_DM_STATUS_CHANGE,
+    OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_DEAD
+)
+from .cache import bump_generation
+from .schemas import ExpenseNoteCreate, ExpenseNoteUpdate, ExpenseNoteFilter, ExpenseNoteBulkFields
 
 logger = logging.getLogger(__name__)
 
 
-def create_expense_note(db: Session, expense: ExpenseNoteCreate) -> ExpenseNote:
+RollupKey = Tuple[str, str, str, str]  # status, month, payment_method, paid_from
+LedgerKey = Tuple[str, str]  # mattermost_username, status
+
+def _aggregate_state(expense: ExpenseNote) -> Optional[Tuple[RollupKey, Optional[LedgerKey], int]]:
+    """
+    Rollup key, member ledger key and amount in cents an expense contributes.
+    None if it doesn't count (deleted); the ledger key is None without a username.
+    """
+    if expense.deleted:
+        return None
+    rollup_key = (
+        expense.status,
+        expense.date_entered.strftime("%Y-%m"),
+        expense.payment_method or "",
+        expense.paid_from or "",
+    )
+    ledger_key = (expense.mattermost_username, expense.status) if expense.mattermost_username else None
+    return rollup_key, ledger_key, int(round(Decimal(expense.amount) * 100))
+
+def _apply_delta(db: Session, model, key: dict, count: int, cents: int):
+    """Add count/cents to an aggregate row, creating it if needed"""
+    stmt = sqlite_insert(model).values(**key, count=count, total_cents=cents)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={
+            "count": model.count + count,
+            "total_cents": model.total_cents + cents,
+        }
+    )
+    db.execute(stmt)
+
+def _move_aggregates(db: Session, before, after):
+    """Move an expense's contribution between aggregate rows (states from _aggregate_state)"""
+    if before == after:
+        return
+    for state, sign in ((before, -1), (after, 1)):
+        if not state:
+            continue
+        rollup_key, ledger_key, cents = state
+        status, month, payment_method, paid_from = rollup_key
+        _apply_delta(db, ExpenseRollup, {
+            "status": status, "month": month,
+            "payment_method": payment_method, "paid_from": paid_from,
+        }, sign, sign * cents)
+        if ledger_key:
+            username, status = ledger_key
+            _apply_delta(db, MemberLedger, {
+                "mattermost_username": username, "status": status,
+            }, sign, sign * cents)
+
+def _enqueue(db: Session, kind: str, db_expense: ExpenseNote, **payload):
+    """Add an outbox message to the current transaction (sent by outbox.py once committed)"""
+    db.add(OutboxMessage(kind=kind, expense_id=db_expense.id, payload=json.dumps(payload)))
+
+def _enqueue_submitted_notifications(db: Session, db_expense: ExpenseNote):
+    _enqueue(
+        db, OUTBOX_EMAIL_NEW_EXPENSE, db_expense,
+        expense_id=db_expense.id,
+        member_name=db_expense.member_name or db_expense.mattermost_username or "Unknown",
+        amount=float(db_expense.amount)
+    )
+    if db_expense.mattermost_username:
+        _enqueue(
+            db, OUTBOX_DM_SUBMITTED, db_expense,
+            username=db_expense.mattermost_username,
+            amount=float(db_expense.amount),
+            description=db_expense.description,
+            view_token=db_expense.view_token
+        )
+
+def _enqueue_status_notifications(db: Session, db_expense: ExpenseNote):
+    _enqueue(
+        db, OUTBOX_EMAIL_STATUS_UPDATE, db_expense,
+        member_email=db_expense.member_email,
+        member_name=db_expense.member_name,
+        status=db_expense.status,
+        amount=float(db_expense.amount),
+        description=db_expense.description,
+        admin_notes=db_expense.admin_notes
+    )
+    if db_expense.mattermost_username:
+        _enqueue(
+            db, OUTBOX_DM_STATUS_CHANGE, db_expense,
+            username=db_expense.mattermost_username,
+            status=db_expense.status,
+            amount=float(db_expense.amount),
+            description=db_expense.description,
+            admin_notes=db_expense.admin_notes
+        )
+
+def create_expense_note(
+    db: Session,
+    expense: ExpenseNoteCreate,
+    mattermost_username: Optional[str] = None
+) -> ExpenseNote:
     try:
-        db_expense = ExpenseNote(**expense.model_dump())
+        db_expense = ExpenseNote(**expense.model_dump(), mattermost_username=mattermost_username)
         db.add(db_expense)
+        db.flush()  # Apply column defaults before computing the rollup key
+        _move_aggregates(db, None, _aggregate_state(db_expense))
+        _enqueue_submitted_notifications(db, db_expense)
         db.commit()
+        bump_generation()
         db.refresh(db_expense)
         return db_expense
     except SQLAlchemyError as e:
@@ -28,33 +136,324 @@ def get_expense_note(db: Session, expense_id: str) -> Optional[ExpenseNote]:
         logger.error(f"Failed to get expense note {expense_id}: {e}")
         raise
 
+def _version_query(db: Session):
+    # updated_at is NULL on some legacy rows; date_entered never is
+    return db.query(func.coalesce(ExpenseNote.updated_at, ExpenseNote.created_at, ExpenseNote.date_entered))
+
+def get_expense_note_version(db: Session, expense_id: str) -> Optional[datetime]:
+    """Last-modified time of an expense note (primary key lookup only), or None if missing"""
+    try:
+        return _version_query(db).filter(ExpenseNote.id == expense_id).scalar()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get version of expense note {expense_id}: {e}")
+        raise
+
+def _pack_cursor(sort_key: str, expense_id: str) -> str:
+    raw = f"{sort_key}|{expense_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _unpack_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_key, expense_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|', 1)
+        return sort_key, expense_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def encode_cursor(expense: ExpenseNote) -> str:
+    """Build an opaque pagination cursor from the (created_at, id) sort key"""
+    return _pack_cursor(expense.created_at.isoformat(), expense.id)
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Parse a cursor from encode_cursor. Raises ValueError if malformed."""
+    created_at, expense_id = _unpack_cursor(cursor)
+    return datetime.fromisoformat(created_at), expense_id
+
+def encode_search_cursor(rank: float, expense_id: str) -> str:
+    """Build an opaque pagination cursor from the (bm25 rank, id) sort key"""
+    return _pack_cursor(repr(rank), expense_id)
+
+def decode_search_cursor(cursor: str) -> Tuple[float, str]:
+    """Parse a cursor from encode_search_cursor. Raises ValueError if malformed."""
+    rank, expense_id = _unpack_cursor(cursor)
+    return float(rank), expense_id
+
+def _filter_by_status(query, status: Optional[str]):
+    if status == 'deleted':
+        # Show only deleted expenses
+        return query.filter(ExpenseNote.deleted == True)
+    elif status == 'all':
+        # Show all expenses including deleted
+        return query
+    elif status:
+        # Show only non-deleted expenses with specific status
+        return query.filter(ExpenseNote.status == status, ExpenseNote.deleted == False)
+    else:
+        # Default: show only non-deleted expenses
+        return query.filter(ExpenseNote.deleted == False)
+
+def get_expense_note_by_view_token(db: Session, view_token: str) -> Optional[ExpenseNote]:
+    try:
+        return db.query(ExpenseNote).filter(
+            ExpenseNote.view_token == view_token,
+            ExpenseNote.deleted == False
+        ).first()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get expense note by view token: {e}")
+        raise
+
+def get_expense_note_version_by_view_token(db: Session, view_token: str) -> Optional[datetime]:
+    """Like get_expense_note_version, through the unique view_token index"""
+    try:
+        return _version_query(db).filter(
+            ExpenseNote.view_token == view_token,
+            ExpenseNote.deleted == False
+        ).scalar()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get expense note version by view token: {e}")
+        raise
+
+def get_expense_file_by_view_token(
+    db: Session,
+    view_token: str,
+    path: str,
+    kind: Optional[str] = None
+) -> Optional[ExpenseFile]:
+    """A file of the (not deleted) expense with this view token, in one query"""
+    try:
+        query = db.query(ExpenseFile).join(ExpenseNote).filter(
+            ExpenseNote.view_token == view_token,
+            ExpenseNote.deleted == False,
+            ExpenseFile.path == path
+        )
+        if kind:
+            query = query.filter(ExpenseFile.kind == kind)
+        return query.first()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get file {path} by view token: {e}")
+        raise
+
+def _apply_filters(query, filters: Optional[ExpenseNoteFilter]):
+    if not filters:
+        return query
+
+    ranges = [
+        (ExpenseNote.date_entered, filters.date_entered_from, filters.date_entered_to),
+        (ExpenseNote.pay_date, filters.pay_date_from, filters.pay_date_to),
+        (ExpenseNote.created_at, filters.created_from, filters.created_to),
+    ]
+    for column_attr, lower, upper in ranges:
+        if lower is not None:
+            query = query.filter(column_attr >= lower)
+        if upper is not None:
+            query = query.filter(column_attr < upper)
+
+    if filters.amount_min is not None:
+        query = query.filter(ExpenseNote.amount >= filters.amount_min)
+    if filters.amount_max is not None:
+        query = query.filter(ExpenseNote.amount <= filters.amount_max)
+    if filters.payment_method:
+        query = query.filter(ExpenseNote.payment_method == filters.payment_method)
+    if filters.paid_from:
+        query = query.filter(ExpenseNote.paid_from == filters.paid_from)
+    if filters.mattermost_username:
+        query = query.filter(ExpenseNote.mattermost_username == filters.mattermost_username)
+    return query
+
+def _expense_notes_query(
+    db: Session,
+    skip: int,
+    limit: int,
+    status: Optional[str],
+    cursor: Optional[str],
+    filters: Optional[ExpenseNoteFilter]
+):
+    query = _filter_by_status(db.query(ExpenseNote), status)
+    query = _apply_filters(query, filters)
+    query = query.order_by(desc(ExpenseNote.created_at), desc(ExpenseNote.id))
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            ExpenseNote.created_at < cursor_created_at,
+            and_(ExpenseNote.created_at == cursor_created_at, ExpenseNote.id < cursor_id)
+        ))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+# Response fields computed from expense_files rather than stored as columns
+FILE_PATH_FIELDS = {"photo_paths", "attachment_paths"}
+
+def _sparse_load_options(fields: List[str]) -> list:
+    """
+    Loader options that fetch only the columns behind fields (plus the
+    created_at/id cursor key), and skip expense_files unless a path field
+    was asked for.
+    """
+    columns = {"id", "created_at"} | (set(fields) - FILE_PATH_FIELDS)
+    options = [load_only(*(getattr(ExpenseNote, name) for name in sorted(columns)))]
+    if not FILE_PATH_FIELDS & set(fields):
+        options.append(noload(ExpenseNote.files))
+    return options
+
 def get_all_expense_notes(
     db: Session,
     skip: int = 0,
     limit: int = 100,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    filters: Optional[ExpenseNoteFilter] = None,
+    fields: Optional[List[str]] = None
 ) -> List[ExpenseNote]:
-    try:
-        query = db.query(ExpenseNote)
-
-        if status == 'deleted':
-            # Show only deleted expenses
-            query = query.filter(ExpenseNote.deleted == True)
-        elif status == 'all':
-            # Show all expenses including deleted
-            pass
-        elif status:
-            # Show only non-deleted expenses with specific status
-            query = query.filter(ExpenseNote.status == status, ExpenseNote.deleted == False)
-        else:
-            # Default: show only non-deleted expenses
-            query = query.filter(ExpenseNote.deleted == False)
+    """
+    List expense notes, newest first.
 
-        return query.order_by(desc(ExpenseNote.created_at)).offset(skip).limit(limit).all()
+    With a cursor, paging is keyset-based on (created_at, id) and skip is ignored,
+    so deep pages cost the same as the first one. With fields, only those
+    attributes are loaded; touching any other one lazy-loads it.
+    """
+    query = _expense_notes_query(db, skip, limit, status, cursor, filters)
+    if fields:
+        query = query.options(*_sparse_load_options(fields))
+    try:
+        return query.all()
     except SQLAlchemyError as e:
         logger.error(f"Failed to get expense notes (status={status}): {e}")
         raise
 
+def iter_expense_notes(
+    db: Session,
+    status: Optional[str] = None,
+    filters: Optional[ExpenseNoteFilter] = None,
+    batch_size: int = 500
+) -> Iterator[ExpenseNote]:
+    """
+    Every matching expense note, newest first, fetched batch_size rows at a
+    time from a server-side cursor (for exports; nothing is held in memory).
+    """
+    try:
+        query = _filter_by_status(db.query(ExpenseNote), status)
+        query = _apply_filters(query, filters)
+        query = query.order_by(desc(ExpenseNote.created_at), desc(ExpenseNote.id))
+        yield from query.yield_per(batch_size)
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to iterate expense notes: {e}")
+        raise
+
+def iter_expense_note_rows(
+    db: Session,
+    columns: List,
+    status: Optional[str] = None,
+    filters: Optional[ExpenseNoteFilter] = None,
+    batch_size: int = 5000
+) -> Iterator[List[tuple]]:
+    """
+    Plain row tuples of the given ExpenseNote columns, newest first, in batches
+    of batch_size from a server-side cursor. No ORM objects are built.
+    """
+    try:
+        stmt = _filter_by_status(select(*columns), status)
+        stmt = _apply_filters(stmt, filters)
+        stmt = stmt.order_by(desc(ExpenseNote.created_at), desc(ExpenseNote.id))
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            yield partition
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to iterate expense note rows: {e}")
+        raise
+
+def get_expenses_for_report(
+    db: Session,
+    filters: Optional[ExpenseNoteFilter],
+    statuses: List[str]
+) -> List[ExpenseNote]:
+    """Non-deleted expenses matching filters and statuses, oldest first"""
+    try:
+        query = db.query(ExpenseNote).filter(
+            ExpenseNote.deleted == False,
+            ExpenseNote.status.in_(statuses)
+        )
+        query = _apply_filters(query, filters)
+        return query.order_by(ExpenseNote.date_entered, ExpenseNote.id).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get expenses for report: {e}")
+        raise
+
+def get_live_expense_ids(db: Session) -> Set[str]:
+    """Ids of all non-deleted expenses"""
+    try:
+        return {expense_id for (expense_id,) in db.query(ExpenseNote.id).filter(ExpenseNote.deleted == False)}
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get live expense ids: {e}")
+        raise
+
+def explain_expense_notes_query(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    filters: Optional[ExpenseNoteFilter] = None
+) -> dict:
+    """Return the SQL and SQLite query plan that get_all_expense_notes would run"""
+    query = _expense_notes_query(db, skip, limit, status, cursor, filters)
+    compiled = query.statement.compile(
+        dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}
+    )
+    try:
+        rows = db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+        return {"sql": str(compiled), "plan": [row[-1] for row in rows]}
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to explain expense notes query (status={status}): {e}")
+        raise
+
+# Lightweight handle on the FTS5 table created by database.init_search_index
+_fts_table = table("expense_notes_fts", column("rowid"))
+
+def _fts_match_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every term must match, as a prefix"""
+    terms = [term.replace('"', '""') for term in q.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+def search_expense_notes(
+    db: Session,
+    q: str,
+    limit: int = 100,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    filters: Optional[ExpenseNoteFilter] = None
+) -> List[Tuple[ExpenseNote, float]]:
+    """
+    Full-text search over description, admin notes, member name and username.
+
+    Returns (expense, rank) pairs, best match first (lower bm25 rank is better).
+    """
+    if cursor:
+        cursor_rank, cursor_id = decode_search_cursor(cursor)
+
+    match = _fts_match_query(q)
+    if not match:
+        return []
+
+    try:
+        rank = literal_column("bm25(expense_notes_fts)")
+        query = db.query(ExpenseNote, rank).join(
+            _fts_table, _fts_table.c.rowid == literal_column("expense_notes.rowid")
+        ).filter(text("expense_notes_fts MATCH :match")).params(match=match)
+        query = _filter_by_status(query, status)
+        query = _apply_filters(query, filters)
+
+        if cursor:
+            query = query.filter(or_(
+                rank > cursor_rank,
+                and_(rank == cursor_rank, ExpenseNote.id > cursor_id)
+            ))
+
+        return [tuple(row) for row in query.order_by(rank, ExpenseNote.id).limit(limit).all()]
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to search expense notes (q={q!r}): {e}")
+        raise
+
 def update_expense_note(
     db: Session,
     expense_id: str,
@@ -66,11 +465,17 @@ def update_expense_note(
             logger.warning(f"Cannot update expense note {expense_id}: not found")
             return None
 
+        before = _aggregate_state(db_expense)
+        old_status = db_expense.status
         update_data = expense_update.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_expense, field, value)
+        _move_aggregates(db, before, _aggregate_state(db_expense))
+        if update_data.get("status") and db_expense.status != old_status:
+            _enqueue_status_notifications(db, db_expense)
 
         db.commit()
+        bump_generation()
         db.refresh(db_expense)
         return db_expense
     except SQLAlchemyError as e:
@@ -78,33 +483,474 @@ def update_expense_note(
         db.rollback()
         raise
 
-def update_expense_file_paths(
+def bulk_update_expense_notes(
+    db: Session,
+    expense_ids: List[str],
+    expense_update: ExpenseNoteBulkFields
+) -> List[Tuple[ExpenseNote, str]]:
+    """
+    Apply the same update to many expense notes in one transaction, queueing
+    status notifications for those whose status changed.
+
+    Returns (expense, old_status) pairs for the expenses that exist.
+    """
+    try:
+        expenses = db.query(ExpenseNote).filter(ExpenseNote.id.in_(expense_ids)).all()
+        update_data = expense_update.model_dump(exclude_unset=True)
+
+        old_statuses = {}
+        for db_expense in expenses:
+            old_statuses[db_expense.id] = db_expense.status
+            before = _aggregate_state(db_expense)
+            for field, value in update_data.items():
+                setattr(db_expense, field, value)
+            _move_aggregates(db, before, _aggregate_state(db_expense))
+            if update_data.get("status") and db_expense.status != old_statuses[db_expense.id]:
+                _enqueue_status_notifications(db, db_expense)
+
+        db.commit()
+        bump_generation()
+
+        # One SELECT to reload everything the commit expired
+        expenses = db.query(ExpenseNote).filter(ExpenseNote.id.in_(expense_ids)).all()
+        return [(db_expense, old_statuses[db_expense.id]) for db_expense in expenses]
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to bulk update {len(expense_ids)} expense notes: {e}")
+        db.rollback()
+        raise
+
+def _adjust_blob_ref(db: Session, sha256: Optional[str], delta: int, size=None, mime_type=None):
+    """Add delta to a stored blob's ref_count, creating the row on first reference"""
+    if not sha256:
+        return
+    stmt = sqlite_insert(StoredBlob).values(
+        sha256=sha256, size=size, mime_type=mime_type,
+        ref_count=max(delta, 0), created_at=datetime.utcnow(), updated_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["sha256"],
+        set_={"ref_count": StoredBlob.ref_count + delta, "updated_at": datetime.utcnow()}
+    )
+    db.execute(stmt)
+
+def record_blobs(db: Session, blobs: List[dict]):
+    """
+    Record blobs an upload is about to write into the store, before they are
+    attached to an expense. New rows start unreferenced and existing ones get
+    a fresh updated_at, so storage GC collects the files if they are never
+    attached, but not within its grace period.
+
+    Each entry in blobs holds sha256, size and mime_type.
+    """
+    try:
+        for blob in blobs:
+            _adjust_blob_ref(db, blob["sha256"], 0, blob.get("size"), blob.get("mime_type"))
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to record {len(blobs)} uploaded blobs: {e}")
+        db.rollback()
+        raise
+
+def add_expense_files(
     db: Session,
     expense_id: str,
-    photo_paths: Optional[str] = None,
-    signature_path: Optional[str] = None,
-    signature_financial_path: Optional[str] = None,
-    attachment_paths: Optional[str] = None
+    kind: str,
+    files: List[dict]
 ) -> Optional[ExpenseNote]:
+    """
+    Attach stored files to an expense.
+
+    Each entry in files holds path, original_filename, size, mime_type and sha256.
+    Rows are plain inserts, so concurrent uploads to the same expense never
+    overwrite each other. Identical content already attached to the expense is
+    skipped; every new row takes a reference on its stored blob.
+    """
     try:
         db_expense = get_expense_note(db, expense_id)
         if not db_expense:
-            logger.warning(f"Cannot update file paths for expense {expense_id}: not found")
+            logger.warning(f"Cannot add files to expense {expense_id}: not found")
             return None
 
-        if photo_paths is not None:
-            db_expense.photo_paths = photo_paths
-        if signature_path is not None:
-            db_expense.signature_path = signature_path
-        if signature_financial_path is not None:
-            db_expense.signature_financial_path = signature_financial_path
-        if attachment_paths is not None:
-            db_expense.attachment_paths = attachment_paths
+        seen = {f.path for f in db_expense.files}
+        for file_info in files:
+            if file_info["path"] in seen:
+                continue
+            seen.add(file_info["path"])
+            db.add(ExpenseFile(expense_id=expense_id, kind=kind, **file_info))
+            _adjust_blob_ref(db, file_info.get("sha256"), 1, file_info.get("size"), file_info.get("mime_type"))
+            _adjust_blob_ref(db, file_info.get("original_sha256"), 1)
 
+        # Files are part of the expense: cached renders keyed by updated_at must refresh
+        db_expense.updated_at = datetime.utcnow()
         db.commit()
+        bump_generation()
         db.refresh(db_expense)
         return db_expense
     except SQLAlchemyError as e:
-        logger.error(f"Failed to update file paths for expense {expense_id}: {e}")
+        logger.error(f"Failed to add {kind} files to expense {expense_id}: {e}")
+        db.rollback()
+        raise
+
+def get_expense_file(
+    db: Session,
+    expense_id: str,
+    path: str,
+    kind: Optional[str] = None
+) -> Optional[ExpenseFile]:
+    try:
+        query = db.query(ExpenseFile).filter(
+            ExpenseFile.expense_id == expense_id,
+            ExpenseFile.path == path
+        )
+        if kind:
+            query = query.filter(ExpenseFile.kind == kind)
+        return query.first()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get file {path} for expense {expense_id}: {e}")
+        raise
+
+def delete_expense_file(db: Session, expense_id: str, path: str) -> Optional[ExpenseNote]:
+    """
+    Detach a file from an expense and release its blob reference.
+    Returns None if the expense or file is not found.
+    """
+    try:
+        db_file = get_expense_file(db, expense_id, path)
+        if not db_file:
+            return None
+
+        db.delete(db_file)
+        _adjust_blob_ref(db, db_file.sha256, -1)
+        _adjust_blob_ref(db, db_file.original_sha256, -1)
+        db.query(ExpenseNote).filter(ExpenseNote.id == expense_id).update(
+            {ExpenseNote.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+        bump_generation()
+        return get_expense_note(db, expense_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to delete file {path} from expense {expense_id}: {e}")
+        db.rollback()
+        raise
+
+def delete_unreferenced_blobs(
+    db: Session,
+    grace_seconds: int = 3600,
+    hashes: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Drop blob rows nothing references any more and return their hashes so the
+    caller can remove the files. Blobs touched within grace_seconds are kept:
+    an upload may have written the file but not yet attached it (see
+    record_blobs). hashes limits collection to those blobs.
+    """
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        query = db.query(StoredBlob.sha256).filter(
+            StoredBlob.ref_count <= 0,
+            StoredBlob.updated_at < cutoff
+        )
+        if hashes is not None:
+            query = query.filter(StoredBlob.sha256.in_(hashes))
+        hashes = [sha for (sha,) in query.all()]
+        if hashes:
+            db.query(StoredBlob).filter(
+                StoredBlob.sha256.in_(hashes),
+                StoredBlob.ref_count <= 0
+            ).delete(synchronize_session=False)
+            db.commit()
+        return hashes
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to collect unreferenced blobs: {e}")
+        db.rollback()
+        raise
+
+def set_expense_note_deleted(db: Session, expense_id: str, deleted: bool) -> Optional[ExpenseNote]:
+    """Soft delete or restore an expense note"""
+    try:
+        db_expense = get_expense_note(db, expense_id)
+        if not db_expense:
+            return None
+
+        before = _aggregate_state(db_expense)
+        db_expense.deleted = deleted
+        _move_aggregates(db, before, _aggregate_state(db_expense))
+        db.commit()
+        bump_generation()
+        db.refresh(db_expense)
+        return db_expense
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to set deleted={deleted} on expense note {expense_id}: {e}")
+        db.rollback()
+        raise
+
+def _aggregate_specs():
+    """(model, key columns, GROUP BY expressions, extra filter) for each aggregate table"""
+    return [
+        (
+            ExpenseRollup,
+            ["status", "month", "payment_method", "paid_from"],
+            [
+                ExpenseNote.status,
+                func.strftime("%Y-%m", ExpenseNote.date_entered),
+                func.coalesce(ExpenseNote.payment_method, ""),
+                func.coalesce(ExpenseNote.paid_from, ""),
+            ],
+            None,
+        ),
+        (
+            MemberLedger,
+            ["mattermost_username", "status"],
+            [ExpenseNote.mattermost_username, ExpenseNote.status],
+            ExpenseNote.mattermost_username.isnot(None),
+        ),
+    ]
+
+def _recount(db: Session, group_by: list, extra_filter) -> dict:
+    """Compute aggregate rows from expense_notes with a full GROUP BY"""
+    query = db.query(
+        *group_by, func.count(), func.sum(cast(func.round(ExpenseNote.amount * 100), Integer))
+    ).filter(ExpenseNote.deleted == False)
+    if extra_filter is not None:
+        query = query.filter(extra_filter)
+    rows = query.group_by(*group_by).all()
+    return {tuple(row[:-2]): (row[-2], row[-1] or 0) for row in rows}
+
+def rebuild_expense_rollups(db: Session) -> int:
+    """Recompute the rollup and member ledger tables from scratch. Returns the number of rows."""
+    try:
+        total_rows = 0
+        for model, key_columns, group_by, extra_filter in _aggregate_specs():
+            aggregated = _recount(db, group_by, extra_filter)
+            db.query(model).delete(synchronize_session=False)
+            for key, (count, cents) in aggregated.items():
+                db.add(model(**dict(zip(key_columns, key)), count=count, total_cents=cents))
+            total_rows += len(aggregated)
+        db.commit()
+        bump_generation()
+        return total_rows
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to rebuild expense rollups: {e}")
+        db.rollback()
+        raise
+
+def check_expense_rollups(db: Session) -> List[dict]:
+    """Compare the rollup and ledger tables against a full GROUP BY. Returns the rows that differ."""
+    mismatches = []
+    for model, key_columns, group_by, extra_filter in _aggregate_specs():
+        try:
+            expected = _recount(db, group_by, extra_filter)
+            actual = {
+                tuple(getattr(row, c) for c in key_columns): (row.count, row.total_cents)
+                for row in db.query(model).filter(model.count != 0).all()
+            }
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to check {model.__tablename__}: {e}")
+            raise
+
+        for key in sorted(set(expected) | set(actual)):
+            if expected.get(key) != actual.get(key):
+                mismatches.append({
+                    "table": model.__tablename__,
+                    **dict(zip(key_columns, key)),
+                    "expected": expected.get(key, (0, 0)),
+                    "actual": actual.get(key, (0, 0)),
+                })
+    return mismatches
+
+def _cents_to_decimal(cents: int) -> Decimal:
+    return (Decimal(cents) / 100).quantize(Decimal("0.01"))
+
+def get_expense_summary(db: Session) -> dict:
+    """Totals and counts by status, month, payment_method and paid_from, from the rollup table"""
+    try:
+        rollups = db.query(ExpenseRollup).filter(ExpenseRollup.count != 0).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get expense summary: {e}")
+        raise
+
+    dimensions = ("status", "month", "payment_method", "paid_from")
+    buckets = {dimension: {} for dimension in dimensions}
+    count = cents = 0
+    for rollup in rollups:
+        count += rollup.count
+        cents += rollup.total_cents
+        for dimension in dimensions:
+            bucket = buckets[dimension].setdefault(getattr(rollup, dimension), [0, 0])
+            bucket[0] += rollup.count
+            bucket[1] += rollup.total_cents
+
+    def to_list(dimension):
+        return [
+            {"key": key, "count": c, "total": _cents_to_decimal(t)}
+            for key, (c, t) in sorted(buckets[dimension].items())
+        ]
+
+    return {
+        "count": count,
+        "total": _cents_to_decimal(cents),
+        "by_status": to_list("status"),
+        "by_month": to_list("month"),
+        "by_payment_method": to_list("payment_method"),
+        "by_paid_from": to_list("paid_from"),
+    }
+
+def get_member_ledger(db: Session, mattermost_username: str) -> dict:
+    """Counts and totals per status for one member, from the ledger table"""
+    try:
+        rows = db.query(MemberLedger).filter(
+            MemberLedger.mattermost_username == mattermost_username
+        ).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get ledger for {mattermost_username}: {e}")
+        raise
+
+    by_status = {row.status: row for row in rows if row.count}
+    ledger = {"username": mattermost_username}
+    for status in ("pending", "paid", "denied"):
+        row = by_status.get(status)
+        ledger[status] = {
+            "count": row.count if row else 0,
+            "total": _cents_to_decimal(row.total_cents if row else 0),
+        }
+    ledger["submitted"] = {
+        "count": sum(row.count for row in by_status.values()),
+        "total": _cents_to_decimal(sum(row.total_cents for row in by_status.values())),
+    }
+    return ledger
+
+def _outbox_claimable(now: datetime):
+    """Pending, due, and not claimed by a dispatcher (or its lease ran out)"""
+    return and_(
+        OutboxMessage.status == OUTBOX_PENDING,
+        OutboxMessage.next_attempt_at <= now,
+        or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until < now)
+    )
+
+def get_due_outbox_messages(db: Session, limit: int, exclude_ids=()) -> List[OutboxMessage]:
+    """Unclaimed pending outbox messages whose next attempt is due, oldest first"""
+    try:
+        query = db.query(OutboxMessage).filter(_outbox_claimable(datetime.utcnow()))
+        if exclude_ids:
+            query = query.filter(OutboxMessage.id.notin_(exclude_ids))
+        return query.order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(limit).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get due outbox messages: {e}")
+        raise
+
+def get_next_outbox_attempt(db: Session) -> Optional[datetime]:
+    """When the earliest pending outbox message is due, or None if there are none"""
+    try:
+        return db.query(func.min(OutboxMessage.next_attempt_at)).filter(
+            OutboxMessage.status == OUTBOX_PENDING
+        ).scalar()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get next outbox attempt: {e}")
+        raise
+
+def claim_outbox_message(db: Session, message_id: int, lease: timedelta) -> bool:
+    """
+    Take a due message for sending until now + lease. The conditional UPDATE
+    is atomic, so of several dispatchers only one gets True.
+    """
+    try:
+        now = datetime.utcnow()
+        claimed = db.query(OutboxMessage).filter(
+            OutboxMessage.id == message_id,
+            _outbox_claimable(now)
+        ).update({OutboxMessage.claimed_until: now + lease}, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to claim outbox message {message_id}: {e}")
+        db.rollback()
+        raise
+
+def mark_outbox_message_sent(db: Session, message_id: int):
+    try:
+        db.query(OutboxMessage).filter(OutboxMessage.id == message_id).update({
+            OutboxMessage.status: OUTBOX_SENT,
+            OutboxMessage.attempts: OutboxMessage.attempts + 1,
+            OutboxMessage.sent_at: datetime.utcnow(),
+            OutboxMessage.last_error: None,
+            OutboxMessage.claimed_until: None,
+        }, synchronize_session=False)
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to mark outbox message {message_id} sent: {e}")
+        db.rollback()
+        raise
+
+def mark_outbox_message_failed(db: Session, message_id: int, error: str, next_attempt_at: Optional[datetime]):
+    """Record a failed attempt; without next_attempt_at the message is dead-lettered"""
+    try:
+        values = {
+            OutboxMessage.attempts: OutboxMessage.attempts + 1,
+            OutboxMessage.last_error: error,
+            OutboxMessage.claimed_until: None,
+        }
+        if next_attempt_at is None:
+            values[OutboxMessage.status] = OUTBOX_DEAD
+        else:
+            values[OutboxMessage.next_attempt_at] = next_attempt_at
+        db.query(OutboxMessage).filter(OutboxMessage.id == message_id).update(values, synchronize_session=False)
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to record failure of outbox message {message_id}: {e}")
+        db.rollback()
+        raise
+
+def get_outbox_messages(
+    db: Session,
+    status: Optional[str] = None,
+    limit: int = 100
+) -> List[OutboxMessage]:
+    """Outbox messages, newest first; all but sent ones when status is None"""
+    try:
+        query = db.query(OutboxMessage)
+        if status:
+            query = query.filter(OutboxMessage.status == status)
+        else:
+            query = query.filter(OutboxMessage.status != OUTBOX_SENT)
+        return query.order_by(desc(OutboxMessage.id)).limit(limit).all()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to get outbox messages (status={status}): {e}")
+        raise
+
+def count_outbox_messages(db: Session) -> dict:
+    try:
+        rows = db.query(OutboxMessage.status, func.count()).group_by(OutboxMessage.status).all()
+        return {status: count for status, count in rows}
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to count outbox messages: {e}")
+        raise
+
+def retry_outbox_message(db: Session, message_id: int) -> Optional[OutboxMessage]:
+    """Put a dead (or pending) message back in the queue with a fresh attempt budget"""
+    try:
+        message = db.query(OutboxMessage).filter(OutboxMessage.id == message_id).first()
+        if not message or message.status == OUTBOX_SENT:
+            return None
+        message.status = OUTBOX_PENDING
+        message.attempts = 0
+        message.next_attempt_at = datetime.utcnow()
+        db.commit()
+        db.refresh(message)
+        return message
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to retry outbox message {message_id}: {e}")
+        db.rollback()
+        raise
+
+def delete_sent_outbox_messages(db: Session, older_than: datetime) -> int:
+    try:
+        deleted = db.query(OutboxMessage).filter(
+            OutboxMessage.status == OUTBOX_SENT,
+            OutboxMessage.sent_at < older_than
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to delete sent outbox messages: {e}")
         db.rollback()
         raise
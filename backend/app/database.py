@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 from .models import Base
@@ -9,16 +9,76 @@ os.makedirs("./data", exist_ok=True)
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 os.makedirs(f"{settings.UPLOAD_DIR}/photos", exist_ok=True)
 os.makedirs(f"{settings.UPLOAD_DIR}/signatures", exist_ok=True)
+os.makedirs(f"{settings.UPLOAD_DIR}/attachments", exist_ok=True)
+os.makedirs(f"{settings.UPLOAD_DIR}/objects", exist_ok=True)
+os.makedirs(f"{settings.UPLOAD_DIR}/tmp", exist_ok=True)
+
+is_sqlite = settings.DATABASE_URL.startswith("sqlite")
 
 engine = create_engine(
     settings.DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Only for SQLite
+    connect_args={"check_same_thread": False} if is_sqlite else {},  # Only for SQLite
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
 )
 
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune every new SQLite connection (pragmas are per-connection)"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA temp_store={settings.SQLITE_TEMP_STORE}")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Full-text search index over expense_notes (external content FTS5 table kept
+# in sync by triggers). Keep in sync with migrate.py
+FTS_TABLE = "expense_notes_fts"
+FTS_COLUMNS = "description, admin_notes, member_name, mattermost_username"
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {FTS_COLUMNS},
+        content='expense_notes', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON expense_notes BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, {FTS_COLUMNS})
+        VALUES (new.rowid, new.description, new.admin_notes, new.member_name, new.mattermost_username);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON expense_notes BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {FTS_COLUMNS})
+        VALUES ('delete', old.rowid, old.description, old.admin_notes, old.member_name, old.mattermost_username);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF {FTS_COLUMNS} ON expense_notes BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {FTS_COLUMNS})
+        VALUES ('delete', old.rowid, old.description, old.admin_notes, old.member_name, old.mattermost_username);
+        INSERT INTO {FTS_TABLE} (rowid, {FTS_COLUMNS})
+        VALUES (new.rowid, new.description, new.admin_notes, new.member_name, new.mattermost_username);
+    END""",
+]
+
+def init_search_index():
+    """Create the FTS5 index and triggers, indexing existing rows on first creation"""
+    with engine.begin() as conn:
+        is_new = not inspect(conn).has_table(FTS_TABLE)
+        for statement in FTS_SCHEMA:
+            conn.exec_driver_sql(statement)
+        if is_new:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    if is_sqlite:
+        init_search_index()
 
 def get_db():
     db = SessionLocal()
@@ -1,12 +1,83 @@
 import aiosmtplib
+import asyncio
 import logging
+import time
+from email.message import Message
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from .config import settings
-from typing import Optional
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+class SMTPPool:
+    """
+    Up to `size` authenticated SMTP sessions, reused across sends so each
+    email doesn't pay for a TCP connect, STARTTLS handshake and login.
+
+    Sessions idle for longer than idle_timeout are closed rather than reused
+    (servers drop them after a few minutes anyway), and a send on a session
+    the server has dropped is retried once on a fresh one.
+    """
+
+    def __init__(self, size: int, idle_timeout: float):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle: List[Tuple[aiosmtplib.SMTP, float]] = []
+        self._slots = asyncio.Semaphore(size)
+        self.connects = 0
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            username=settings.SMTP_USER,
+            password=settings.SMTP_PASSWORD,
+            start_tls=True,
+            timeout=settings.SMTP_TIMEOUT
+        )
+        # Connects, upgrades with STARTTLS and logs in
+        await client.connect()
+        self.connects += 1
+        return client
+
+    async def _discard(self, client: aiosmtplib.SMTP):
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def _acquire(self) -> aiosmtplib.SMTP:
+        while self._idle:
+            client, last_used = self._idle.pop()
+            if client.is_connected and time.monotonic() - last_used < self.idle_timeout:
+                return client
+            await self._discard(client)
+        return await self._connect()
+
+    async def send(self, message: Message):
+        async with self._slots:
+            client = await self._acquire()
+            try:
+                try:
+                    await client.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # Dropped while idle; one attempt on a new session
+                    await self._discard(client)
+                    client = await self._connect()
+                    await client.send_message(message)
+            except Exception:
+                await self._discard(client)
+                raise
+            self._idle.append((client, time.monotonic()))
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._discard(client) for client, _ in idle))
+
+smtp_pool = SMTPPool(settings.SMTP_POOL_SIZE, settings.SMTP_IDLE_TIMEOUT)
+
 class EmailService:
     @staticmethod
     async def send_email(
@@ -29,16 +100,11 @@ class EmailService:
         message.attach(MIMEText(html_content, "html"))
 
         try:
-            await aiosmtplib.send(
-                message,
-                hostname=settings.SMTP_HOST,
-                port=settings.SMTP_PORT,
-                username=settings.SMTP_USER,
-                password=settings.SMTP_PASSWORD,
-                start_tls=True
-            )
+            await smtp_pool.send(message)
         except Exception as e:
+            # Raised so the outbox dispatcher can retry it
             logger.error(f"Failed to send email to {to_email}: {e}")
+            raise
 
     @staticmethod
     async def send_new_expense_notification(expense_id: str, member_name: str, amount: float):
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+import orjson
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Change feed for the admin dashboard, served as Server-Sent Events by
+# GET /api/admin/events. Routers publish after their write has committed;
+# every event carries the expense's list columns so dashboards can patch
+# their list in place instead of refetching it.
+#
+# The last EVENT_BUFFER_SIZE events are kept so a reconnecting client can
+# resume from its Last-Event-ID. If that ID is older than the buffer, or from
+# before a restart (IDs are "<process start>-<sequence>"), the client gets a
+# "reset" event and should refetch. Everything here runs on the event loop;
+# publish() must not be called from worker threads.
+
+_epoch = f"{time.time_ns():x}"
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.EVENT_BUFFER_SIZE)
+        self.lagged = False
+
+
+class EventBroker:
+    def __init__(self, buffer_size: int):
+        self._buffer: "deque[tuple[int, bytes]]" = deque(maxlen=buffer_size)
+        self._sequence = 0
+        self._subscribers: "set[_Subscriber]" = set()
+
+    def _event_id(self, sequence: int) -> str:
+        return f"{_epoch}-{sequence}"
+
+    def _frame(self, sequence: int, event_type: str, data: dict) -> bytes:
+        return (
+            f"id: {self._event_id(sequence)}\nevent: {event_type}\ndata: ".encode()
+            + orjson.dumps(data) + b"\n\n"
+        )
+
+    def publish(self, event_type: str, expense) -> None:
+        self._sequence += 1
+        frame = self._frame(self._sequence, event_type, {
+            "id": expense.id,
+            "status": expense.status,
+            "member_name": expense.member_name,
+            "description": expense.description,
+            "amount": str(expense.amount),
+            "date_entered": expense.date_entered,
+            "deleted": expense.deleted,
+            "updated_at": expense.updated_at,
+        })
+        self._buffer.append((self._sequence, frame))
+
+        for subscriber in self._subscribers:
+            if subscriber.lagged:
+                continue
+            try:
+                subscriber.queue.put_nowait((self._sequence, frame))
+            except asyncio.QueueFull:
+                # Too slow to keep up; it gets a reset instead of a gap
+                subscriber.lagged = True
+
+    def _replay(self, last_event_id: Optional[str]) -> Optional[list]:
+        """Buffered frames after last_event_id, or None if the client must reset"""
+        if not last_event_id:
+            return []
+        epoch, _, sequence = last_event_id.partition("-")
+        if epoch != _epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        oldest = self._buffer[0][0] if self._buffer else self._sequence + 1
+        if sequence < oldest - 1:
+            return None
+        return [entry for entry in self._buffer if entry[0] > sequence]
+
+    def _reset_frame(self) -> bytes:
+        return self._frame(self._sequence, "reset", {})
+
+    async def stream(self, last_event_id: Optional[str]) -> AsyncIterator[bytes]:
+        """SSE frames for one client: the missed ones, then live ones as they are published"""
+        subscriber = _Subscriber()
+        self._subscribers.add(subscriber)
+        try:
+            # Snapshot before the first yield, so nothing published meanwhile is lost
+            replay = self._replay(last_event_id)
+            reset = replay is None
+            replay = replay or []
+            sent = replay[-1][0] if replay else self._sequence
+
+            yield f"retry: {settings.EVENT_RETRY_MS}\n\n".encode()
+            if reset:
+                yield self._reset_frame()
+            for _, frame in replay:
+                yield frame
+
+            while True:
+                if subscriber.lagged:
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.lagged = False
+                    sent = self._sequence
+                    yield self._reset_frame()
+                try:
+                    sequence, frame = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=settings.EVENT_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    # Comment line: keeps proxies from closing an idle stream
+                    yield b": keepalive\n\n"
+                    continue
+                if sequence > sent:
+                    sent = sequence
+                    yield frame
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "buffered": len(self._buffer),
+            "last_event_id": self._event_id(self._sequence) if self._sequence else None,
+        }
+
+
+broker = EventBroker(settings.EVENT_BUFFER_SIZE)
+
+
+def publish(event_type: str, expense) -> None:
+    """Announce a committed change to an expense; never raises"""
+    if expense is None:
+        return
+    try:
+        broker.publish(event_type, expense)
+    except Exception as e:
+        logger.error(f"Failed to publish {event_type} for expense {expense.id}: {e}")
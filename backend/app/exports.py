@@ -0,0 +1,261 @@
+import csv
+import io
+import json
+import logging
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterator, List, Optional
+from .crud import iter_expense_notes, iter_expense_note_rows
+from .database import SessionLocal
+from .models import ExpenseNote
+from .schemas import ExpenseNoteFilter
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+# In requirements.txt; only optional for local setups that skip it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Streaming exports. Each generator runs with its own session (the request's
+# session is closed before a StreamingResponse body is sent) and yields bytes
+# as soon as they are produced, so memory stays flat whatever the size.
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Already compressed; deflating them again only costs CPU
+STORED_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "webp", "heic", "heif", "pdf", "zip"}
+
+MANIFEST_FIELDS = [
+    "expense_id", "date_entered", "status", "member_name", "member_email", "mattermost_username",
+    "description", "amount", "payment_method", "pay_date", "paid_from", "paid_to",
+    "file_kind", "file_path", "original_filename", "file_size", "sha256",
+]
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only, unseekable buffer a zipfile/parquet writer fills and the response drains"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _expense_fields(expense) -> dict:
+    return {
+        "expense_id": expense.id,
+        "date_entered": _isoformat(expense.date_entered),
+        "status": expense.status,
+        "member_name": expense.member_name,
+        "member_email": expense.member_email,
+        "mattermost_username": expense.mattermost_username,
+        "description": expense.description,
+        "amount": str(expense.amount),
+        "payment_method": expense.payment_method,
+        "pay_date": _isoformat(expense.pay_date),
+        "paid_from": expense.paid_from,
+        "paid_to": expense.paid_to,
+    }
+
+
+def _file_fields(expense_file) -> dict:
+    return {
+        "file_kind": expense_file.kind,
+        "file_path": expense_file.path,
+        "original_filename": expense_file.original_filename,
+        "file_size": expense_file.size,
+        "sha256": expense_file.sha256,
+    }
+
+
+def _write_entry(archive: zipfile.ZipFile, sink: _StreamSink, zinfo: zipfile.ZipInfo, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # Sizes aren't known up front for generated entries, so always allow zip64
+    with archive.open(zinfo, "w", force_zip64=True) as dest:
+        for chunk in chunks:
+            dest.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def _read_file(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(EXPORT_CHUNK_SIZE):
+            yield chunk
+
+
+def _csv_manifest(db, status, filters) -> Iterator[bytes]:
+    """One row per file of each expense, or a single row for expenses without files"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    for expense in iter_expense_notes(db, status, filters):
+        fields = _expense_fields(expense)
+        if not expense.files:
+            writer.writerow(fields)
+        for f in expense.files:
+            writer.writerow({**fields, **_file_fields(f)})
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _json_manifest(db, status, filters) -> Iterator[bytes]:
+    """A JSON array of expenses, each with its files"""
+    yield b"["
+    separator = b"\n"
+    for expense in iter_expense_notes(db, status, filters):
+        entry = {**_expense_fields(expense), "files": [_file_fields(f) for f in expense.files]}
+        yield separator + json.dumps(entry).encode()
+        separator = b",\n"
+    yield b"\n]\n"
+
+
+def stream_zip_export(status: Optional[str], filters: Optional[ExpenseNoteFilter]) -> Iterator[bytes]:
+    """
+    ZIP of the matching expenses' files, laid out like UPLOAD_DIR (photos/...,
+    attachments/...), plus manifest.csv and manifest.json. Files shared by
+    several expenses are stored once.
+    """
+    sink = _StreamSink()
+    db = SessionLocal()
+    try:
+        with zipfile.ZipFile(sink, mode="w") as archive:
+            written = set()
+            for expense in iter_expense_notes(db, status, filters):
+                for f in expense.files:
+                    if f.path in written:
+                        continue
+                    file_type, filename = f.path.split("/", 1)
+                    source = storage.resolve_file(file_type, filename)
+                    if not source:
+                        logger.warning(f"ZIP export: {f.path} of expense {expense.id} missing on disk")
+                        continue
+                    written.add(f.path)
+
+                    zinfo = zipfile.ZipInfo.from_file(source, arcname=f.path)
+                    extension = filename.rsplit(".", 1)[-1].lower()
+                    zinfo.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                    yield from _write_entry(archive, sink, zinfo, _read_file(source))
+
+            now = datetime.now().timetuple()[:6]
+            for name, chunks in (
+                ("manifest.csv", _csv_manifest(db, status, filters)),
+                ("manifest.json", _json_manifest(db, status, filters)),
+            ):
+                zinfo = zipfile.ZipInfo(name, date_time=now)
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                yield from _write_entry(archive, sink, zinfo, chunks)
+
+            logger.info(f"ZIP export: {len(written)} files")
+        # Central directory, written when the archive is closed
+        yield sink.drain()
+    finally:
+        db.close()
+
+
+# Flat accounting export (CSV / NDJSON / Parquet): one row per expense
+EXPORT_COLUMNS = [
+    ExpenseNote.id, ExpenseNote.status, ExpenseNote.date_entered, ExpenseNote.member_name,
+    ExpenseNote.member_email, ExpenseNote.mattermost_username, ExpenseNote.description,
+    ExpenseNote.amount, ExpenseNote.payment_method, ExpenseNote.iban, ExpenseNote.expense_type,
+    ExpenseNote.pay_date, ExpenseNote.paid_from, ExpenseNote.paid_to,
+    ExpenseNote.financial_responsible, ExpenseNote.admin_notes,
+    ExpenseNote.created_at, ExpenseNote.updated_at,
+]
+EXPORT_FIELDS = [c.key for c in EXPORT_COLUMNS]
+
+ROW_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _csv_rows(batches: Iterator[List[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _ndjson_rows(batches: Iterator[List[tuple]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_FIELDS, row)), default=_json_default) + "\n" for row in batch
+        ).encode()
+
+
+def _parquet_schema():
+    types = {
+        "date_entered": pa.timestamp("us"),
+        "pay_date": pa.timestamp("us"),
+        "created_at": pa.timestamp("us"),
+        "updated_at": pa.timestamp("us"),
+        "amount": pa.decimal128(10, 2),
+    }
+    return pa.schema([(name, types.get(name, pa.string())) for name in EXPORT_FIELDS])
+
+
+def _parquet_rows(batches: Iterator[List[tuple]]) -> Iterator[bytes]:
+    """One Parquet row group per batch, flushed to the client as it is written"""
+    schema = _parquet_schema()
+    sink = _StreamSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for batch in batches:
+            columns = zip(*batch)
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_rows_export(export_format: str, status: Optional[str], filters: Optional[ExpenseNoteFilter]) -> Iterator[bytes]:
+    """Every matching expense as CSV, NDJSON or Parquet, serialized a batch at a time"""
+    writers = {"csv": _csv_rows, "ndjson": _ndjson_rows, "parquet": _parquet_rows}
+    db = SessionLocal()
+    try:
+        yield from writers[export_format](iter_expense_note_rows(db, EXPORT_COLUMNS, status, filters))
+    finally:
+        db.close()
+
+
+def export_filename(extension: str) -> str:
+    return f"expenses-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
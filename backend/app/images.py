@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set
+from PIL import Image, ImageOps
+from .config import settings
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# Resized copies of uploaded images, cached on disk next to the store:
+#   derived/<path of original relative to UPLOAD_DIR>/<size>.<format>
+# Pillow work runs in a process pool so it never blocks the event loop or holds the GIL.
+
+DERIVED_DIR = "derived"
+
+# Longest edge in pixels per ?size= value
+SIZES = {
+    "thumb": 320,
+    "small": 640,
+    "preview": 1600,
+}
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "webp"}
+
+# Uploads normalized on ingest: extension -> (Pillow format, stored extension).
+# HEIC/HEIF photos from iPhones are stored as JPEG.
+NORMALIZED_FORMATS = {
+    "jpg": ("JPEG", "jpg"),
+    "jpeg": ("JPEG", "jpg"),
+    "heic": ("JPEG", "jpg"),
+    "heif": ("JPEG", "jpg"),
+    "png": ("PNG", "png"),
+}
+
+# Only readable with pillow-heif; without it these uploads are refused
+HEIF_EXTENSIONS = {"heic", "heif"}
+
+
+class InvalidImage(ValueError):
+    """Upload is not a readable image, or has more pixels than IMAGE_MAX_PIXELS"""
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending: Dict[str, asyncio.Future] = {}
+
+
+def allowed_extensions() -> Set[str]:
+    """Upload extensions from ALLOWED_EXTENSIONS that can actually be processed"""
+    extensions = set(settings.ALLOWED_EXTENSIONS.split(","))
+    return extensions if HEIF_SUPPORTED else extensions - HEIF_EXTENSIONS
+
+
+def check_support():
+    """Warn at startup about configured upload types this install can't read"""
+    if not HEIF_SUPPORTED and HEIF_EXTENSIONS & set(settings.ALLOWED_EXTENSIONS.split(",")):
+        logger.warning("pillow-heif is not installed: HEIC/HEIF uploads will be rejected")
+
+
+def is_image(filename: str) -> bool:
+    return filename.rsplit(".", 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def derived_dir(source_path: str) -> str:
+    """Directory holding every derivative of a stored file"""
+    relative = os.path.relpath(source_path, settings.UPLOAD_DIR)
+    return os.path.join(settings.UPLOAD_DIR, DERIVED_DIR, relative)
+
+
+def derivative_path(source_path: str, size: str, fmt: str) -> str:
+    return os.path.join(derived_dir(source_path), f"{size}.{fmt}")
+
+
+def _render(source_path: str, target_path: str, max_edge: int, pil_format: str, quality: int):
+    """Write a resized copy of source_path (runs in a worker process)"""
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f"{target_path}.{secrets.token_hex(8)}.part"
+        try:
+            image.save(temp_path, pil_format, quality=quality)
+            os.replace(temp_path, target_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def render_derivative(source_path: str, size: str, fmt: str) -> str:
+    """Render a derivative in the calling process unless it is cached already"""
+    target_path = derivative_path(source_path, size, fmt)
+    if not os.path.exists(target_path):
+        pil_format, _ = FORMATS[fmt]
+        _render(source_path, target_path, SIZES[size], pil_format, settings.IMAGE_QUALITY)
+    return target_path
+
+
+def _normalize(source_path: str, target_path: str, pil_format: str,
+               max_edge: int, quality: int, max_pixels: int) -> dict:
+    """
+    Auto-orient, downscale and recompress an upload without its EXIF/GPS
+    metadata (runs in a worker process). Returns size and sha256 of the result.
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with Image.open(source_path) as image:
+            # Only the header has been read so far; refuse bombs before decoding
+            if image.width * image.height > max_pixels:
+                raise InvalidImage(f"{image.width}x{image.height} exceeds {max_pixels} pixels")
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            # Pillow only writes metadata that is passed to save(), so EXIF is dropped
+            image.save(target_path, pil_format, quality=quality, optimize=True)
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise InvalidImage(str(e))
+    except (OSError, SyntaxError) as e:
+        raise InvalidImage(f"Cannot read image: {e}")
+
+    digest = hashlib.sha256()
+    with open(target_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return {"size": os.path.getsize(target_path), "sha256": digest.hexdigest()}
+
+
+async def normalize_upload(source_path: str, extension: str) -> Optional[dict]:
+    """
+    Normalize an uploaded image in the process pool. Returns the temp path,
+    extension, size and sha256 of the normalized file, or None if uploads
+    of this type are stored as-is. Raises InvalidImage.
+    """
+    if extension not in NORMALIZED_FORMATS:
+        return None
+    pil_format, stored_extension = NORMALIZED_FORMATS[extension]
+    target_path = storage.temp_path(f"{secrets.token_hex(16)}.{stored_extension}")
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(
+            _get_executor(), _normalize,
+            source_path, target_path, pil_format,
+            settings.IMAGE_MAX_EDGE, settings.IMAGE_NORMALIZE_QUALITY, settings.IMAGE_MAX_PIXELS
+        )
+    except BaseException:
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        raise
+    return {"temp_path": target_path, "extension": stored_extension, **result}
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def get_derivative(source_path: str, size: str, fmt: str) -> str:
+    """
+    Path of a resized copy of source_path, rendering it on a cache miss.
+    Concurrent requests for the same derivative share one render.
+    """
+    target_path = derivative_path(source_path, size, fmt)
+    if os.path.exists(target_path):
+        return target_path
+
+    future = _pending.get(target_path)
+    if future is None:
+        pil_format, _ = FORMATS[fmt]
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            _get_executor(), _render,
+            source_path, target_path, SIZES[size], pil_format, settings.IMAGE_QUALITY
+        )
+        _pending[target_path] = future
+        future.add_done_callback(lambda _: _pending.pop(target_path, None))
+
+    await asyncio.shield(future)
+    return target_path
+
+
+async def generate_derivatives(paths: List[str]):
+    """Pre-render the WebP sizes for freshly uploaded images (background task)"""
+    for path in paths:
+        file_type, filename = path.split("/", 1)
+        source_path = storage.resolve_file(file_type, filename)
+        if not source_path or not is_image(filename):
+            continue
+        for size in SIZES:
+            try:
+                await get_derivative(source_path, size, "webp")
+            except Exception as e:
+                logger.warning(f"Failed to render {size} derivative of {path}: {e}")
+                break
@@ -1,6 +1,9 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .database import init_db
+from . import images, outbox, reports
+from .email_service import smtp_pool
 from .routers import expenses, admin
 from .config import settings
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -20,7 +23,8 @@ app.add_middleware(
     allow_origins=[settings.FRONTEND_URL, "http://localhost:3000", "http://localhost:5173"],
     allow_credentials=True,
     allow_methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "Last-Event-ID"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Security headers middleware
@@ -32,10 +36,33 @@ async def add_security_headers(request: Request, call_next):
     response.headers["X-XSS-Protection"] = "1; mode=block"
     return response
 
+# Reject oversized uploads from Content-Length, before the body is read or spooled to disk
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_REQUEST_SIZE:
+        return JSONResponse(status_code=413, content={"detail": "Request too large"})
+    return await call_next(request)
+
 # Initialize database
 @app.on_event("startup")
 def startup_event():
     init_db()
+    images.check_support()
+
+@app.on_event("startup")
+async def start_outbox():
+    outbox.start()
+
+@app.on_event("shutdown")
+async def stop_outbox():
+    await outbox.stop()
+    await smtp_pool.close()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    images.shutdown()
+    reports.shutdown()
 
 # Include routers
 app.include_router(expenses.router)
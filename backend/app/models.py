@@ -1,11 +1,27 @@
-from sqlalchemy import Column, String, DateTime, Boolean, Numeric, Text
+from sqlalchemy import Column, String, DateTime, Boolean, Numeric, Text, Integer, ForeignKey, Index, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
 import secrets
 
 Base = declarative_base()
 
+# ExpenseFile.kind values
+FILE_KIND_PHOTO = "photo"
+FILE_KIND_ATTACHMENT = "attachment"
+
+# OutboxMessage.kind values (senders in outbox.py)
+OUTBOX_EMAIL_NEW_EXPENSE = "email.new_expense"
+OUTBOX_EMAIL_STATUS_UPDATE = "email.status_update"
+OUTBOX_DM_SUBMITTED = "dm.submitted"
+OUTBOX_DM_STATUS_CHANGE = "dm.status_change"
+
+# OutboxMessage.status values
+OUTBOX_PENDING = "pending"
+OUTBOX_SENT = "sent"
+OUTBOX_DEAD = "dead"
+
 def generate_view_token():
     return secrets.token_urlsafe(32)
 
@@ -22,7 +38,6 @@ class ExpenseNote(Base):
     description = Column(Text, nullable=False)
     amount = Column(Numeric(10, 2), nullable=False)
     member_email = Column(String(255), nullable=False)
-    photo_paths = Column(Text, nullable=True)  # Comma-separated file paths
     signature_path = Column(String(500), nullable=True)
     mattermost_username = Column(String(255), nullable=True)  # From access token
     payment_method = Column(String(50), nullable=True, default='iban')  # iban, cash
@@ -36,7 +51,6 @@ class ExpenseNote(Base):
     paid_to = Column(String(255), nullable=True)
     financial_responsible = Column(String(255), nullable=True)
     signature_financial_path = Column(String(500), nullable=True)
-    attachment_paths = Column(Text, nullable=True)  # Comma-separated admin file paths
 
     # Metadata
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -44,6 +58,146 @@ class ExpenseNote(Base):
     admin_notes = Column(Text, nullable=True)
     deleted = Column(Boolean, default=False)
 
+    # Keyset pagination indexes for the admin list (ORDER BY created_at DESC, id DESC).
+    # Partial indexes cover the default "not deleted" views; keep in sync with migrate.py
+    __table_args__ = (
+        Index('ix_expense_notes_created_at_id', 'created_at', 'id'),
+        Index('ix_expense_notes_active_created_at_id', 'created_at', 'id',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_active_status_created_at_id', 'status', 'created_at', 'id',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_deleted_created_at_id', 'created_at', 'id',
+              sqlite_where=text('deleted = 1')),
+        # Structured list filters (crud.ExpenseNoteFilter) on active expenses
+        Index('ix_expense_notes_active_username_created_at_id', 'mattermost_username', 'created_at', 'id',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_active_payment_method_created_at_id', 'payment_method', 'created_at', 'id',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_active_paid_from_pay_date', 'paid_from', 'pay_date',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_active_date_entered', 'date_entered',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_active_pay_date', 'pay_date',
+              sqlite_where=text('deleted = 0')),
+        Index('ix_expense_notes_active_amount', 'amount',
+              sqlite_where=text('deleted = 0')),
+    )
+
+    # Uploaded photos and admin attachments. The legacy comma-separated
+    # photo_paths/attachment_paths columns stay in old databases but are no
+    # longer mapped; migrate.py backfills them into expense_files.
+    files = relationship(
+        "ExpenseFile",
+        back_populates="expense",
+        lazy="selectin",
+        order_by="ExpenseFile.id",
+    )
+
+    def _joined_paths(self, kind: str):
+        paths = [f.path for f in self.files if f.kind == kind]
+        return ",".join(paths) if paths else None
+
+    @property
+    def photo_paths(self):
+        """Comma-separated photo paths (kept for API compatibility)"""
+        return self._joined_paths(FILE_KIND_PHOTO)
+
+    @property
+    def attachment_paths(self):
+        """Comma-separated admin attachment paths (kept for API compatibility)"""
+        return self._joined_paths(FILE_KIND_ATTACHMENT)
+
+class ExpenseFile(Base):
+    __tablename__ = "expense_files"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    expense_id = Column(String(36), ForeignKey("expense_notes.id"), nullable=False)
+    kind = Column(String(20), nullable=False)  # photo, attachment
+    path = Column(String(500), nullable=False)  # Logical path, e.g. photos/<sha256>.jpg (see storage.py)
+    original_filename = Column(String(255), nullable=True)
+    size = Column(Integer, nullable=True)
+    mime_type = Column(String(100), nullable=True)
+    sha256 = Column(String(64), nullable=True)
+    original_sha256 = Column(String(64), nullable=True)  # Unprocessed upload, if KEEP_ORIGINAL_UPLOADS
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    expense = relationship("ExpenseNote", back_populates="files")
+
+    # Keep in sync with migrate.py
+    __table_args__ = (
+        Index('ix_expense_files_expense_id_kind', 'expense_id', 'kind'),
+        Index('ix_expense_files_expense_id_path', 'expense_id', 'path', unique=True),
+    )
+
+class StoredBlob(Base):
+    """
+    A file in the content-addressed upload store, shared by every ExpenseFile
+    with the same sha256. Blobs whose ref_count drops to 0 are removed by
+    crud.delete_unreferenced_blobs.
+    """
+    __tablename__ = "stored_blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=True)
+    mime_type = Column(String(100), nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class OutboxMessage(Base):
+    """
+    A notification (email or Mattermost DM) to send, written by crud in the
+    same transaction as the expense change that triggers it and delivered by
+    the dispatcher in outbox.py. Messages that keep failing end up "dead".
+    A dispatcher claims a message (claimed_until) before sending it, so
+    several processes can share the queue without sending anything twice.
+    """
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON keyword arguments of the sender
+    expense_id = Column(String(36), nullable=True)
+    status = Column(String(20), nullable=False, default=OUTBOX_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    claimed_until = Column(DateTime, nullable=True)  # Lease of the dispatcher sending it
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    # Keep in sync with migrate.py
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+class ExpenseRollup(Base):
+    """
+    Pre-aggregated counts and totals of non-deleted expenses, one row per
+    (status, month, payment_method, paid_from). Maintained by crud in the same
+    transaction as every expense write; see crud.rebuild_expense_rollups.
+    """
+    __tablename__ = "expense_rollups"
+
+    status = Column(String(20), primary_key=True)
+    month = Column(String(7), primary_key=True)  # YYYY-MM of date_entered
+    payment_method = Column(String(50), primary_key=True)  # '' when unset
+    paid_from = Column(String(100), primary_key=True)  # '' when unset
+    count = Column(Integer, nullable=False, default=0)
+    total_cents = Column(Integer, nullable=False, default=0)
+
+class MemberLedger(Base):
+    """
+    Per-member counts and totals of non-deleted expenses by status, keyed on
+    the Mattermost username. Maintained alongside ExpenseRollup.
+    """
+    __tablename__ = "member_ledgers"
+
+    mattermost_username = Column(String(255), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total_cents = Column(Integer, nullable=False, default=0)
+
 # DEPRECATED: AdminUser table no longer used
 # Auth now uses ADMIN_PASSWORD env var directly
 # Table kept for backward compatibility with existing databases
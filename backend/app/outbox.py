@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from .bot_notification import notify_expense_status_change, notify_expense_submitted
+from .config import settings
+from .crud import (
+    get_due_outbox_messages, get_next_outbox_attempt, claim_outbox_message, mark_outbox_message_sent,
+    mark_outbox_message_failed, delete_sent_outbox_messages
+)
+from .database import SessionLocal
+from .email_service import EmailService
+from .models import (
+    OUTBOX_EMAIL_NEW_EXPENSE, OUTBOX_EMAIL_STATUS_UPDATE, OUTBOX_DM_SUBMITTED, OUTBOX_DM_STATUS_CHANGE
+)
+
+logger = logging.getLogger(__name__)
+
+# Delivery of queued notifications (models.OutboxMessage).
+#
+# crud writes outbox rows in the same transaction as the expense change, so a
+# notification exists if and only if the change committed; request handlers
+# then only call wake(). One dispatcher task per process polls for due
+# messages, sends up to NOTIFY_CONCURRENCY at a time and reschedules failures
+# with exponential backoff until OUTBOX_MAX_ATTEMPTS, after which the message
+# is dead-lettered for an admin to inspect and retry.
+#
+# Right before sending, a dispatcher claims the message with a lease
+# (crud.claim_outbox_message, a conditional UPDATE), so several workers or
+# processes, or an old and a new process overlapping during a restart, never
+# send the same message concurrently. The lease outlives the send timeout; it
+# only runs out if the process died mid-send, and then the message is sent
+# again. Delivery is therefore at least once.
+
+
+async def _send_new_expense_email(expense_id: str, member_name: str, amount: float):
+    await EmailService.send_new_expense_notification(expense_id, member_name, amount)
+
+
+async def _send_status_update_email(**payload):
+    await EmailService.send_status_update(**payload)
+
+
+async def _send_submitted_dm(username: str, amount: float, description: str, view_token: Optional[str]):
+    view_url = f"{settings.FRONTEND_URL}/view/{view_token}" if view_token else None
+    if not await notify_expense_submitted(username, amount, description, view_url):
+        raise RuntimeError(f"Bot did not deliver DM to {username}")
+
+
+async def _send_status_change_dm(username: str, **payload):
+    if not await notify_expense_status_change(username, **payload):
+        raise RuntimeError(f"Bot did not deliver DM to {username}")
+
+
+SENDERS = {
+    OUTBOX_EMAIL_NEW_EXPENSE: _send_new_expense_email,
+    OUTBOX_EMAIL_STATUS_UPDATE: _send_status_update_email,
+    OUTBOX_DM_SUBMITTED: _send_submitted_dm,
+    OUTBOX_DM_STATUS_CHANGE: _send_status_change_dm,
+}
+
+# Messages picked up per poll, beyond those already being sent
+BATCH_SIZE = 50
+# How long a claim outlasts the send timeout before another dispatcher may take over
+LEASE_MARGIN = timedelta(seconds=60)
+PRUNE_INTERVAL = timedelta(hours=1)
+
+_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+_deliveries: "set[asyncio.Task]" = set()
+_in_flight: "set[int]" = set()
+
+
+def _with_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff after the given number of failed attempts, with +-20% jitter"""
+    delay = min(settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+async def _deliver(message_id: int, kind: str, payload: str, attempts: int, semaphore: asyncio.Semaphore):
+    try:
+        async with semaphore:
+            # Claimed only now, so the lease doesn't run out while we queue for the semaphore
+            lease = timedelta(seconds=settings.OUTBOX_SEND_TIMEOUT) + LEASE_MARGIN
+            if not await run_in_threadpool(_with_session, claim_outbox_message, message_id, lease):
+                return  # Another dispatcher has it, or it was sent meanwhile
+            sender = SENDERS.get(kind)
+            try:
+                if sender is None:
+                    raise ValueError(f"Unknown outbox message kind {kind!r}")
+                await asyncio.wait_for(sender(**json.loads(payload)), timeout=settings.OUTBOX_SEND_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempts += 1
+                error = f"{type(e).__name__}: {e}"
+                if sender is None or attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    logger.error(f"Outbox message {message_id} ({kind}) dead after {attempts} attempts: {error}")
+                    next_attempt_at = None
+                else:
+                    next_attempt_at = datetime.utcnow() + retry_delay(attempts)
+                    logger.warning(f"Outbox message {message_id} ({kind}) failed, retrying at {next_attempt_at}: {error}")
+                await run_in_threadpool(_with_session, mark_outbox_message_failed, message_id, error, next_attempt_at)
+            else:
+                await run_in_threadpool(_with_session, mark_outbox_message_sent, message_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to record outcome of outbox message {message_id}: {e}")
+    finally:
+        _in_flight.discard(message_id)
+        wake()
+
+
+async def _dispatch_due(semaphore: asyncio.Semaphore):
+    if len(_in_flight) >= BATCH_SIZE:
+        return
+    messages = await run_in_threadpool(
+        _with_session, get_due_outbox_messages, BATCH_SIZE - len(_in_flight), list(_in_flight)
+    )
+    for message in messages:
+        _in_flight.add(message.id)
+        task = asyncio.create_task(_deliver(message.id, message.kind, message.payload, message.attempts, semaphore))
+        _deliveries.add(task)
+        task.add_done_callback(_deliveries.discard)
+
+
+async def _next_wait() -> float:
+    """Seconds until the next retry is due (capped at the poll interval)"""
+    next_attempt_at = await run_in_threadpool(_with_session, get_next_outbox_attempt)
+    if next_attempt_at is None:
+        return settings.OUTBOX_POLL_SECONDS
+    wait = (next_attempt_at - datetime.utcnow()).total_seconds()
+    # Due but not picked up: it's being sent, and the delivery will wake us
+    if wait <= 0:
+        return settings.OUTBOX_POLL_SECONDS
+    return min(wait, settings.OUTBOX_POLL_SECONDS)
+
+
+async def _run():
+    semaphore = asyncio.Semaphore(settings.NOTIFY_CONCURRENCY)
+    last_prune = datetime.min
+    while True:
+        _wake.clear()
+        wait = settings.OUTBOX_POLL_SECONDS
+        try:
+            await _dispatch_due(semaphore)
+            if datetime.utcnow() - last_prune > PRUNE_INTERVAL:
+                last_prune = datetime.utcnow()
+                cutoff = last_prune - timedelta(days=settings.OUTBOX_RETENTION_DAYS)
+                pruned = await run_in_threadpool(_with_session, delete_sent_outbox_messages, cutoff)
+                if pruned:
+                    logger.info(f"Pruned {pruned} sent outbox messages")
+            wait = await _next_wait()
+        except Exception as e:
+            logger.error(f"Outbox dispatcher error: {e}")
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+
+
+def wake():
+    """Have the dispatcher look for due messages now (after committing new ones)"""
+    if _wake is not None:
+        _wake.set()
+
+
+def start():
+    global _task, _wake
+    _wake = asyncio.Event()
+    _task = asyncio.create_task(_run())
+
+
+async def stop():
+    """Cancel the dispatcher and unfinished sends; they stay pending for the next start"""
+    global _task
+    tasks = list(_deliveries) + ([_task] if _task else [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _task = None
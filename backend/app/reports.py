@@ -0,0 +1,370 @@
+import asyncio
+import glob
+import logging
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Set
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+from .config import settings
+from .models import ExpenseNote
+from . import images, storage
+
+logger = logging.getLogger(__name__)
+
+# Server-side PDF expense reports. Every expense is rendered to its own PDF
+# fragment, cached under reports/<expense id>/ and keyed by updated_at, so
+# re-exporting a period after one edit only re-renders that expense. The cover
+# page is rendered per report and the fragments are concatenated behind it.
+# All rendering runs in a process pool. Fragments are never deleted while a
+# report may still append them: earlier versions and fragments of deleted
+# expenses are dropped by the storage GC once they are old (sweep_fragments).
+
+REPORTS_DIR = "reports"
+FRAGMENT_VERSION = 1  # Bump when the fragment layout changes
+
+MARGIN = 40
+LINE_HEIGHT = 12
+MAX_IMAGE_HEIGHT = 350
+GRAY = colors.Color(0.4, 0.4, 0.4)
+LIGHT_GRAY = colors.Color(0.8, 0.8, 0.8)
+STATUS_COLORS = {
+    "pending": colors.Color(0.9, 0.7, 0.1),
+    "paid": colors.Color(0.2, 0.7, 0.3),
+    "denied": colors.Color(0.8, 0.2, 0.2),
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.REPORT_WORKERS)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _safe(value) -> str:
+    """Text the standard PDF fonts can draw (WinAnsi); drops emoji and the like"""
+    if value is None:
+        return ""
+    return str(value).encode("cp1252", "ignore").decode("cp1252")
+
+
+def _euro(amount) -> str:
+    return f"€{Decimal(amount or 0):.2f}"
+
+
+def _fragments_dir(expense_id: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, REPORTS_DIR, expense_id)
+
+
+def fragment_path(expense: ExpenseNote) -> str:
+    stamp = (expense.updated_at or expense.created_at).strftime("%Y%m%d%H%M%S%f")
+    return os.path.join(_fragments_dir(expense.id), f"v{FRAGMENT_VERSION}-{stamp}.pdf")
+
+
+def sweep_fragments(live_ids: Set[str], grace_seconds: int = 3600) -> int:
+    """
+    Remove cached fragments of expenses not in live_ids (deleted or gone) and
+    earlier versions of the others, and return how many fragments were removed.
+    The newest fragment of a live expense is always kept; fragments written
+    within grace_seconds are kept too, as a running report may append them.
+    """
+    root = os.path.join(settings.UPLOAD_DIR, REPORTS_DIR)
+    try:
+        entries = [entry for entry in os.scandir(root) if entry.is_dir()]
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for entry in entries:
+        fragments = sorted(glob.glob(os.path.join(entry.path, "*.pdf")), key=os.path.getmtime)
+        if entry.name in live_ids:
+            fragments = fragments[:-1]
+        for path in fragments:
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if entry.name not in live_ids and not os.listdir(entry.path):
+            os.rmdir(entry.path)
+    return removed
+
+
+def _expense_data(expense: ExpenseNote) -> dict:
+    """Picklable snapshot of an expense for the worker processes"""
+    files = []
+    for f in expense.files:
+        file_type, filename = f.path.split("/", 1)
+        files.append({
+            "name": f.original_filename or filename,
+            "source": storage.resolve_file(file_type, filename),
+            "is_image": images.is_image(filename),
+            "is_pdf": filename.lower().endswith(".pdf"),
+        })
+    return {
+        "member_name": expense.member_name or expense.mattermost_username,
+        "member_email": expense.member_email,
+        "description": expense.description,
+        "amount": expense.amount,
+        "status": expense.status,
+        "date_entered": expense.date_entered,
+        "pay_date": expense.pay_date,
+        "paid_from": expense.paid_from,
+        "paid_to": expense.paid_to,
+        "financial_responsible": expense.financial_responsible,
+        "admin_notes": expense.admin_notes,
+        "files": files,
+    }
+
+
+def _draw_footer(c: canvas.Canvas, expense: dict):
+    c.setFont("Helvetica", 8)
+    c.setFillColor(GRAY)
+    c.drawString(MARGIN, 20, f"{_safe(expense['member_name'])} — {expense['date_entered']:%Y/%m/%d}")
+    c.setFillColor(colors.black)
+
+
+def _draw_wrapped(c: canvas.Canvas, text: str, x: float, y: float, width: float, size: int) -> float:
+    c.setFont("Helvetica", size)
+    for line in simpleSplit(_safe(text), "Helvetica", size, width):
+        c.drawString(x, y, line)
+        y -= LINE_HEIGHT
+    return y
+
+
+def _render_fragment(expense: dict, target_path: str):
+    """Render one expense with its images and attached PDFs (runs in a worker process)"""
+    width, height = A4
+    content_width = width - 2 * MARGIN
+    temp_path = f"{target_path}.{secrets.token_hex(8)}.part"
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+    # Open attached PDFs first so the page can say how many pages follow
+    attached = []
+    for f in expense["files"]:
+        if f["is_pdf"] and f["source"]:
+            try:
+                attached.append((f, len(PdfReader(f["source"]).pages)))
+            except Exception:
+                attached.append((f, None))
+
+    c = canvas.Canvas(temp_path, pagesize=A4)
+    y = height - MARGIN
+    c.setLineWidth(2)
+    c.setStrokeColor(colors.Color(0.2, 0.2, 0.2))
+    c.line(MARGIN, y, width - MARGIN, y)
+    y -= 20
+
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(MARGIN, y, _safe(expense["member_name"]))
+    c.drawRightString(width - MARGIN, y, _euro(expense["amount"]))
+    y -= 16
+    c.setFont("Helvetica", 9)
+    c.setFillColor(GRAY)
+    c.drawString(MARGIN, y, _safe(expense["member_email"]))
+    c.drawRightString(width - MARGIN, y, f"{expense['date_entered']:%Y/%m/%d}")
+    c.setFillColor(colors.black)
+    y -= 20
+
+    y = _draw_wrapped(c, expense["description"], MARGIN, y, content_width, 10) - 10
+
+    c.setFont("Helvetica-Bold", 10)
+    c.setFillColor(STATUS_COLORS.get(expense["status"], colors.black))
+    c.drawString(MARGIN, y, _safe(expense["status"]).upper())
+    c.setFillColor(colors.black)
+    y -= 18
+
+    if expense["status"] != "pending":
+        fields = [
+            ("Pay Date", expense["pay_date"] and f"{expense['pay_date']:%Y/%m/%d}"),
+            ("From", expense["paid_from"]),
+            ("To", expense["paid_to"]),
+            ("Responsible", expense["financial_responsible"]),
+        ]
+        fields = [(label, value) for label, value in fields if value]
+        for i, (label, value) in enumerate(fields):
+            x = MARGIN + (content_width / 2 if i % 2 else 0)
+            c.setFont("Helvetica-Bold", 9)
+            c.setFillColor(GRAY)
+            c.drawString(x, y, f"{label}: ")
+            c.setFillColor(colors.black)
+            c.setFont("Helvetica", 9)
+            c.drawString(x + c.stringWidth(f"{label}: ", "Helvetica", 9), y, _safe(value))
+            if i % 2 or i == len(fields) - 1:
+                y -= LINE_HEIGHT
+        if expense["admin_notes"]:
+            y -= 5
+            c.setFont("Helvetica-Bold", 9)
+            c.setFillColor(GRAY)
+            c.drawString(MARGIN, y, "Message: ")
+            c.setFillColor(colors.black)
+            label_width = c.stringWidth("Message: ", "Helvetica", 9)
+            y = _draw_wrapped(c, expense["admin_notes"], MARGIN + label_width, y, content_width - 40, 9)
+    y -= 10
+
+    if expense["files"]:
+        c.setLineWidth(0.5)
+        c.setStrokeColor(LIGHT_GRAY)
+        c.line(MARGIN, y, width - MARGIN, y)
+        y -= 15
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(MARGIN, y, "Attachments")
+        y -= 15
+
+    for f in expense["files"]:
+        if f["is_pdf"]:
+            continue
+        if not f["is_image"] or not f["source"]:
+            c.setFont("Helvetica", 9)
+            c.drawString(MARGIN + 5, y, f"{_safe(f['name'])} (missing)" if not f["source"] else _safe(f["name"]))
+            y -= LINE_HEIGHT
+            continue
+        try:
+            image = ImageReader(images.render_derivative(f["source"], "preview", "jpeg"))
+            image_width, image_height = image.getSize()
+            scale = min(content_width / image_width, MAX_IMAGE_HEIGHT / image_height, 1)
+            draw_width, draw_height = image_width * scale, image_height * scale
+            if y - draw_height < MARGIN + 30:
+                _draw_footer(c, expense)
+                c.showPage()
+                y = height - MARGIN
+            c.drawImage(image, MARGIN, y - draw_height, draw_width, draw_height)
+            y -= draw_height + 10
+        except Exception:
+            c.setFont("Helvetica", 9)
+            c.setFillColor(STATUS_COLORS["denied"])
+            c.drawString(MARGIN + 5, y, f"{_safe(f['name'])} (embed failed)")
+            c.setFillColor(colors.black)
+            y -= LINE_HEIGHT
+
+    c.setFont("Helvetica", 9)
+    for f, page_count in attached:
+        if page_count is None:
+            c.setFillColor(STATUS_COLORS["denied"])
+            c.drawString(MARGIN + 5, y, f"{_safe(f['name'])} (merge failed)")
+            c.setFillColor(colors.black)
+        else:
+            c.setFillColor(GRAY)
+            c.drawString(MARGIN + 5, y, f"{_safe(f['name'])} ({page_count} page{'s' if page_count > 1 else ''} follow)")
+            c.setFillColor(colors.black)
+        y -= LINE_HEIGHT
+
+    _draw_footer(c, expense)
+    c.save()
+
+    try:
+        if any(page_count for _, page_count in attached):
+            writer = PdfWriter()
+            writer.append(temp_path)
+            for f, page_count in attached:
+                if page_count:
+                    writer.append(f["source"])
+            writer.write(temp_path)
+        os.replace(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _render_report(cover: dict, fragment_paths: List[str], target_path: str):
+    """Render the cover page and append the cached fragments (runs in a worker process)"""
+    width, height = A4
+    cover_path = f"{target_path}.cover"
+    c = canvas.Canvas(cover_path, pagesize=A4)
+    y = height - 80
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(MARGIN, y, "Expense Report")
+    y -= 30
+    c.setFont("Helvetica", 12)
+    c.setFillColor(GRAY)
+    c.drawString(MARGIN, y, cover["period"])
+    c.setFillColor(colors.black)
+    y -= 40
+
+    c.setStrokeColor(LIGHT_GRAY)
+    c.rect(MARGIN, y - 80, width - 2 * MARGIN, 90)
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(MARGIN + 10, y - 5, "Summary")
+    y -= 25
+    c.setFont("Helvetica", 10)
+    c.drawString(MARGIN + 10, y, f"Total Expenses: {cover['count']}")
+    y -= 15
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(MARGIN + 10, y, f"Total Amount: {_euro(cover['total'])}")
+    y -= 15
+    c.setFont("Helvetica", 10)
+    c.drawString(MARGIN + 10, y, "Status: " + "  |  ".join(f"{s}: {n}" for s, n in cover["status_counts"].items()))
+    y -= 50
+
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(MARGIN, y, "Contents")
+    y -= 18
+    for line in cover["contents"]:
+        if y < 50:
+            c.showPage()
+            y = height - MARGIN
+        c.setFont("Helvetica", 9)
+        c.drawString(MARGIN + 10, y, _safe(line))
+        y -= 14
+    c.save()
+
+    try:
+        writer = PdfWriter()
+        writer.append(cover_path)
+        for path in fragment_paths:
+            writer.append(path)
+        writer.write(target_path)
+    finally:
+        os.remove(cover_path)
+
+
+async def build_report(expenses: List[ExpenseNote], period: str) -> str:
+    """
+    Render a PDF report of expenses into a temp file and return its path.
+    Only expenses without a cached fragment for their current updated_at are rendered.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+
+    fragment_paths = [fragment_path(e) for e in expenses]
+    missing = [(e, path) for e, path in zip(expenses, fragment_paths) if not os.path.exists(path)]
+    logger.info(f"PDF report: {len(expenses)} expenses, rendering {len(missing)} fragments")
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, _render_fragment, _expense_data(e), path) for e, path in missing
+    ))
+
+    status_counts = {}
+    for e in expenses:
+        status_counts[e.status] = status_counts.get(e.status, 0) + 1
+    cover = {
+        "period": period,
+        "count": len(expenses),
+        "total": sum((Decimal(e.amount) for e in expenses), Decimal(0)),
+        "status_counts": status_counts,
+        "contents": [
+            f"{i}. {e.member_name or e.mattermost_username or ''} — {_euro(e.amount)} — {e.status}"
+            for i, e in enumerate(expenses, 1)
+        ],
+    }
+
+    target_path = storage.temp_path(f"report-{datetime.utcnow():%Y%m%d%H%M%S}-{secrets.token_hex(8)}.pdf")
+    await loop.run_in_executor(executor, _render_report, cover, fragment_paths, target_path)
+    return target_path
@@ -0,0 +1,21 @@
+from decimal import Decimal
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _orjson_default(value):
+    # Same representation pydantic uses for Decimal in JSON mode
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson. Accepts plain dicts/lists holding
+    datetimes and Decimals directly, so list endpoints can skip building
+    pydantic models per row.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_orjson_default)
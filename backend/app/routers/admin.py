@@ -1,25 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form, Request, Response, Query
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import timedelta
+import asyncio
 import os
+import shutil
 import logging
 
 logger = logging.getLogger(__name__)
 
 from ..database import get_db
 from ..schemas import (
-    AdminLogin, Token, ExpenseNoteResponse, ExpenseNoteUpdate
+    AdminLogin, Token, ExpenseNoteResponse, ExpenseNoteUpdate, ExpenseNoteFilter,
+    ExpenseSummary, ExpenseNoteBulkUpdate, ExpenseNoteBulkResult, ExpenseReportRequest,
+    OutboxMessageResponse
 )
 from ..crud import (
-    get_all_expense_notes, get_expense_note, update_expense_note,
-    update_expense_file_paths
+    get_all_expense_notes, get_expense_note, get_expense_note_version, update_expense_note,
+    add_expense_files, delete_expense_file, encode_cursor, set_expense_note_deleted,
+    search_expense_notes, encode_search_cursor, explain_expense_notes_query,
+    get_expense_summary, rebuild_expense_rollups, check_expense_rollups,
+    bulk_update_expense_notes, delete_unreferenced_blobs, get_expenses_for_report, get_live_expense_ids,
+    get_outbox_messages, count_outbox_messages, retry_outbox_message
 )
+from ..models import FILE_KIND_ATTACHMENT
 from ..auth import authenticate_admin, create_access_token, get_current_admin
-from ..email_service import EmailService
-from ..bot_notification import notify_expense_status_change
 from ..config import settings
+from .. import conditional, events, exports, images, outbox, reports, storage
+from ..cache import generation, generation_etag, make_key, query_cache
+from ..responses import FastJSONResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
@@ -40,30 +52,344 @@ async def admin_login(request: Request, login_data: AdminLogin):
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Validate a ?fields= list against ExpenseNoteResponse; id is always included"""
+    if not fields:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in ExpenseNoteResponse.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + sorted(set(requested) - {"id"})
+
 @router.get("/expenses", response_model=List[ExpenseNoteResponse])
 async def list_expenses(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated subset of the response fields"),
+    explain: bool = False,
+    filters: ExpenseNoteFilter = Depends(),
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Get all expense notes (admin only)
+
+    Pass the X-Next-Cursor response header back as ?cursor= to fetch the next page.
+    With ?fields=id,status,amount only those columns are loaded and returned.
+    With ?explain=true, returns the SQL and query plan instead of the rows.
+    Answers 304 to a matching If-None-Match without touching the database.
+    """
+    field_names = _parse_fields(fields)
+    if explain:
+        try:
+            plan = await run_in_threadpool(
+                explain_expense_notes_query, db, skip=skip, limit=limit, status=status,
+                cursor=cursor, filters=filters
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return JSONResponse(plan)
+
+    # Read before querying, like computed_at: a write mid-query leaves the tag stale
+    etag = generation_etag()
+    if conditional.is_not_modified(request, etag):
+        return conditional.not_modified_response(etag, conditional.REVALIDATE_CACHE_CONTROL)
+
+    key = make_key(
+        "expenses", skip=skip, limit=limit, status=status, cursor=cursor,
+        fields=",".join(field_names) if field_names else None, **filters.model_dump()
+    )
+    cached = query_cache.get(key)
+    if cached is None:
+        computed_at = generation()
+        try:
+            expenses = await run_in_threadpool(
+                get_all_expense_notes, db, skip=skip, limit=limit, status=status,
+                cursor=cursor, filters=filters, fields=field_names
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        next_cursor = encode_cursor(expenses[-1]) if expenses and len(expenses) == limit else None
+        if field_names:
+            # Plain attribute reads; FastJSONResponse handles datetime/Decimal
+            body = [{name: getattr(e, name) for name in field_names} for e in expenses]
+        else:
+            body = [ExpenseNoteResponse.model_validate(e).model_dump(mode="json") for e in expenses]
+        cached = query_cache.put(key, (body, next_cursor), computed_at)
+
+    body, next_cursor = cached
+    headers = {"ETag": etag, "Cache-Control": conditional.REVALIDATE_CACHE_CONTROL}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return FastJSONResponse(body, headers=headers)
+
+@router.get("/expenses/search", response_model=List[ExpenseNoteResponse])
+async def search_expenses(
+    response: Response,
+    q: str,
+    limit: int = 50,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    filters: ExpenseNoteFilter = Depends(),
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Full-text search expense notes, best match first (admin only)
+
+    Paginates like list_expenses: pass X-Next-Cursor back as ?cursor=.
+    """
+    try:
+        results = await run_in_threadpool(
+            search_expense_notes, db, q, limit=limit, status=status, cursor=cursor,
+            filters=filters
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if results and len(results) == limit:
+        last_expense, last_rank = results[-1]
+        response.headers["X-Next-Cursor"] = encode_search_cursor(last_rank, last_expense.id)
+    return [expense for expense, _ in results]
+
+@router.get("/events")
+async def expense_events(
+    request: Request,
+    last_event_id: Optional[str] = Query(None, description="Resume point, if the Last-Event-ID header can't be sent"),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Server-Sent Events stream of expense changes (admin only)
+
+    Events: expense.created, expense.updated, expense.deleted, expense.restored
+    and expense.files, each with the expense's list columns as data. Reconnect
+    with Last-Event-ID to receive what was missed; a "reset" event means the
+    gap couldn't be filled and the list should be refetched.
+    """
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(
+        events.broker.stream(resume_from),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/summary", response_model=ExpenseSummary)
+async def expense_summary(
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """Totals and counts of non-deleted expenses (admin only)"""
+    key = make_key("summary")
+    summary = query_cache.get(key)
+    if summary is None:
+        computed_at = generation()
+        summary = query_cache.put(key, await run_in_threadpool(get_expense_summary, db), computed_at)
+    return summary
+
+@router.get("/metrics")
+async def metrics(
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """Response cache and event feed counters, and outbox messages by status (admin only)"""
+    return {
+        "query_cache": query_cache.stats(),
+        "events": events.broker.stats(),
+        "outbox": await run_in_threadpool(count_outbox_messages, db),
+    }
+
+@router.get("/outbox", response_model=List[OutboxMessageResponse])
+async def list_outbox(
+    status: Optional[str] = Query(None, pattern="^(pending|sent|dead)$"),
+    limit: int = Query(100, le=1000),
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """Queued notifications, newest first; pending and dead ones by default (admin only)"""
+    return await run_in_threadpool(get_outbox_messages, db, status, limit)
+
+@router.post("/outbox/{message_id}/retry", response_model=OutboxMessageResponse)
+async def retry_outbox(
+    message_id: int,
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """Requeue a dead or pending notification with a fresh attempt budget (admin only)"""
+    message = await run_in_threadpool(retry_outbox_message, db, message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail="Outbox message not found or already sent")
+    outbox.wake()
+    return message
+
+@router.post("/summary/rebuild")
+async def rebuild_summary(
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """Recompute the summary rollups and member ledgers from scratch (admin only)"""
+    rows = await run_in_threadpool(rebuild_expense_rollups, db)
+    logger.info(f"Rebuilt expense rollups ({rows} rows)")
+    return {"message": "Summary rebuilt", "rows": rows}
+
+@router.get("/summary/check")
+async def check_summary(
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin)
 ):
-    """Get all expense notes (admin only)"""
-    expenses = get_all_expense_notes(db, skip=skip, limit=limit, status=status)
-    return expenses
+    """Compare the summary rollups and member ledgers with a full recount (admin only)"""
+    mismatches = await run_in_threadpool(check_expense_rollups, db)
+    if mismatches:
+        logger.warning(f"Expense rollups inconsistent: {len(mismatches)} rows differ")
+    return {"consistent": not mismatches, "mismatches": mismatches}
+
+@router.post("/reports/pdf")
+async def export_report_pdf(
+    report: ExpenseReportRequest,
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """Render a PDF report of the matching expenses with their receipts (admin only)"""
+    expenses = await run_in_threadpool(get_expenses_for_report, db, report, report.statuses)
+    if not expenses:
+        raise HTTPException(status_code=404, detail="No expenses found")
+
+    start = report.date_entered_from or expenses[0].date_entered
+    # date_entered_to is exclusive; show the last day it includes
+    end = report.date_entered_to - timedelta(microseconds=1) if report.date_entered_to else expenses[-1].date_entered
+    report_path = await reports.build_report(expenses, f"{start:%Y/%m/%d} — {end:%Y/%m/%d}")
+
+    return FileResponse(
+        report_path,
+        media_type="application/pdf",
+        filename=f"expense-report-{start:%Y-%m-%d}-to-{end:%Y-%m-%d}.pdf",
+        background=BackgroundTask(os.remove, report_path)
+    )
+
+@router.get("/export/zip")
+async def export_zip(
+    status: Optional[str] = None,
+    filters: ExpenseNoteFilter = Depends(),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Stream a ZIP of the matching expenses' photos and attachments with a
+    CSV and JSON manifest (admin only). Takes the same filters as the list.
+    """
+    return StreamingResponse(
+        exports.stream_zip_export(status, filters),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{exports.export_filename("zip")}"'}
+    )
+
+@router.get("/export/{export_format}")
+async def export_rows(
+    export_format: str,
+    status: Optional[str] = None,
+    filters: ExpenseNoteFilter = Depends(),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Stream every matching expense as csv, ndjson or parquet (admin only).
+    Takes the same filters as the list.
+    """
+    if export_format not in exports.ROW_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown export format")
+    if export_format == "parquet" and exports.pq is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed")
+
+    return StreamingResponse(
+        exports.stream_rows_export(export_format, status, filters),
+        media_type=exports.ROW_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{exports.export_filename(export_format)}"'}
+    )
+
+def _remove_blobs(hashes: List[str]) -> int:
+    """Remove collected blobs and their derivatives from the store; returns how many files were removed"""
+    removed = 0
+    for sha in hashes:
+        try:
+            shutil.rmtree(images.derived_dir(storage.blob_path(sha)), ignore_errors=True)
+            os.remove(storage.blob_path(sha))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Failed to remove blob {sha}: {e}")
+    return removed
+
+@router.post("/storage/gc")
+async def collect_unreferenced_blobs(
+    grace_seconds: int = Query(3600, ge=0),
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Remove stored files no expense references any more, and cached report
+    fragments of deleted expenses and earlier expense versions (admin only)
+    """
+    hashes = await run_in_threadpool(delete_unreferenced_blobs, db, grace_seconds)
+    removed = await run_in_threadpool(_remove_blobs, hashes)
+    live_ids = await run_in_threadpool(get_live_expense_ids, db)
+    fragments_removed = await run_in_threadpool(reports.sweep_fragments, live_ids, grace_seconds)
+    logger.info(f"Storage GC removed {removed} unreferenced blobs and {fragments_removed} stale report fragments")
+    return {"message": "Storage collected", "removed": removed, "fragments_removed": fragments_removed}
 
 @router.get("/expenses/{expense_id}", response_model=ExpenseNoteResponse)
 async def get_expense_details(
+    request: Request,
+    response: Response,
     expense_id: str,
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin)
 ):
-    """Get expense details (admin only)"""
-    expense = get_expense_note(db, expense_id)
+    """Get expense details (admin only); 304 if If-None-Match matches its updated_at"""
+    version = await run_in_threadpool(get_expense_note_version, db, expense_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    etag = conditional.version_etag(version)
+    if conditional.is_not_modified(request, etag):
+        return conditional.not_modified_response(etag, conditional.REVALIDATE_CACHE_CONTROL)
+
+    expense = await run_in_threadpool(get_expense_note, db, expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = conditional.REVALIDATE_CACHE_CONTROL
     return expense
 
+@router.post("/expenses/bulk", response_model=ExpenseNoteBulkResult)
+async def bulk_update_expenses(
+    bulk_update: ExpenseNoteBulkUpdate,
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Apply status, pay_date and paid_from to many expenses in one transaction (admin only)
+
+    Status notifications are queued in the same transaction and sent by the outbox.
+    """
+    changes = await run_in_threadpool(
+        bulk_update_expense_notes, db, bulk_update.ids, bulk_update.update
+    )
+
+    updated = [expense for expense, _ in changes]
+    found_ids = {expense.id for expense in updated}
+    not_found = [expense_id for expense_id in bulk_update.ids if expense_id not in found_ids]
+    if not_found:
+        logger.warning(f"Bulk update skipped {len(not_found)} unknown expenses")
+
+    outbox.wake()
+    for expense in updated:
+        events.publish("expense.updated", expense)
+
+    return {"updated": updated, "not_found": not_found}
+
 @router.patch("/expenses/{expense_id}", response_model=ExpenseNoteResponse)
 async def update_expense(
     expense_id: str,
@@ -71,48 +397,19 @@ async def update_expense(
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin)
 ):
-    """Update expense note (admin only)"""
-    expense = get_expense_note(db, expense_id)
-    if not expense:
+    """Update expense note (admin only); a status change queues notifications"""
+    updated_expense = await run_in_threadpool(update_expense_note, db, expense_id, expense_update)
+    if not updated_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    old_status = expense.status
-    updated_expense = update_expense_note(db, expense_id, expense_update)
-
-    # Send notifications if status changed
-    if expense_update.status and expense_update.status != old_status:
-        # Email notification
-        try:
-            await EmailService.send_status_update(
-                updated_expense.member_email,
-                updated_expense.member_name,
-                updated_expense.status,
-                float(updated_expense.amount),
-                updated_expense.description,
-                updated_expense.admin_notes
-            )
-        except Exception as e:
-            logger.error(f"Failed to send status update email to {updated_expense.member_email}: {e}")
-
-        # Mattermost DM notification
-        if updated_expense.mattermost_username:
-            try:
-                result = await notify_expense_status_change(
-                    updated_expense.mattermost_username,
-                    updated_expense.status,
-                    float(updated_expense.amount),
-                    updated_expense.description,
-                    updated_expense.admin_notes
-                )
-                if not result:
-                    logger.warning(f"DM notification returned false for {updated_expense.mattermost_username}")
-            except Exception as e:
-                logger.error(f"Failed to send DM notification to {updated_expense.mattermost_username}: {e}")
+    outbox.wake()
+    events.publish("expense.updated", updated_expense)
     return updated_expense
 
 @router.post("/expenses/{expense_id}/attachments")
 async def upload_admin_attachments(
     expense_id: str,
+    background_tasks: BackgroundTasks,
     attachments: List[UploadFile] = File(...),
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin)
@@ -120,29 +417,35 @@ async def upload_admin_attachments(
     """Upload admin attachments (admin only)"""
     from .expenses import save_upload_file
 
-    expense = get_expense_note(db, expense_id)
+    expense = await run_in_threadpool(get_expense_note, db, expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    # Get existing attachments
-    existing_paths = expense.attachment_paths.split(",") if expense.attachment_paths else []
-
-    # Upload new files
-    new_paths = []
-    for attachment in attachments:
-        if attachment.filename:
-            attachment_path = await save_upload_file(attachment, "attachments")
-            new_paths.append(attachment_path)
-
-    # Combine existing and new paths
-    all_paths = existing_paths + new_paths
-    attachment_paths = ",".join(all_paths)
+    # Upload new files concurrently
+    results = await asyncio.gather(
+        *(save_upload_file(attachment, "attachments") for attachment in attachments if attachment.filename),
+        return_exceptions=True
+    )
+    saved_files = [r for r in results if not isinstance(r, BaseException)]
+    failure = next((r for r in results if isinstance(r, BaseException)), None)
+    if failure:
+        # All or nothing: drop the files already saved unless something else references them
+        hashes = [sha for f in saved_files for sha in (f["sha256"], f["original_sha256"]) if sha]
+        collected = await run_in_threadpool(delete_unreferenced_blobs, db, 0, hashes)
+        await run_in_threadpool(_remove_blobs, collected)
+        raise failure
 
-    update_expense_file_paths(
-        db, expense_id, attachment_paths=attachment_paths
+    expense = await run_in_threadpool(
+        add_expense_files, db, expense_id, FILE_KIND_ATTACHMENT, saved_files
     )
 
-    return {"attachment_paths": attachment_paths, "new_files": new_paths}
+    background_tasks.add_task(images.generate_derivatives, [f["path"] for f in saved_files])
+    events.publish("expense.files", expense)
+
+    return {
+        "attachment_paths": expense.attachment_paths if expense else None,
+        "new_files": [f["path"] for f in saved_files]
+    }
 
 @router.delete("/expenses/{expense_id}/photos/{filename:path}")
 async def delete_photo(
@@ -152,43 +455,18 @@ async def delete_photo(
     current_admin = Depends(get_current_admin)
 ):
     """Delete a photo from an expense (admin only)"""
-    expense = get_expense_note(db, expense_id)
+    expense = await run_in_threadpool(get_expense_note, db, expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
     # Remove filename from photo_paths or attachment_paths
     # Note: filename may include directory like "photos/xyz.jpg"
-    # We need to normalize both the stored path and the incoming filename
-    photo_deleted = False
-
     # Normalize the filename (remove duplicate directory prefixes)
     normalized_filename = filename.replace('photos/photos/', 'photos/').replace('attachments/attachments/', 'attachments/')
 
-    if expense.photo_paths:
-        photos = [p.strip() for p in expense.photo_paths.split(",") if p.strip()]
-        original_count = len(photos)
-        # Filter out the photo that matches
-        photos = [p for p in photos if p != normalized_filename]
-        if len(photos) < original_count:
-            photo_deleted = True
-            photo_paths = ",".join(photos) if photos else ""
-            expense.photo_paths = photo_paths if photo_paths else None
-            db.commit()
-            db.refresh(expense)
-
-    if not photo_deleted and expense.attachment_paths:
-        attachments = [a.strip() for a in expense.attachment_paths.split(",") if a.strip()]
-        original_count = len(attachments)
-        # Filter out the attachment that matches
-        attachments = [a for a in attachments if a != normalized_filename]
-        if len(attachments) < original_count:
-            photo_deleted = True
-            attachment_paths = ",".join(attachments) if attachments else ""
-            expense.attachment_paths = attachment_paths if attachment_paths else None
-            db.commit()
-            db.refresh(expense)
-
-    if photo_deleted:
+    expense = await run_in_threadpool(delete_expense_file, db, expense_id, normalized_filename)
+    if expense:
+        events.publish("expense.files", expense)
         return {"message": "Photo deleted successfully", "expense": expense}
     else:
         logger.warning(f"Photo not found for deletion: {normalized_filename} in expense {expense_id}")
@@ -201,14 +479,12 @@ async def soft_delete_expense(
     current_admin = Depends(get_current_admin)
 ):
     """Soft delete an expense (admin only)"""
-    expense = get_expense_note(db, expense_id)
+    expense = await run_in_threadpool(set_expense_note_deleted, db, expense_id, True)
     if not expense:
         logger.warning(f"Attempted to delete non-existent expense: {expense_id}")
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    expense.deleted = True
-    db.commit()
-    db.refresh(expense)
+    events.publish("expense.deleted", expense)
     return {"message": "Expense deleted successfully"}
 
 @router.post("/expenses/{expense_id}/restore")
@@ -218,28 +494,29 @@ async def restore_expense(
     current_admin = Depends(get_current_admin)
 ):
     """Restore a deleted expense (admin only)"""
-    expense = get_expense_note(db, expense_id)
+    expense = await run_in_threadpool(set_expense_note_deleted, db, expense_id, False)
     if not expense:
         logger.warning(f"Attempted to restore non-existent expense: {expense_id}")
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    expense.deleted = False
-    db.commit()
-    db.refresh(expense)
+    events.publish("expense.restored", expense)
     return {"message": "Expense restored successfully"}
 
 @router.get("/files/{file_type}/{filename}")
 async def get_file(
+    request: Request,
     file_type: str,
     filename: str,
+    size: Optional[str] = Query(None, description="thumb, small or preview; images only"),
+    format: str = Query("webp", pattern="^(webp|jpeg)$"),
     current_admin = Depends(get_current_admin)
 ):
-    """Serve uploaded files (admin only)"""
-    if file_type not in ["photos", "signatures", "attachments"]:
-        raise HTTPException(status_code=400, detail="Invalid file type")
+    """Serve uploaded files, optionally resized (admin only)"""
+    from .expenses import serve_stored_file
 
-    file_path = os.path.join(settings.UPLOAD_DIR, file_type, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+    if file_type not in storage.FILE_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    if size and size not in images.SIZES:
+        raise HTTPException(status_code=400, detail="Invalid size")
 
-    return FileResponse(file_path)
+    return await serve_stored_file(request, file_type, filename, size, format)
@@ -1,19 +1,31 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from decimal import Decimal
 import aiofiles
+import aiofiles.os
+import asyncio
+import hashlib
+import mimetypes
 import os
+import secrets
 from datetime import datetime
 
-from ..database import get_db
-from ..schemas import ExpenseNoteCreate, ExpenseNoteResponse
-from ..crud import create_expense_note, update_expense_file_paths, get_expense_note as get_expense
-from ..email_service import EmailService
-from ..bot_notification import notify_expense_submitted
+from ..database import SessionLocal, get_db
+from ..schemas import ExpenseNoteCreate, ExpenseNoteResponse, ExpenseNoteFilter, MemberLedgerResponse
+from ..crud import (
+    create_expense_note, add_expense_files, get_expense_note_by_view_token, get_expense_file_by_view_token,
+    get_expense_note_version_by_view_token, get_member_ledger, get_all_expense_notes,
+    record_blobs
+)
+from ..models import FILE_KIND_PHOTO
 from ..config import settings
-from ..token_verification import verify_access_token
+from .. import conditional, events, images, outbox, storage, token_format
+from ..cache import generation, make_key, query_cache
+from ..token_verification import Keyring, VerifiedTokenCache, verify_access_token
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
@@ -22,6 +34,10 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/expenses", tags=["expenses"])
 limiter = Limiter(key_func=get_remote_address)
 
+# Bot public keys, parsed once (a malformed key fails startup, not each request)
+access_keyring = Keyring.parse(settings.ACCESS_TOKEN_PUBLIC_KEY) if settings.ACCESS_TOKEN_PUBLIC_KEY else None
+verified_tokens = VerifiedTokenCache(settings.ACCESS_TOKEN_CACHE_SIZE)
+
 
 async def verify_public_access(access: Optional[str] = Query(None)) -> Optional[dict]:
     """Verify access token for public endpoints"""
@@ -33,13 +49,16 @@ async def verify_public_access(access: Optional[str] = Query(None)) -> Optional[
         return None
 
     # Try to verify token if we have a public key
-    if not settings.ACCESS_TOKEN_PUBLIC_KEY:
+    if not access_keyring:
         if settings.ACCESS_TOKEN_REQUIRED:
             logger.error("Token verification required but public key not configured")
             raise HTTPException(status_code=500, detail="Server not configured for token verification")
         return None
 
-    payload = verify_access_token(access, settings.ACCESS_TOKEN_PUBLIC_KEY)
+    payload = verify_access_token(access, access_keyring, verified_tokens)
+    # Scoped tokens are for the bot's own calls, not for submitting
+    if payload and payload.get('s'):
+        payload = None
     if not payload:
         if settings.ACCESS_TOKEN_REQUIRED:
             logger.warning("Invalid or expired access token")
@@ -48,33 +67,162 @@ async def verify_public_access(access: Optional[str] = Query(None)) -> Optional[
 
     return payload
 
-async def save_upload_file(upload_file: UploadFile, subfolder: str) -> str:
-    """Save uploaded file and return relative path"""
+async def verify_member_access(access: str = Query(...)) -> str:
+    """
+    Require a valid member-scoped access token and return its Mattermost
+    username. Plain submission links (7 days, forwardable) are rejected.
+    """
+    payload = verify_access_token(access, access_keyring, verified_tokens) if access_keyring else None
+    scoped = payload and payload.get('s') == token_format.SCOPE_MEMBER
+    username = payload.get('u') if scoped else None
+    if not username or username == 'unknown':
+        logger.warning("Invalid or expired member access token")
+        raise HTTPException(status_code=401, detail="Invalid or expired access token")
+    return username
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ALLOWED_EXTENSIONS = images.allowed_extensions()
+
+def _with_session(fn, *args):
+    # Concurrent uploads each record their blobs in their own session
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def save_upload_file(upload_file: UploadFile, subfolder: str) -> dict:
+    """
+    Save uploaded file in the content-addressed store and return its ExpenseFile
+    fields (path, original_filename, size, mime_type, sha256, original_sha256)
+
+    The file is streamed to a temporary name in chunks, with the size limit and
+    SHA-256 checked along the way. Photos are then normalized (see
+    images.normalize_upload); attachments such as scanned invoices are kept
+    as uploaded. The result is recorded as an unreferenced blob (see
+    crud.record_blobs) and renamed to its hash. Content that is already
+    stored is not written twice.
+    """
     file_extension = upload_file.filename.split(".")[-1].lower()
-    if file_extension not in settings.ALLOWED_EXTENSIONS.split(","):
+    if file_extension not in ALLOWED_EXTENSIONS:
         logger.warning(f"Rejected file upload with invalid extension: {upload_file.filename}")
         raise HTTPException(status_code=400, detail="Invalid file type")
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{upload_file.filename}"
-    file_path = os.path.join(settings.UPLOAD_DIR, subfolder, filename)
+    if upload_file.size is not None and upload_file.size > settings.MAX_FILE_SIZE:
+        logger.warning(f"Rejected file upload exceeding size limit: {upload_file.filename} ({upload_file.size} bytes)")
+        raise HTTPException(status_code=400, detail="File too large")
+
+    temp_path = storage.temp_path(f"{secrets.token_hex(16)}.part")
+    normalized = None
 
+    digest = hashlib.sha256()
+    size = 0
     try:
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            content = await upload_file.read()
-            if len(content) > settings.MAX_FILE_SIZE:
-                logger.warning(f"Rejected file upload exceeding size limit: {upload_file.filename} ({len(content)} bytes)")
-                raise HTTPException(status_code=400, detail="File too large")
-            await out_file.write(content)
-        return f"{subfolder}/{filename}"
+        async with aiofiles.open(temp_path, 'wb') as out_file:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.MAX_FILE_SIZE:
+                    logger.warning(f"Rejected file upload exceeding size limit: {upload_file.filename} (>{size} bytes)")
+                    raise HTTPException(status_code=400, detail="File too large")
+                digest.update(chunk)
+                await out_file.write(chunk)
+
+        sha256 = digest.hexdigest()
+        original = None
+        if subfolder == "photos":
+            normalized = await images.normalize_upload(temp_path, file_extension)
+        if normalized:
+            logger.info(f"Normalized {upload_file.filename}: {size} -> {normalized['size']} bytes")
+            if settings.KEEP_ORIGINAL_UPLOADS:
+                original = {"sha256": sha256, "size": size, "mime_type": upload_file.content_type}
+            sha256, size, file_extension = normalized["sha256"], normalized["size"], normalized["extension"]
+
+        path = storage.logical_path(subfolder, sha256, file_extension)
+        stored = {"sha256": sha256, "size": size, "mime_type": mimetypes.guess_type(path)[0] or upload_file.content_type}
+
+        # Recorded before the files enter the store, so storage GC can collect
+        # them if this upload is never attached to an expense
+        await run_in_threadpool(_with_session, record_blobs, [stored] + ([original] if original else []))
+        if original:
+            await storage.commit_blob(temp_path, original["sha256"])
+        await storage.commit_blob(normalized["temp_path"] if normalized else temp_path, sha256)
+
+        return {
+            "path": path,
+            "original_filename": os.path.basename(upload_file.filename),
+            "size": size,
+            "mime_type": stored["mime_type"],
+            "sha256": sha256,
+            "original_sha256": original and original["sha256"],
+        }
+    except images.InvalidImage as e:
+        logger.warning(f"Rejected invalid image upload {upload_file.filename}: {e}")
+        raise HTTPException(status_code=400, detail="Invalid or too large image")
+    except SQLAlchemyError:
+        raise HTTPException(status_code=500, detail="Failed to save file")
     except IOError as e:
-        logger.error(f"Failed to save file {file_path}: {e}")
+        logger.error(f"Failed to save file {upload_file.filename}: {e}")
         raise HTTPException(status_code=500, detail="Failed to save file")
+    finally:
+        for leftover in (temp_path, normalized and normalized["temp_path"]):
+            if leftover and os.path.exists(leftover):
+                await aiofiles.os.remove(leftover)
+
+async def serve_stored_file(
+    request: Request,
+    file_type: str,
+    filename: str,
+    size: Optional[str] = None,
+    format: str = "webp",
+    media_type: Optional[str] = None
+):
+    """
+    Serve an uploaded file, or a resized copy of an image when size is given,
+    with ETag/Last-Modified validators, 304s and Range support.
+    """
+    file_path = storage.resolve_file(file_type, filename)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Content-addressed files never change, so browsers may cache them forever
+    # and their hash is a strong ETag; legacy files are revalidated
+    sha256 = storage.content_hash(filename)
+    cache_control = conditional.IMMUTABLE_CACHE_CONTROL if sha256 else conditional.REVALIDATE_CACHE_CONTROL
+    etag = f'"{sha256}"' if sha256 else None
+    media_type = media_type or mimetypes.guess_type(filename)[0]
+
+    if size and images.is_image(filename):
+        derived_etag = f'"{sha256}-{size}.{format}"' if sha256 else None
+        if derived_etag and conditional.is_not_modified(request, derived_etag):
+            return conditional.not_modified_response(derived_etag, cache_control)
+        try:
+            file_path = await images.get_derivative(file_path, size, format)
+            media_type, etag = images.FORMATS[format][1], derived_etag
+        except Exception as e:
+            logger.warning(f"Failed to render {size} of {file_type}/{filename}, serving original: {e}")
+
+    return await conditional.serve_file(request, file_path, media_type, cache_control, etag)
+
+async def save_upload_files(upload_files: List[UploadFile], subfolder: str) -> List[dict]:
+    """Save several uploads concurrently. Failed files are logged and left out."""
+    upload_files = [f for f in upload_files if f.filename]  # Check if file was actually uploaded
+    results = await asyncio.gather(
+        *(save_upload_file(f, subfolder) for f in upload_files), return_exceptions=True
+    )
+
+    saved = []
+    for upload_file, result in zip(upload_files, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to save {subfolder} file {upload_file.filename}: {result}")
+        else:
+            saved.append(result)
+    return saved
 
 @router.post("/", response_model=ExpenseNoteResponse)
 @limiter.limit("10/minute")
 async def submit_expense_note(
     request: Request,
+    background_tasks: BackgroundTasks,
     description: str = Form(...),
     amount: Decimal = Form(...),
     member_email: str = Form(...),
@@ -99,56 +247,21 @@ async def submit_expense_note(
             date_entered=datetime.utcnow()
         )
 
-        expense = create_expense_note(db, expense_data)
-
         # Store Mattermost username from token if available
-        if username:
-            expense.mattermost_username = username
-            db.commit()
-            db.refresh(expense)
+        expense = await run_in_threadpool(create_expense_note, db, expense_data, username)
 
         # Handle multiple photo uploads
         if photos:
-            photo_paths_list = []
-            for photo in photos:
-                if photo.filename:  # Check if file was actually uploaded
-                    try:
-                        photo_path = await save_upload_file(photo, "photos")
-                        photo_paths_list.append(photo_path)
-                    except Exception as e:
-                        logger.error(f"Failed to save photo {photo.filename}: {e}")
-
-            if photo_paths_list:
-                photo_paths = ",".join(photo_paths_list)
-                expense = update_expense_file_paths(
-                    db, expense.id, photo_paths=photo_paths
+            saved_photos = await save_upload_files(photos, "photos")
+            if saved_photos:
+                expense = await run_in_threadpool(
+                    add_expense_files, db, expense.id, FILE_KIND_PHOTO, saved_photos
                 )
+                background_tasks.add_task(images.generate_derivatives, [p["path"] for p in saved_photos])
 
-        # Build view URL for submitter (only if view_token exists)
-        view_url = f"{settings.FRONTEND_URL}/view/{expense.view_token}" if expense.view_token else None
-
-        # Send notification email to admin
-        display_name = member_name or expense.mattermost_username or "Unknown"
-        try:
-            await EmailService.send_new_expense_notification(
-                expense.id, display_name, float(amount)
-            )
-        except Exception as e:
-            logger.error(f"Failed to send admin email notification: {e}")
-
-        # Send DM confirmation to user
-        if expense.mattermost_username:
-            try:
-                result = await notify_expense_submitted(
-                    expense.mattermost_username,
-                    float(amount),
-                    description,
-                    view_url
-                )
-                if not result:
-                    logger.warning(f"DM notification failed for {expense.mattermost_username}")
-            except Exception as e:
-                logger.error(f"Failed to send DM notification to {expense.mattermost_username}: {e}")
+        # Admin email and submitter DM were queued with the expense (see outbox.py)
+        outbox.wake()
+        events.publish("expense.created", expense)
 
         return expense
 
@@ -156,24 +269,55 @@ async def submit_expense_note(
         logger.error(f"Failed to submit expense: {e}")
         raise
 
+@router.get("/member", response_model=MemberLedgerResponse)
+async def member_ledger(
+    limit: int = Query(10, le=50),
+    db: Session = Depends(get_db),
+    username: str = Depends(verify_member_access)
+):
+    """Ledger and recent expenses of the token's member (used by the bot's /expenses balance and list)"""
+    ledger = await run_in_threadpool(get_member_ledger, db, username)
+    ledger["recent"] = await run_in_threadpool(
+        get_all_expense_notes, db, limit=limit,
+        filters=ExpenseNoteFilter(mattermost_username=username)
+    )
+    return ledger
+
 @router.get("/view/{view_token}")
 async def view_expense_by_token(
+    request: Request,
+    response: Response,
     view_token: str,
     db: Session = Depends(get_db)
 ):
-    """View expense details by secret view token (for submitters)"""
-    from ..models import ExpenseNote
+    """
+    View expense details by secret view token (for submitters)
+
+    Pages left open poll this; a matching If-None-Match costs one indexed
+    lookup and an empty 304.
+    """
+    version = await run_in_threadpool(get_expense_note_version_by_view_token, db, view_token)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    etag = conditional.version_etag(version)
+    if conditional.is_not_modified(request, etag):
+        return conditional.not_modified_response(etag, conditional.REVALIDATE_CACHE_CONTROL)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = conditional.REVALIDATE_CACHE_CONTROL
 
-    expense = db.query(ExpenseNote).filter(
-        ExpenseNote.view_token == view_token,
-        ExpenseNote.deleted == False
-    ).first()
+    key = make_key("view", view_token=view_token)
+    cached = query_cache.get(key)
+    if cached is not None:
+        return cached
+
+    computed_at = generation()
+    expense = await run_in_threadpool(get_expense_note_by_view_token, db, view_token)
 
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
     # Return limited public-safe fields
-    return {
+    return query_cache.put(key, {
         "id": expense.id,
         "status": expense.status,
         "member_name": expense.member_name or expense.mattermost_username,
@@ -185,47 +329,28 @@ async def view_expense_by_token(
         "created_at": expense.created_at.isoformat() if expense.created_at else None,
         "pay_date": expense.pay_date.isoformat() if expense.pay_date else None,
         "admin_notes": expense.admin_notes,
-    }
+    }, computed_at)
 
 @router.get("/view/{view_token}/photo/{filename}")
 async def get_photo_by_view_token(
+    request: Request,
     view_token: str,
     filename: str,
+    size: Optional[str] = Query(None, description="thumb, small or preview; images only"),
+    format: str = Query("webp", pattern="^(webp|jpeg)$"),
     db: Session = Depends(get_db)
 ):
     """Serve photo for an expense via view token"""
-    from ..models import ExpenseNote
-    from fastapi.responses import FileResponse
+    if size and size not in images.SIZES:
+        raise HTTPException(status_code=400, detail="Invalid size")
 
-    # Verify view token
-    expense = db.query(ExpenseNote).filter(
-        ExpenseNote.view_token == view_token,
-        ExpenseNote.deleted == False
-    ).first()
-
-    if not expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-
-    # Verify the photo belongs to this expense
-    if not expense.photo_paths:
-        raise HTTPException(status_code=404, detail="No photos for this expense")
-
-    photo_list = expense.photo_paths.split(',')
+    # Verify the view token and that the photo belongs to its expense in one query
     # Normalize paths (remove any directory prefixes from filename param)
     normalized_filename = filename.replace('photos/', '')
+    photo = await run_in_threadpool(
+        get_expense_file_by_view_token, db, view_token, f"photos/{normalized_filename}", FILE_KIND_PHOTO
+    )
+    if not photo:
+        raise HTTPException(status_code=404, detail="Photo not found")
 
-    matching_photo = None
-    for photo_path in photo_list:
-        if photo_path.endswith(normalized_filename) or photo_path == f"photos/{normalized_filename}":
-            matching_photo = photo_path
-            break
-
-    if not matching_photo:
-        raise HTTPException(status_code=403, detail="Photo not associated with this expense")
-
-    # Serve the file
-    file_path = os.path.join(settings.UPLOAD_DIR, matching_photo)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Photo file not found")
-
-    return FileResponse(file_path)
+    return await serve_stored_file(request, "photos", normalized_filename, size, format, photo.mime_type)
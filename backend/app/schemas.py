@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr, field_validator
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from datetime import datetime, date, time
+from typing import List, Optional, Union
 from decimal import Decimal
 
 class ExpenseNoteCreate(BaseModel):
@@ -25,9 +25,46 @@ class ExpenseNoteUpdate(BaseModel):
     paid_from: Optional[str] = None
     paid_to: Optional[str] = None
     financial_responsible: Optional[str] = None
-    attachment_paths: Optional[str] = None
     admin_notes: Optional[str] = None
 
+class ExpenseNoteBulkFields(BaseModel):
+    status: Optional[str] = None
+    pay_date: Optional[datetime] = None
+    paid_from: Optional[str] = None
+
+class ExpenseNoteBulkUpdate(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=500)
+    update: ExpenseNoteBulkFields
+
+class ExpenseNoteFilter(BaseModel):
+    """Optional list filters. Ranges are half-open: *_from is inclusive, *_to is exclusive."""
+    date_entered_from: Optional[Union[datetime, date]] = None
+    date_entered_to: Optional[Union[datetime, date]] = None
+    pay_date_from: Optional[Union[datetime, date]] = None
+    pay_date_to: Optional[Union[datetime, date]] = None
+    created_from: Optional[Union[datetime, date]] = None
+    created_to: Optional[Union[datetime, date]] = None
+    amount_min: Optional[Decimal] = None
+    amount_max: Optional[Decimal] = None
+    payment_method: Optional[str] = None
+    paid_from: Optional[str] = None
+    mattermost_username: Optional[str] = None
+
+    @field_validator(
+        'date_entered_from', 'date_entered_to', 'pay_date_from', 'pay_date_to',
+        'created_from', 'created_to'
+    )
+    @classmethod
+    def dates_to_midnight(cls, v):
+        # Accept "2026-01-31" as midnight of that day
+        if isinstance(v, date) and not isinstance(v, datetime):
+            return datetime.combine(v, time.min)
+        return v
+
+class ExpenseReportRequest(ExpenseNoteFilter):
+    """Expenses to include in a PDF report: the filters plus a set of statuses"""
+    statuses: List[str] = Field(default_factory=lambda: ["pending", "paid", "denied"], min_length=1)
+
 class ExpenseNoteResponse(BaseModel):
     id: str
     status: str
@@ -53,6 +90,62 @@ class ExpenseNoteResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ExpenseNoteBulkResult(BaseModel):
+    updated: List[ExpenseNoteResponse]
+    not_found: List[str]
+
+class SummaryBucket(BaseModel):
+    key: str
+    count: int
+    total: Decimal
+
+class ExpenseSummary(BaseModel):
+    count: int
+    total: Decimal
+    by_status: List[SummaryBucket]
+    by_month: List[SummaryBucket]
+    by_payment_method: List[SummaryBucket]
+    by_paid_from: List[SummaryBucket]
+
+class OutboxMessageResponse(BaseModel):
+    id: int
+    kind: str
+    payload: str
+    expense_id: Optional[str]
+    status: str
+    attempts: int
+    next_attempt_at: datetime
+    last_error: Optional[str]
+    claimed_until: Optional[datetime]
+    created_at: datetime
+    sent_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class LedgerBucket(BaseModel):
+    count: int
+    total: Decimal
+
+class MemberExpenseItem(BaseModel):
+    id: str
+    status: str
+    description: str
+    amount: Decimal
+    date_entered: datetime
+    pay_date: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class MemberLedgerResponse(BaseModel):
+    username: str
+    submitted: LedgerBucket
+    pending: LedgerBucket
+    paid: LedgerBucket
+    denied: LedgerBucket
+    recent: List[MemberExpenseItem]
+
 class AdminLogin(BaseModel):
     password: str
 
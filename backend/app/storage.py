@@ -0,0 +1,60 @@
+import os
+import re
+import aiofiles.os
+from typing import Optional
+from .config import settings
+
+# Content-addressed upload store. Blobs live at objects/ab/cd/<sha256>; expenses
+# reference them by logical paths like photos/<sha256>.jpg, so identical uploads
+# share one file and every URL is immutable.
+
+OBJECTS_DIR = "objects"
+TEMP_DIR = "tmp"
+FILE_TYPES = ("photos", "signatures", "attachments")
+
+_CONTENT_ADDRESSED_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+
+
+def blob_relative_path(sha256: str) -> str:
+    """Sharded location of a blob relative to UPLOAD_DIR"""
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, blob_relative_path(sha256))
+
+
+def temp_path(name: str) -> str:
+    """Scratch file on the same filesystem as the store, so renames are atomic"""
+    return os.path.join(settings.UPLOAD_DIR, TEMP_DIR, name)
+
+
+async def commit_blob(temp_file: str, sha256: str):
+    """Move a fully written temp file into the store, unless the content is already there"""
+    path = blob_path(sha256)
+    if not os.path.exists(path):
+        await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+        await aiofiles.os.replace(temp_file, path)
+
+
+def logical_path(subfolder: str, sha256: str, extension: str) -> str:
+    return f"{subfolder}/{sha256}.{extension}"
+
+
+def content_hash(filename: str) -> Optional[str]:
+    """SHA-256 encoded in a content-addressed filename, None for legacy filenames"""
+    match = _CONTENT_ADDRESSED_NAME.match(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def resolve_file(file_type: str, filename: str) -> Optional[str]:
+    """
+    Filesystem path for a logical file, or None if it doesn't exist.
+    Legacy (pre content-addressed) files are still served from their old location.
+    """
+    if file_type not in FILE_TYPES or os.path.basename(filename) != filename:
+        return None
+
+    sha256 = content_hash(filename)
+    path = blob_path(sha256) if sha256 else os.path.join(settings.UPLOAD_DIR, file_type, filename)
+    return path if os.path.exists(path) else None
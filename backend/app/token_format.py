@@ -0,0 +1,108 @@
+"""
+Binary access-token format, shared by hsg-bot (encoding) and the backend
+(decoding). This file is kept identical in hsg-bot/services/token_format.py
+and backend/app/token_format.py; change both together.
+
+Token = base64url (unpadded) of payload + 64-byte Ed25519 signature of payload.
+
+Payload, big-endian:
+    version   1 byte   (VERSION, or VERSION_SCOPED)
+    key id    4 bytes  ASCII, NUL-padded; all NUL = no key id
+    iat       4 bytes  unsigned seconds since the epoch
+    exp       4 bytes  unsigned seconds since the epoch
+    scope     1 byte   VERSION_SCOPED only; code from SCOPES
+    username  1 byte length + that many bytes of UTF-8
+
+Submission links carry no scope. Scoped tokens (claim "s") are minted by the
+bot for its own backend calls and are only accepted where that scope is
+required.
+
+Legacy tokens (signature + JSON payload) are told apart by the leading
+version byte and the exact length; see split_token.
+"""
+import base64
+import struct
+from typing import Optional, Tuple
+
+VERSION = 1
+VERSION_SCOPED = 2
+SIGNATURE_SIZE = 64
+KEY_ID_SIZE = 4
+MAX_USERNAME_BYTES = 255
+
+# Bot-to-backend calls for a member's own ledger (GET /api/expenses/member)
+SCOPE_MEMBER = "member"
+SCOPES = {1: SCOPE_MEMBER}
+_SCOPE_CODES = {name: code for code, name in SCOPES.items()}
+
+_HEADER = struct.Struct(">B4sIIB")
+_SCOPED_HEADER = struct.Struct(">B4sIIBB")
+_HEADERS = {VERSION: _HEADER, VERSION_SCOPED: _SCOPED_HEADER}
+
+
+def encode_payload(
+    username: str, iat: int, exp: int, key_id: Optional[str] = None, scope: Optional[str] = None
+) -> bytes:
+    key_id_bytes = (key_id or "").encode("ascii")
+    if len(key_id_bytes) > KEY_ID_SIZE:
+        raise ValueError(f"Key id {key_id!r} longer than {KEY_ID_SIZE} characters")
+    username_bytes = username.encode("utf-8")
+    if len(username_bytes) > MAX_USERNAME_BYTES:
+        raise ValueError(f"Username longer than {MAX_USERNAME_BYTES} bytes")
+    if scope is None:
+        return _HEADER.pack(VERSION, key_id_bytes, iat, exp, len(username_bytes)) + username_bytes
+    if scope not in _SCOPE_CODES:
+        raise ValueError(f"Unknown token scope {scope!r}")
+    return _SCOPED_HEADER.pack(
+        VERSION_SCOPED, key_id_bytes, iat, exp, _SCOPE_CODES[scope], len(username_bytes)
+    ) + username_bytes
+
+
+def decode_payload(payload: bytes) -> dict:
+    """Claims of a binary payload, keyed like legacy JSON tokens (u, iat, exp, k, s)"""
+    header = _HEADERS.get(payload[0]) if payload else None
+    if header is None:
+        raise ValueError(f"Unsupported token version {payload[0] if payload else None}")
+    if len(payload) < header.size:
+        raise ValueError("Payload too short")
+    fields = header.unpack_from(payload)
+    version, key_id_bytes, iat, exp, username_length = fields[:4] + fields[-1:]
+    if len(payload) != header.size + username_length:
+        raise ValueError("Payload length does not match username length")
+    key_id = key_id_bytes.rstrip(b"\0").decode("ascii")
+    claims = {
+        "u": payload[header.size:].decode("utf-8"),
+        "iat": iat,
+        "exp": exp,
+    }
+    if key_id:
+        claims["k"] = key_id
+    if version == VERSION_SCOPED:
+        if fields[4] not in SCOPES:
+            raise ValueError(f"Unknown token scope code {fields[4]}")
+        claims["s"] = SCOPES[fields[4]]
+    return claims
+
+
+def is_binary(token_bytes: bytes) -> bool:
+    """Whether decoded token bytes have the binary layout (version byte, consistent length)"""
+    header = _HEADERS.get(token_bytes[0]) if token_bytes else None
+    return (
+        header is not None
+        and len(token_bytes) >= header.size + SIGNATURE_SIZE
+        and token_bytes[header.size - 1] == len(token_bytes) - header.size - SIGNATURE_SIZE
+    )
+
+
+def split_token(token_bytes: bytes) -> Tuple[bytes, bytes]:
+    """(payload, signature) of a binary token"""
+    return token_bytes[:-SIGNATURE_SIZE], token_bytes[-SIGNATURE_SIZE:]
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def b64decode(token: str) -> bytes:
+    """Accepts padded (legacy) and unpadded tokens"""
+    return base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
@@ -1,50 +1,161 @@
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
 from cryptography.exceptions import InvalidSignature
+from collections import OrderedDict
 import base64
+import binascii
 import json
+import threading
 import time
-from typing import Optional
+from typing import Dict, List, Optional
+from . import token_format
 
+# Key id of a bare public key (and of tokens signed before key ids existed)
+DEFAULT_KEY_ID = "default"
 
-def verify_access_token(token: str, public_key_b64: str) -> Optional[dict]:
+
+class Keyring:
+    """
+    Ed25519 public keys by key id, parsed once.
+
+    Configured as a comma-separated list of "<kid>:<base64 key>" entries, e.g.
+    "k1:MCow...,k2:MCow..." while rotating; a bare base64 key is registered
+    as DEFAULT_KEY_ID. Binary tokens carry at most 4 characters of key id.
+    """
+
+    def __init__(self, keys: Dict[str, Ed25519PublicKey]):
+        self.keys = keys
+
+    @classmethod
+    def parse(cls, value: str) -> "Keyring":
+        keys = {}
+        for entry in value.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            key_id, _, key_b64 = entry.rpartition(":")
+            try:
+                keys[key_id or DEFAULT_KEY_ID] = Ed25519PublicKey.from_public_bytes(base64.b64decode(key_b64))
+            except (ValueError, binascii.Error) as e:
+                raise ValueError(f"Invalid Ed25519 public key for key id {key_id or DEFAULT_KEY_ID!r}: {e}")
+        if not keys:
+            raise ValueError("No Ed25519 public keys configured")
+        return cls(keys)
+
+    def candidates(self, key_id: Optional[str]) -> List[Ed25519PublicKey]:
+        """
+        The key for key_id; every key if the token doesn't name one. An id we
+        don't know falls back to the bare key, so the bot can start sending
+        ids before the backend's config lists them.
+        """
+        if key_id is None:
+            return list(self.keys.values())
+        key = self.keys.get(key_id) or self.keys.get(DEFAULT_KEY_ID)
+        return [key] if key else []
+
+
+class VerifiedTokenCache:
+    """LRU of tokens whose signature already checked out, kept until they expire"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str, now: int) -> Optional[dict]:
+        with self._lock:
+            payload = self._entries.get(token)
+            if payload is None:
+                return None
+            if now > payload['exp']:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return payload
+
+    def put(self, token: str, payload: dict):
+        # Only tokens that expire; anything else would be trusted until restart
+        if self.max_entries <= 0 or not isinstance(payload.get('exp'), int):
+            return
+        with self._lock:
+            self._entries[token] = payload
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _signature_valid(keyring: Keyring, key_id, signature: bytes, payload_bytes: bytes) -> bool:
+    for public_key in keyring.candidates(key_id):
+        try:
+            public_key.verify(signature, payload_bytes)
+            return True
+        except InvalidSignature:
+            continue
+    return False
+
+
+def _verify_binary(token_bytes: bytes, keyring: Keyring) -> Optional[dict]:
+    payload_bytes, signature = token_format.split_token(token_bytes)
+    try:
+        payload = token_format.decode_payload(payload_bytes)
+    except ValueError:
+        return None
+    return payload if _signature_valid(keyring, payload.get('k'), signature, payload_bytes) else None
+
+
+def _verify_legacy(token_bytes: bytes, keyring: Keyring) -> Optional[dict]:
+    # Signature (64 bytes) + JSON payload, as the bot issued before token_format
+    if len(token_bytes) < 64:
+        return None
+    signature, payload_bytes = token_bytes[:64], token_bytes[64:]
+
+    # The key id is read before the signature is checked; it only picks
+    # which key to try, and the signature covers it
+    payload = json.loads(payload_bytes.decode('utf-8'))
+    if not isinstance(payload, dict):
+        return None
+    return payload if _signature_valid(keyring, payload.get('k'), signature, payload_bytes) else None
+
+
+def verify_access_token(
+    token: str,
+    keyring: Keyring,
+    cache: Optional[VerifiedTokenCache] = None
+) -> Optional[dict]:
     """
     Verify Ed25519 signed access token.
 
     Args:
-        token: Base64url-encoded token (signature + payload)
-        public_key_b64: Base64-encoded Ed25519 public key
+        token: Base64url-encoded token, binary (see token_format) or legacy JSON
+        keyring: Public keys, selected by the token's key id
+        cache: Previously verified tokens, to skip the signature check
 
     Returns:
         Payload dict if valid, None otherwise
     """
+    now = int(time.time())
+    if cache is not None:
+        payload = cache.get(token, now)
+        if payload is not None:
+            return dict(payload)
+
     try:
-        # Decode the token from base64url
-        token_bytes = base64.urlsafe_b64decode(token)
+        token_bytes = token_format.b64decode(token)
 
-        # Ed25519 signatures are 64 bytes
-        if len(token_bytes) < 64:
+        payload = _verify_binary(token_bytes, keyring) if token_format.is_binary(token_bytes) else None
+        if payload is None:
+            # Also covers legacy tokens whose bytes happen to look binary
+            payload = _verify_legacy(token_bytes, keyring)
+        if payload is None:
             return None
 
-        signature = token_bytes[:64]
-        payload_bytes = token_bytes[64:]
-
-        # Load the public key
-        public_key_bytes = base64.b64decode(public_key_b64)
-        public_key = Ed25519PublicKey.from_public_bytes(public_key_bytes)
-
-        # Verify the signature
-        public_key.verify(signature, payload_bytes)
-
-        # Parse the payload
-        payload = json.loads(payload_bytes.decode('utf-8'))
-
         # Check expiration
         if 'exp' in payload:
-            now = int(time.time())
             if now > payload['exp']:
                 return None  # Token expired
 
-        return payload
+        if cache is not None:
+            cache.put(token, payload)
+        return dict(payload)
 
-    except (InvalidSignature, ValueError, KeyError, json.JSONDecodeError):
+    except (ValueError, KeyError, TypeError, binascii.Error, json.JSONDecodeError):
         return None
@@ -0,0 +1,225 @@
+"""
+Latency under mixed concurrent load, with database calls run on the event
+loop (how the routers called crud before they used run_in_threadpool) and
+offloaded to the threadpool (current code).
+
+For each mode the app is served by uvicorn in its own process, against a
+fresh SQLite database seeded with --seed expenses. --clients concurrent
+clients loop over admin list/search/detail reads, status updates and public
+submissions for --duration seconds, pausing --think-ms on average between
+requests, while a probe requests /health every 10 ms to show how long the
+event loop stalls.
+
+    cd backend
+    python bench/concurrency.py [--clients 10] [--think-ms 100] [--duration 10] [--seed 20000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPERATIONS = {  # name: weight
+    "list": 4,
+    "search": 2,
+    "detail": 4,
+    "update": 2,
+    "submit": 1,
+}
+PROBE = "probe (/health)"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float("nan")
+
+
+def configure(data_dir: str):
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{data_dir}/bench.db",
+        UPLOAD_DIR=f"{data_dir}/uploads",
+        QUERY_CACHE_SIZE="0",  # Measure the database, not the response cache
+        ACCESS_TOKEN_REQUIRED="false",
+        SMTP_HOST="",
+        ADMIN_EMAIL="",
+        SECRET_KEY="bench",
+        ADMIN_PASSWORD="bench",
+        ACCESS_TOKEN_PUBLIC_KEY="A" * 43 + "=",
+        BOT_NOTIFY_URL="http://127.0.0.1:9/notify",
+        BOT_NOTIFY_SECRET="bench",
+    )
+    os.makedirs(f"{data_dir}/uploads", exist_ok=True)
+
+
+def seed(count: int):
+    from datetime import datetime, timedelta
+    from decimal import Decimal
+    from app.database import SessionLocal, init_db
+    from app.models import ExpenseNote
+
+    init_db()
+    rng = random.Random(42)
+    words = ["beer", "filament", "soldering", "pizza", "arduino", "screws", "laser", "paint", "cables", "coffee"]
+    db = SessionLocal()
+    start = datetime.utcnow() - timedelta(days=365)
+    db.bulk_save_objects([
+        ExpenseNote(
+            member_name=f"Member {i % 150}",
+            member_email=f"member{i % 150}@example.com",
+            mattermost_username=f"member{i % 150}",
+            description=" ".join(rng.choice(words) for _ in range(4)),
+            amount=Decimal(rng.randint(100, 50000)) / 100,
+            status=rng.choice(["pending", "paid", "denied"]),
+            date_entered=start + timedelta(minutes=i),
+        )
+        for i in range(count)
+    ])
+    db.commit()
+    db.close()
+    # Seed what crud maintains incrementally (rollups, member ledgers)
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "migrate.py")], check=True, capture_output=True)
+
+
+def serve(mode: str, port: int, seed_count: int):
+    """Server process: seed a fresh database and serve the app, patched for mode"""
+    configure(tempfile.mkdtemp(prefix=f"bench-{mode}-"))
+    sys.path.insert(0, BACKEND_DIR)
+    import logging
+    import uvicorn
+    from app import main
+    from app.routers import admin, expenses
+
+    logging.disable(logging.CRITICAL)
+    seed(seed_count)
+    if mode == "before":
+        async def inline(fn, *args, **kwargs):
+            return fn(*args, **kwargs)
+        admin.run_in_threadpool = expenses.run_in_threadpool = inline
+    for limiter in (main.limiter, admin.limiter, expenses.limiter):
+        limiter.enabled = False
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="critical")
+
+
+async def run_load(base_url: str, clients: int, think: float, duration: float) -> dict:
+    latencies = {name: [] for name in OPERATIONS}
+    latencies[PROBE] = []
+    errors = 0
+    names, weights = zip(*OPERATIONS.items())
+    limits = httpx.Limits(max_connections=clients + 1)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        token = (await client.post("/api/admin/login", json={"password": "bench"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        ids = [e["id"] for e in (await client.get("/api/admin/expenses?limit=500", headers=headers)).json()]
+        deadline = time.perf_counter() + duration
+
+        async def request(name, rng):
+            if name == "list":
+                return await client.get("/api/admin/expenses", headers=headers, params={
+                    "limit": 100, "skip": rng.randrange(0, 5000), "status": rng.choice(["pending", "paid"])
+                })
+            if name == "search":
+                return await client.get(
+                    "/api/admin/expenses/search", headers=headers, params={"q": rng.choice(["beer", "laser", "pizza"])}
+                )
+            if name == "detail":
+                return await client.get(f"/api/admin/expenses/{rng.choice(ids)}", headers=headers)
+            if name == "update":
+                return await client.patch(
+                    f"/api/admin/expenses/{rng.choice(ids)}", headers=headers,
+                    json={"status": rng.choice(["pending", "paid", "denied"])}
+                )
+            return await client.post("/api/expenses/", data={
+                "description": "bench submission", "amount": "12.50",
+                "member_email": "bench@example.com", "member_name": "Bench",
+            })
+
+        async def worker(seed):
+            nonlocal errors
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                response = await request(name, rng)
+                latencies[name].append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+                await asyncio.sleep(rng.expovariate(1 / think) if think else 0)
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/health")
+                latencies[PROBE].append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(probe(), *(worker(i) for i in range(clients)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def wait_until_up(base_url: str, server: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--think-ms", type=float, default=100.0, help="Mean pause between a client's requests")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=20000, help="Expenses in the database")
+    parser.add_argument("--serve", choices=["before", "after"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve, args.port, args.seed)
+
+    print(
+        f"{args.clients} clients, {args.think_ms:.0f} ms think time, {args.duration:.0f}s per mode, "
+        f"{args.seed} expenses; latencies in ms"
+    )
+    print(f"{'mode':7s} {'request':16s} {'count':>6s} {'p50':>8s} {'p99':>8s} {'max':>8s}")
+    for mode in ("before", "after"):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        base_url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port), "--seed", str(args.seed)
+        ])
+        try:
+            wait_until_up(base_url, server)
+            result = asyncio.run(run_load(base_url, args.clients, args.think_ms / 1000, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+        for name, samples in result["latencies"].items():
+            print(
+                f"{mode:7s} {name:16s} {len(samples):6d} "
+                f"{percentile(samples, 0.5) * 1000:8.1f} {percentile(samples, 0.99) * 1000:8.1f} "
+                f"{max(samples, default=float('nan')) * 1000:8.1f}"
+            )
+        if result["errors"]:
+            print(f"{mode:7s} ({result['errors']} error responses)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Email throughput: a new SMTP connection per message (what send_email did
+before SMTPPool) against the pooled EmailService.send_email.
+
+Runs against the local stand-in server from tests/smtp_standin.py (STARTTLS +
+AUTH), with a reply delay to model the round trip to the relay. Sends are
+limited to NOTIFY_CONCURRENCY at a time, like the outbox dispatcher.
+
+    cd backend
+    pip install -r requirements-dev.txt
+    python bench/smtp_throughput.py [--messages 100] [--rtt-ms 5] [--pool-size 5]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+parser.add_argument("--messages", type=int, default=100)
+parser.add_argument("--rtt-ms", type=float, default=5.0, help="Delay before every server reply")
+parser.add_argument("--pool-size", type=int, default=5)
+parser.add_argument("--concurrency", type=int, default=5)
+args = parser.parse_args()
+
+certificate_dir = tempfile.mkdtemp()
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    PORT = s.getsockname()[1]
+
+from tests.smtp_standin import StandinController, StandinHandler, write_certificate  # noqa: E402
+
+CERTIFICATE = write_certificate(certificate_dir)
+os.environ["SSL_CERT_FILE"] = CERTIFICATE
+os.environ.update(
+    SMTP_HOST="localhost", SMTP_PORT=str(PORT), SMTP_USER="user", SMTP_PASSWORD="password",
+    SMTP_FROM_EMAIL="expenses@example.com", SMTP_POOL_SIZE=str(args.pool_size),
+)
+for name in ("SECRET_KEY", "ADMIN_PASSWORD", "BOT_NOTIFY_URL", "BOT_NOTIFY_SECRET"):
+    os.environ.setdefault(name, "bench")
+os.environ.setdefault("ACCESS_TOKEN_PUBLIC_KEY", "A" * 43 + "=")
+
+import aiosmtplib  # noqa: E402
+from email.mime.text import MIMEText  # noqa: E402
+from app.email_service import EmailService, smtp_pool  # noqa: E402
+
+
+async def send_unpooled(i: int):
+    message = MIMEText("<p>Your expense has been paid.</p>", "html")
+    message["From"] = "Expense Notes System <expenses@example.com>"
+    message["To"] = f"member{i}@example.com"
+    message["Subject"] = "Expense Paid"
+    await aiosmtplib.send(
+        message, hostname="localhost", port=PORT, username="user", password="password", start_tls=True
+    )
+
+
+async def send_pooled(i: int):
+    await EmailService.send_email(f"member{i}@example.com", "Expense Paid", "<p>Your expense has been paid.</p>")
+
+
+async def run(name: str, send, handler: StandinHandler):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(i):
+        async with semaphore:
+            await send(i)
+
+    handler.messages.clear()
+    handler.logins = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(i) for i in range(args.messages)))
+    elapsed = time.perf_counter() - start
+    assert len(handler.messages) == args.messages
+    print(
+        f"{name:24s} {args.messages} messages in {elapsed:5.2f}s = {args.messages / elapsed:6.1f} msg/s, "
+        f"{handler.logins} connections"
+    )
+
+
+async def main():
+    handler = StandinHandler()
+    controller = StandinController(handler, CERTIFICATE, PORT, latency=args.rtt_ms / 1000)
+    controller.start()
+    try:
+        print(f"rtt {args.rtt_ms} ms, concurrency {args.concurrency}, pool size {args.pool_size}")
+        await run("connection per message", send_unpooled, handler)
+        await run("pooled", send_pooled, handler)
+    finally:
+        await smtp_pool.close()
+        controller.stop()
+
+
+asyncio.run(main())
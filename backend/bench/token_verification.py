@@ -0,0 +1,83 @@
+"""
+Cost of verifying one access token: the verification before the keyring
+(decode and load the public key on every call, legacy JSON tokens) against
+token_verification with a parsed Keyring, with and without the
+verified-token cache.
+
+    cd backend
+    python bench/token_verification.py [--iterations 20000]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import timeit
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import token_format  # noqa: E402
+from app.token_verification import Keyring, VerifiedTokenCache, verify_access_token  # noqa: E402
+
+
+def verify_before(token: str, public_key_b64: str):
+    """verify_access_token as it was before the keyring (one key, parsed per call)"""
+    try:
+        token_bytes = base64.urlsafe_b64decode(token)
+        if len(token_bytes) < 64:
+            return None
+        signature, payload_bytes = token_bytes[:64], token_bytes[64:]
+        public_key = Ed25519PublicKey.from_public_bytes(base64.b64decode(public_key_b64))
+        public_key.verify(signature, payload_bytes)
+        payload = json.loads(payload_bytes.decode('utf-8'))
+        if 'exp' in payload and int(time.time()) > payload['exp']:
+            return None
+        return payload
+    except (InvalidSignature, ValueError, KeyError, json.JSONDecodeError):
+        return None
+
+
+def public_b64(private_key) -> str:
+    return base64.b64encode(private_key.public_key().public_bytes_raw()).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    old_key, key = Ed25519PrivateKey.generate(), Ed25519PrivateKey.generate()
+    now = int(time.time())
+
+    claims = json.dumps({"exp": now + 3600, "iat": now, "u": "alice"}).encode()
+    legacy_token = base64.urlsafe_b64encode(key.sign(claims) + claims).decode()
+    payload = token_format.encode_payload("alice", now, now + 3600, "k2")
+    binary_token = token_format.b64encode(payload + key.sign(payload))
+
+    single = Keyring.parse(public_b64(key))
+    rotating = Keyring.parse(f"k1:{public_b64(old_key)},k2:{public_b64(key)}")
+    cache = VerifiedTokenCache(1024)
+    verify_access_token(binary_token, rotating, cache)
+
+    cases = [
+        ("before: parse key per call, JSON token", lambda: verify_before(legacy_token, public_b64(key))),
+        ("keyring, JSON token", lambda: verify_access_token(legacy_token, single)),
+        ("keyring (2 keys), binary token with kid", lambda: verify_access_token(binary_token, rotating)),
+        ("keyring, verified-token cache hit", lambda: verify_access_token(binary_token, rotating, cache)),
+        ("(public key parse alone)", lambda: Ed25519PublicKey.from_public_bytes(base64.b64decode(public_b64(key)))),
+    ]
+    for _, fn in cases:
+        assert fn() is not None
+
+    print(f"{args.iterations} iterations, best of 3, per call")
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=args.iterations, repeat=3)) / args.iterations
+        print(f"  {name:42s} {best * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
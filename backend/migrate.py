@@ -4,11 +4,17 @@
 import sqlite3
 import os
 import secrets
+import hashlib
+import mimetypes
+import re
+import shutil
+from datetime import datetime
 
 DB_PATH = os.environ.get('DATABASE_URL', 'sqlite:///./data/expense_notes.db')
 # Extract path from sqlite:/// URL
 if DB_PATH.startswith('sqlite:///'):
     DB_PATH = DB_PATH.replace('sqlite:///', '')
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', './uploads')
 
 def add_column_if_not_exists(cursor, table, column, col_type):
     """Add column if it doesn't exist."""
@@ -21,6 +27,100 @@ def add_column_if_not_exists(cursor, table, column, col_type):
     else:
         print(f"Column exists: {table}.{column} (skipping)")
 
+def create_index_if_not_exists(cursor, name, table, columns, where=None, unique=False):
+    """Create index if it doesn't exist."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+    if cursor.fetchone():
+        print(f"Index exists: {name} (skipping)")
+        return
+
+    print(f"Creating index: {name}")
+    where_clause = f" WHERE {where}" if where else ""
+    unique_clause = "UNIQUE " if unique else ""
+    cursor.execute(f"CREATE {unique_clause}INDEX {name} ON {table} ({', '.join(columns)}){where_clause}")
+
+def file_sha256(full_path):
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def backfill_expense_files(cursor, column, kind):
+    """Copy comma-separated paths from a legacy column into expense_files."""
+    cursor.execute("PRAGMA table_info(expense_notes)")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        return
+
+    cursor.execute(f"""
+        SELECT id, {column} FROM expense_notes
+        WHERE {column} IS NOT NULL AND {column} != ''
+          AND id NOT IN (SELECT expense_id FROM expense_files WHERE kind = ?)
+    """, (kind,))
+    rows = cursor.fetchall()
+    if not rows:
+        print(f"No {column} to backfill (skipping)")
+        return
+
+    count = 0
+    for expense_id, joined_paths in rows:
+        for path in [p.strip() for p in joined_paths.split(",") if p.strip()]:
+            size = sha256 = None
+            full_path = os.path.join(UPLOAD_DIR, path)
+            if os.path.exists(full_path):
+                size = os.path.getsize(full_path)
+                sha256 = file_sha256(full_path)
+            cursor.execute("""
+                INSERT OR IGNORE INTO expense_files (expense_id, kind, path, size, mime_type, sha256, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (expense_id, kind, path, size, mimetypes.guess_type(path)[0], sha256, datetime.utcnow()))
+            count += 1
+    print(f"Backfilled {count} {kind} files from {column}")
+
+def move_files_to_object_store(conn, cursor):
+    """
+    Give legacy expense_files rows content-addressed paths (see app/storage.py).
+
+    Each file is linked (or copied) into objects/ab/cd/<sha256> before its row
+    is rewritten, and each row is committed on its own, so the app keeps
+    serving every file while this runs. Legacy files are left in place.
+    """
+    cursor.execute("SELECT id, expense_id, path, sha256 FROM expense_files")
+    rows = [row for row in cursor.fetchall() if not re.match(r"^[0-9a-f]{64}(\.|$)", os.path.basename(row[2]))]
+    if not rows:
+        print("No legacy files to move to the object store (skipping)")
+        return
+
+    moved = merged = missing = 0
+    for file_id, expense_id, path, sha256 in rows:
+        full_path = os.path.join(UPLOAD_DIR, path)
+        if not os.path.exists(full_path):
+            missing += 1
+            continue
+
+        sha256 = sha256 or file_sha256(full_path)
+        blob_path = os.path.join(UPLOAD_DIR, "objects", sha256[:2], sha256[2:4], sha256)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.link(full_path, blob_path)
+            except OSError:
+                shutil.copy2(full_path, blob_path)
+
+        directory, extension = os.path.dirname(path), path.rsplit(".", 1)[-1].lower()
+        new_path = f"{directory}/{sha256}.{extension}"
+        cursor.execute("SELECT 1 FROM expense_files WHERE expense_id = ? AND path = ?", (expense_id, new_path))
+        if cursor.fetchone():
+            # Same content attached twice to one expense: keep a single row
+            cursor.execute("DELETE FROM expense_files WHERE id = ?", (file_id,))
+            merged += 1
+        else:
+            cursor.execute("UPDATE expense_files SET path = ?, sha256 = ? WHERE id = ?", (new_path, sha256, file_id))
+            moved += 1
+        conn.commit()
+
+    print(f"Moved {moved} files to the object store ({merged} duplicates merged, {missing} missing on disk)")
+
 def main():
     if not os.path.exists(DB_PATH):
         print(f"Database not found: {DB_PATH}")
@@ -97,6 +197,186 @@ def main():
             cursor.execute("UPDATE expense_notes SET view_token = ? WHERE id = ?", (token, expense_id))
         print(f"Generated {len(rows_without_token)} view tokens")
 
+    # 2026-10: Keyset pagination indexes for the admin expense list (see models.ExpenseNote)
+    create_index_if_not_exists(cursor, "ix_expense_notes_created_at_id", "expense_notes", ["created_at", "id"])
+    create_index_if_not_exists(cursor, "ix_expense_notes_active_created_at_id", "expense_notes",
+                               ["created_at", "id"], where="deleted = 0")
+    create_index_if_not_exists(cursor, "ix_expense_notes_active_status_created_at_id", "expense_notes",
+                               ["status", "created_at", "id"], where="deleted = 0")
+    create_index_if_not_exists(cursor, "ix_expense_notes_deleted_created_at_id", "expense_notes",
+                               ["created_at", "id"], where="deleted = 1")
+
+    # 2026-10: Indexes for the structured list filters
+    for name, columns in [
+        ("ix_expense_notes_active_username_created_at_id", ["mattermost_username", "created_at", "id"]),
+        ("ix_expense_notes_active_payment_method_created_at_id", ["payment_method", "created_at", "id"]),
+        ("ix_expense_notes_active_paid_from_pay_date", ["paid_from", "pay_date"]),
+        ("ix_expense_notes_active_date_entered", ["date_entered"]),
+        ("ix_expense_notes_active_pay_date", ["pay_date"]),
+        ("ix_expense_notes_active_amount", ["amount"]),
+    ]:
+        create_index_if_not_exists(cursor, name, "expense_notes", columns, where="deleted = 0")
+
+    # 2026-10: Move comma-separated photo_paths/attachment_paths into expense_files
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS expense_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            expense_id VARCHAR(36) NOT NULL REFERENCES expense_notes (id),
+            kind VARCHAR(20) NOT NULL,
+            path VARCHAR(500) NOT NULL,
+            size INTEGER,
+            mime_type VARCHAR(100),
+            sha256 VARCHAR(64),
+            created_at DATETIME
+        )
+    """)
+    create_index_if_not_exists(cursor, "ix_expense_files_expense_id_kind", "expense_files", ["expense_id", "kind"])
+    create_index_if_not_exists(cursor, "ix_expense_files_expense_id_path", "expense_files",
+                               ["expense_id", "path"], unique=True)
+    backfill_expense_files(cursor, "photo_paths", "photo")
+    backfill_expense_files(cursor, "attachment_paths", "attachment")
+
+    # 2026-10: Content-addressed upload store (see app/storage.py)
+    add_column_if_not_exists(cursor, "expense_files", "original_filename", "VARCHAR(255)")
+    add_column_if_not_exists(cursor, "expense_files", "original_sha256", "VARCHAR(64)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stored_blobs (
+            sha256 VARCHAR(64) PRIMARY KEY,
+            size INTEGER,
+            mime_type VARCHAR(100),
+            ref_count INTEGER NOT NULL,
+            created_at DATETIME,
+            updated_at DATETIME
+        )
+    """)
+    cursor.execute("SELECT id, path FROM expense_files WHERE original_filename IS NULL")
+    for file_id, path in cursor.fetchall():
+        # Legacy uploads were saved as YYYYMMDD_HHMMSS_<original name>
+        original = re.sub(r"^\d{8}_\d{6}_", "", os.path.basename(path))
+        cursor.execute("UPDATE expense_files SET original_filename = ? WHERE id = ?", (original, file_id))
+    conn.commit()
+    move_files_to_object_store(conn, cursor)
+    cursor.execute("""
+        INSERT INTO stored_blobs (sha256, size, mime_type, ref_count, created_at, updated_at)
+        SELECT sha256, MAX(size), MAX(mime_type), COUNT(*), ?, ?
+        FROM (SELECT sha256, size, mime_type FROM expense_files
+              UNION ALL SELECT original_sha256, NULL, NULL FROM expense_files)
+        WHERE sha256 IS NOT NULL GROUP BY sha256
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = excluded.ref_count
+    """, (datetime.utcnow(), datetime.utcnow()))
+    cursor.execute("""
+        UPDATE stored_blobs SET ref_count = 0
+        WHERE sha256 NOT IN (SELECT sha256 FROM expense_files WHERE sha256 IS NOT NULL)
+          AND sha256 NOT IN (SELECT original_sha256 FROM expense_files WHERE original_sha256 IS NOT NULL)
+    """)
+    print("Recounted stored blob references")
+
+    # 2026-10: Full-text search index (see database.FTS_SCHEMA)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'expense_notes_fts'")
+    fts_exists = cursor.fetchone() is not None
+    fts_columns = "description, admin_notes, member_name, mattermost_username"
+    new_values = "new.rowid, new.description, new.admin_notes, new.member_name, new.mattermost_username"
+    old_values = "old.rowid, old.description, old.admin_notes, old.member_name, old.mattermost_username"
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS expense_notes_fts USING fts5(
+            {fts_columns},
+            content='expense_notes', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS expense_notes_fts_ai AFTER INSERT ON expense_notes BEGIN
+            INSERT INTO expense_notes_fts (rowid, {fts_columns}) VALUES ({new_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS expense_notes_fts_ad AFTER DELETE ON expense_notes BEGIN
+            INSERT INTO expense_notes_fts (expense_notes_fts, rowid, {fts_columns}) VALUES ('delete', {old_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS expense_notes_fts_au AFTER UPDATE OF {fts_columns} ON expense_notes BEGIN
+            INSERT INTO expense_notes_fts (expense_notes_fts, rowid, {fts_columns}) VALUES ('delete', {old_values});
+            INSERT INTO expense_notes_fts (rowid, {fts_columns}) VALUES ({new_values});
+        END
+    """)
+    if not fts_exists:
+        print("Building full-text search index...")
+        cursor.execute("INSERT INTO expense_notes_fts (expense_notes_fts) VALUES ('rebuild')")
+    else:
+        print("Full-text search index exists (skipping)")
+
+    # 2026-10: Summary rollups (see models.ExpenseRollup), seeded once from existing expenses
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS expense_rollups (
+            status VARCHAR(20) NOT NULL,
+            month VARCHAR(7) NOT NULL,
+            payment_method VARCHAR(50) NOT NULL,
+            paid_from VARCHAR(100) NOT NULL,
+            count INTEGER NOT NULL,
+            total_cents INTEGER NOT NULL,
+            PRIMARY KEY (status, month, payment_method, paid_from)
+        )
+    """)
+    cursor.execute("SELECT COUNT(*) FROM expense_rollups")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO expense_rollups (status, month, payment_method, paid_from, count, total_cents)
+            SELECT status, strftime('%Y-%m', date_entered), COALESCE(payment_method, ''),
+                   COALESCE(paid_from, ''), COUNT(*), SUM(CAST(ROUND(amount * 100) AS INTEGER))
+            FROM expense_notes
+            WHERE deleted = 0
+            GROUP BY 1, 2, 3, 4
+        """)
+        print(f"Seeded {cursor.rowcount} summary rollup rows")
+    else:
+        print("Summary rollups exist (skipping)")
+
+    # 2026-10: Per-member ledger (see models.MemberLedger), seeded once from existing expenses
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS member_ledgers (
+            mattermost_username VARCHAR(255) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            count INTEGER NOT NULL,
+            total_cents INTEGER NOT NULL,
+            PRIMARY KEY (mattermost_username, status)
+        )
+    """)
+    cursor.execute("SELECT COUNT(*) FROM member_ledgers")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO member_ledgers (mattermost_username, status, count, total_cents)
+            SELECT mattermost_username, status, COUNT(*), SUM(CAST(ROUND(amount * 100) AS INTEGER))
+            FROM expense_notes
+            WHERE deleted = 0 AND mattermost_username IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        print(f"Seeded {cursor.rowcount} member ledger rows")
+    else:
+        print("Member ledgers exist (skipping)")
+
+    # 2026-10: Notification outbox (see models.OutboxMessage and app/outbox.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind VARCHAR(50) NOT NULL,
+            payload TEXT NOT NULL,
+            expense_id VARCHAR(36),
+            status VARCHAR(20) NOT NULL,
+            attempts INTEGER NOT NULL,
+            next_attempt_at DATETIME NOT NULL,
+            last_error TEXT,
+            claimed_until DATETIME,
+            created_at DATETIME,
+            sent_at DATETIME
+        )
+    """)
+    # 2026-10: Send leases, for outbox tables created before they existed
+    add_column_if_not_exists(cursor, "outbox", "claimed_until", "DATETIME")
+    create_index_if_not_exists(cursor, "ix_outbox_status_next_attempt_at", "outbox", ["status", "next_attempt_at"])
+
+    cursor.execute("ANALYZE expense_notes")
+
     conn.commit()
     conn.close()
 
@@ -0,0 +1,51 @@
+import os
+import socket
+
+import pytest
+
+# Settings needs these; tests never talk to a real bot or use the key
+for name, value in {
+    "SECRET_KEY": "test-secret",
+    "ADMIN_PASSWORD": "test-password",
+    "ACCESS_TOKEN_PUBLIC_KEY": "A" * 43 + "=",
+    "BOT_NOTIFY_URL": "http://127.0.0.1:9/notify",
+    "BOT_NOTIFY_SECRET": "test-secret",
+}.items():
+    os.environ.setdefault(name, value)
+
+from tests.smtp_standin import StandinController, StandinHandler, write_certificate  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def smtp_certificate(tmp_path_factory):
+    return write_certificate(str(tmp_path_factory.mktemp("smtp")))
+
+
+@pytest.fixture
+def smtp_server(smtp_certificate, monkeypatch):
+    """A local STARTTLS/AUTH SMTP server, with settings pointing the app at it"""
+    from app.config import settings
+
+    handler = StandinHandler()
+    port = _free_port()
+    controller = StandinController(handler, smtp_certificate, port)
+    controller.start()
+    monkeypatch.setenv("SSL_CERT_FILE", smtp_certificate)
+    for name, value in {
+        "SMTP_HOST": "localhost", "SMTP_PORT": port, "SMTP_USER": "user", "SMTP_PASSWORD": "password",
+        "SMTP_FROM_EMAIL": "expenses@example.com",
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+    yield handler
+    controller.stop()
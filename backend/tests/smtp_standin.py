@@ -0,0 +1,107 @@
+"""
+Local SMTP server for the email tests and bench/smtp_throughput.py.
+
+aiosmtpd with STARTTLS and AUTH on a self-signed certificate, like the real
+relay, plus an optional reply delay to model network latency and a switch to
+drop sessions the way servers do when they time out idle clients.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import ssl
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP, AuthResult
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+# aiosmtpd logs every command and a deprecation warning per login
+logging.getLogger("mail.log").setLevel(logging.ERROR)
+
+
+def write_certificate(directory: str) -> str:
+    """Write a self-signed localhost certificate and key; returns the certificate path"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "smtp-cert.pem")
+    key_path = os.path.join(directory, "smtp-key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path
+
+
+class StandinHandler:
+    """Records logins and delivered messages; drop_after closes a session once it delivered that many"""
+
+    def __init__(self):
+        self.messages = []
+        self.logins = 0
+        self.drop_after = None
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        self.logins += 1
+        return AuthResult(success=True)
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        if self.drop_after and getattr(session, "delivered", 0) >= self.drop_after:
+            # Hang up without a reply, as a server that already dropped the session would
+            server.transport.close()
+            return "421 Closing connection"
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.content)
+        session.delivered = getattr(session, "delivered", 0) + 1
+        return "250 Message accepted for delivery"
+
+
+class _LatencySMTP(SMTP):
+    def __init__(self, handler, latency: float, **kwargs):
+        super().__init__(handler, **kwargs)
+        self.latency = latency
+
+    async def push(self, status):
+        # One round trip per reply, not per line of a multi-line reply
+        line = status.decode() if isinstance(status, bytes) else status
+        if self.latency and line[3:4] != "-":
+            await asyncio.sleep(self.latency)
+        await super().push(status)
+
+
+class StandinController(Controller):
+    def __init__(self, handler: StandinHandler, cert_path: str, port: int, latency: float = 0.0):
+        tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        tls_context.load_cert_chain(cert_path, cert_path.replace("-cert.pem", "-key.pem"))
+        self.latency = latency
+        super().__init__(
+            handler,
+            hostname="127.0.0.1",
+            port=port,
+            tls_context=tls_context,
+            require_starttls=True,
+            authenticator=handler.authenticate,
+        )
+
+    def factory(self):
+        return _LatencySMTP(self.handler, self.latency, **self.SMTP_kwargs)
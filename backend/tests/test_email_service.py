@@ -0,0 +1,90 @@
+import asyncio
+from email.mime.text import MIMEText
+
+import aiosmtplib
+import pytest
+
+from app.email_service import SMTPPool
+
+pytestmark = pytest.mark.anyio
+
+
+def message(i: int = 0) -> MIMEText:
+    msg = MIMEText(f"Message {i}")
+    msg["From"] = "expenses@example.com"
+    msg["To"] = f"member{i}@example.com"
+    msg["Subject"] = f"Test {i}"
+    return msg
+
+
+async def test_sequential_sends_reuse_one_session(smtp_server):
+    pool = SMTPPool(size=2, idle_timeout=60)
+    for i in range(10):
+        await pool.send(message(i))
+    await pool.close()
+
+    assert len(smtp_server.messages) == 10
+    assert pool.connects == 1
+    assert smtp_server.logins == 1
+
+
+async def test_concurrent_sends_open_at_most_pool_size_sessions(smtp_server):
+    pool = SMTPPool(size=3, idle_timeout=60)
+    await asyncio.gather(*(pool.send(message(i)) for i in range(30)))
+    await pool.close()
+
+    assert len(smtp_server.messages) == 30
+    assert pool.connects <= 3
+    assert smtp_server.logins == pool.connects
+
+
+async def test_idle_sessions_expire(smtp_server):
+    pool = SMTPPool(size=1, idle_timeout=0)
+    for i in range(3):
+        await pool.send(message(i))
+    await pool.close()
+
+    assert pool.connects == 3
+
+
+async def test_dropped_session_is_discarded_and_next_send_reconnects(smtp_server, monkeypatch):
+    smtp_server.drop_after = 1
+    raised = []
+    send_message = aiosmtplib.SMTP.send_message
+
+    async def recording_send_message(self, *args, **kwargs):
+        try:
+            return await send_message(self, *args, **kwargs)
+        except Exception as e:
+            raised.append(type(e))
+            raise
+
+    monkeypatch.setattr(aiosmtplib.SMTP, "send_message", recording_send_message)
+
+    pool = SMTPPool(size=1, idle_timeout=60)
+    for i in range(3):
+        await pool.send(message(i))
+    await pool.close()
+
+    # Every reuse hit a dropped session: it raised, was discarded and the send retried on a new one
+    assert raised == [aiosmtplib.SMTPServerDisconnected] * 2
+    assert len(smtp_server.messages) == 3
+    assert pool.connects == 3
+
+
+async def test_failed_send_does_not_return_session_to_pool(smtp_server, monkeypatch):
+    pool = SMTPPool(size=1, idle_timeout=60)
+    await pool.send(message(0))
+
+    async def refused(self, *args, **kwargs):
+        raise aiosmtplib.SMTPRecipientsRefused([])
+
+    with monkeypatch.context() as patch:
+        patch.setattr(aiosmtplib.SMTP, "send_message", refused)
+        with pytest.raises(aiosmtplib.SMTPRecipientsRefused):
+            await pool.send(message(1))
+
+    await pool.send(message(2))
+    await pool.close()
+    assert pool.connects == 2
+    assert len(smtp_server.messages) == 2
@@ -0,0 +1,188 @@
+import base64
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from app import token_format
+from app.token_verification import Keyring, VerifiedTokenCache, verify_access_token
+
+BACKEND_COPY = Path(token_format.__file__)
+BOT_DIR = Path(__file__).resolve().parents[2] / "hsg-bot"
+BOT_COPY = BOT_DIR / "services" / "token_format.py"
+
+# Fixed key, so the legacy tokens below are reproducible (Ed25519 is deterministic)
+PRIVATE_KEY = Ed25519PrivateKey.from_private_bytes(bytes(range(32)))
+OTHER_KEY = Ed25519PrivateKey.from_private_bytes(bytes(range(1, 33)))
+EXP = 4102444800  # 2100-01-01
+
+
+def _public_b64(private_key) -> str:
+    return base64.b64encode(private_key.public_key().public_bytes_raw()).decode()
+
+
+KEYRING = Keyring.parse(_public_b64(PRIVATE_KEY))
+
+
+def binary_token(username="alice", iat=1700000000, exp=EXP, key_id=None, scope=None, private_key=PRIVATE_KEY):
+    payload = token_format.encode_payload(username, iat, exp, key_id, scope)
+    return token_format.b64encode(payload + private_key.sign(payload))
+
+
+def legacy_token(claims, private_key=PRIVATE_KEY) -> str:
+    payload = json.dumps(claims).encode("utf-8")
+    return base64.urlsafe_b64encode(private_key.sign(payload) + payload).decode()
+
+
+@pytest.mark.parametrize("key_id", [None, "k", "k2", "abcd"])
+@pytest.mark.parametrize("scope", [None, token_format.SCOPE_MEMBER])
+def test_round_trip(key_id, scope):
+    payload = token_format.encode_payload("alice", 1700000000, EXP, key_id, scope)
+    claims = token_format.decode_payload(payload)
+    expected = {"u": "alice", "iat": 1700000000, "exp": EXP}
+    if key_id:
+        expected["k"] = key_id
+    if scope:
+        expected["s"] = scope
+    assert claims == expected
+
+
+@pytest.mark.parametrize("key_id", [None, "k2"])
+def test_round_trip_through_verification(key_id):
+    keyring = Keyring.parse(f"k1:{_public_b64(OTHER_KEY)},k2:{_public_b64(PRIVATE_KEY)}")
+    token = binary_token(key_id=key_id)
+    assert token_format.is_binary(token_format.b64decode(token))
+    payload = verify_access_token(token, keyring)
+    assert payload["u"] == "alice"
+    assert payload.get("k") == key_id
+
+
+def test_key_id_longer_than_four_characters_is_rejected():
+    with pytest.raises(ValueError):
+        token_format.encode_payload("alice", 0, EXP, "k1234")
+
+
+def test_unknown_scope_is_rejected():
+    with pytest.raises(ValueError):
+        token_format.encode_payload("alice", 0, EXP, scope="admin")
+
+
+def test_username_of_255_utf8_bytes():
+    username = "é" * 127 + "a"
+    assert len(username.encode("utf-8")) == 255
+    token = binary_token(username)
+    assert verify_access_token(token, KEYRING)["u"] == username
+
+
+@pytest.mark.parametrize("username", ["é" * 128, "a" * 256, "€" * 86])
+def test_username_over_255_bytes_is_rejected(username):
+    assert len(username.encode("utf-8")) > 255
+    with pytest.raises(ValueError):
+        token_format.encode_payload(username, 0, EXP)
+
+
+def test_legacy_token_starting_with_version_byte():
+    claims = {"exp": EXP, "iat": 1700000284, "u": "alice"}
+    token = legacy_token(claims)
+    assert token_format.b64decode(token)[0] == token_format.VERSION
+    assert verify_access_token(token, KEYRING) == claims
+
+
+def test_legacy_token_that_looks_binary():
+    # Signature happens to start with the version byte and a matching username length
+    claims = {"exp": EXP, "iat": 1700002429, "u": "alice"}
+    token = legacy_token(claims)
+    assert token_format.is_binary(token_format.b64decode(token))
+    assert verify_access_token(token, KEYRING) == claims
+
+
+def test_legacy_token_with_key_id():
+    claims = {"exp": EXP, "iat": 1700000000, "u": "alice", "k": "k2"}
+    keyring = Keyring.parse(f"k1:{_public_b64(OTHER_KEY)},k2:{_public_b64(PRIVATE_KEY)}")
+    assert verify_access_token(legacy_token(claims), keyring) == claims
+
+
+def test_expired_token_is_rejected():
+    assert verify_access_token(binary_token(iat=1, exp=2), KEYRING) is None
+
+
+def test_token_signed_by_another_key_is_rejected():
+    assert verify_access_token(binary_token(private_key=OTHER_KEY), KEYRING) is None
+
+
+@pytest.mark.parametrize("token", [
+    binary_token(key_id="k2", scope=token_format.SCOPE_MEMBER),
+    legacy_token({"exp": EXP, "iat": 1700000000, "u": "alice"}),
+])
+def test_truncated_tokens_do_not_verify(token):
+    token_bytes = token_format.b64decode(token)
+    for length in range(len(token_bytes)):
+        truncated = token_format.b64encode(token_bytes[:length])
+        assert verify_access_token(truncated, KEYRING) is None
+    # Padding is optional, so only cut into the data characters
+    unpadded = token.rstrip("=")
+    for length in range(len(unpadded)):
+        assert verify_access_token(unpadded[:length], KEYRING) is None
+
+
+@pytest.mark.parametrize("token", [
+    binary_token(key_id="k2", scope=token_format.SCOPE_MEMBER),
+    legacy_token({"exp": EXP, "iat": 1700000000, "u": "alice"}),
+])
+def test_bit_flipped_tokens_do_not_verify(token):
+    keyring = Keyring.parse(f"k2:{_public_b64(PRIVATE_KEY)}")
+    token_bytes = token_format.b64decode(token)
+    for position in range(len(token_bytes) * 8):
+        flipped = bytearray(token_bytes)
+        flipped[position // 8] ^= 1 << (position % 8)
+        assert verify_access_token(token_format.b64encode(bytes(flipped)), keyring) is None
+
+
+def test_random_inputs_do_not_raise_or_verify():
+    rng = random.Random(1234)
+    cache = VerifiedTokenCache(16)
+    for _ in range(5000):
+        data = bytes(rng.getrandbits(8) for _ in range(rng.randrange(0, 200)))
+        if rng.random() < 0.5 and data:
+            # Make the binary path likely: right version byte and username length
+            version = rng.choice([token_format.VERSION, token_format.VERSION_SCOPED])
+            header_size = 14 if version == token_format.VERSION else 15
+            data = bytearray(data.ljust(header_size + token_format.SIGNATURE_SIZE, b"\0"))
+            data[0] = version
+            data[header_size - 1] = len(data) - header_size - token_format.SIGNATURE_SIZE
+            data = bytes(data)
+        assert verify_access_token(token_format.b64encode(data), KEYRING, cache) is None
+        try:
+            token_format.decode_payload(data)
+        except ValueError:
+            pass
+
+    for _ in range(2000):
+        text = "".join(rng.choice("ABCxyz019-_=+/.!é ") for _ in range(rng.randrange(0, 200)))
+        assert verify_access_token(text, KEYRING, cache) is None
+
+
+@pytest.mark.skipif(not BOT_COPY.exists(), reason="hsg-bot is not checked out next to the backend")
+def test_bot_and_backend_copies_are_identical():
+    assert BOT_COPY.read_bytes() == BACKEND_COPY.read_bytes()
+
+
+@pytest.mark.skipif(not BOT_COPY.exists(), reason="hsg-bot is not checked out next to the backend")
+@pytest.mark.parametrize("token_format_name", ["binary", "json"])
+def test_bot_tokens_verify(monkeypatch, token_format_name):
+    monkeypatch.syspath_prepend(str(BOT_DIR))
+    from services.tokens import generate_access_token
+
+    private_b64 = base64.b64encode(PRIVATE_KEY.private_bytes_raw()).decode()
+    token = generate_access_token(private_b64, "alice", key_id="k2", format=token_format_name)
+    keyring = Keyring.parse(f"k2:{_public_b64(PRIVATE_KEY)}")
+    payload = verify_access_token(token, keyring)
+    assert payload["u"] == "alice"
+    assert payload["k"] == "k2"
+    assert "s" not in payload
+
+    token = generate_access_token(private_b64, "alice", format=token_format_name, scope=token_format.SCOPE_MEMBER)
+    assert verify_access_token(token, KEYRING)["s"] == token_format.SCOPE_MEMBER
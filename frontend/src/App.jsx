@@ -4,16 +4,35 @@ import ExpenseForm from './components/ExpenseForm';
 import ExpenseView from './components/ExpenseView';
 import AdminLogin from './components/AdminLogin';
 
-// Lazy load admin dashboard (contains pdf-lib which is large)
+// Lazy load admin dashboard
 const AdminDashboard = lazy(() => import('./components/AdminDashboard'));
 
-// Decode username from Ed25519 signed token (base64url(signature + payload))
+// Access tokens are base64url, in one of two layouts (see backend/app/token_format.py):
+// binary: payload + 64-byte signature, where the payload is version (1), key id (4),
+//   iat (4), exp (4), username length (1) and the UTF-8 username
+// legacy: 64-byte signature + JSON payload
+const SIGNATURE_SIZE = 64;
+const BINARY_VERSION = 1;
+const BINARY_HEADER_SIZE = 14;
+
+// Decode username from Ed25519 signed token (not verified; only used for display)
 function decodeTokenUsername(token) {
   try {
-    const decoded = atob(token.replace(/-/g, '+').replace(/_/g, '/'));
-    // Signature is 64 bytes, payload follows
-    const payloadStr = decoded.slice(64);
-    const payload = JSON.parse(payloadStr);
+    const base64 = token.replace(/-/g, '+').replace(/_/g, '/');
+    const decoded = atob(base64 + '='.repeat((4 - (base64.length % 4)) % 4));
+    const bytes = Uint8Array.from(decoded, (c) => c.charCodeAt(0));
+    const utf8 = new TextDecoder('utf-8', { fatal: true });
+
+    const usernameLength = bytes.length - BINARY_HEADER_SIZE - SIGNATURE_SIZE;
+    if (bytes[0] === BINARY_VERSION && usernameLength >= 0 && bytes[BINARY_HEADER_SIZE - 1] === usernameLength) {
+      try {
+        return utf8.decode(bytes.subarray(BINARY_HEADER_SIZE, BINARY_HEADER_SIZE + usernameLength)) || null;
+      } catch {
+        // Not valid UTF-8: a legacy token that happens to look binary
+      }
+    }
+
+    const payload = JSON.parse(utf8.decode(bytes.subarray(SIGNATURE_SIZE)));
     return payload.u || null;
   } catch {
     return null;
@@ -1,12 +1,14 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import DatePicker from 'react-datepicker';
 import 'react-datepicker/dist/react-datepicker.css';
-import { PDFDocument, rgb, StandardFonts } from 'pdf-lib';
 import { format } from 'date-fns';
 import { adminAPI } from '../services/api';
 import ExpenseList from './ExpenseList';
 import ExpenseDetails from './ExpenseDetails';
 
+// Columns the list panel shows; the details panel fetches the full expense
+const LIST_FIELDS = ['status', 'member_name', 'description', 'amount', 'date_entered', 'deleted'];
+
 const AdminDashboard = ({ onLogout }) => {
   const [expenses, setExpenses] = useState([]);
   const [selectedExpense, setSelectedExpense] = useState(null);
@@ -21,14 +23,41 @@ const AdminDashboard = ({ onLogout }) => {
     denied: false
   });
 
+  const selectedIdRef = useRef(null);
+  useEffect(() => {
+    selectedIdRef.current = selectedExpense?.id;
+  }, [selectedExpense]);
+
   useEffect(() => {
     loadExpenses();
   }, [filter]);
 
+  // Patch the list from the change feed instead of re-polling it
+  useEffect(() => {
+    const matchesFilter = (e) =>
+      filter === 'deleted' ? e.deleted : !e.deleted && (filter === 'all' || e.status === filter);
+
+    return adminAPI.subscribeEvents((type, data) => {
+      if (type === 'reset') {
+        loadExpenses();
+        return;
+      }
+      setExpenses((current) => {
+        const others = current.filter(e => e.id !== data.id);
+        if (!matchesFilter(data)) return others;
+        const row = Object.fromEntries(['id', ...LIST_FIELDS].map(field => [field, data[field]]));
+        return [...others, row].sort((a, b) => new Date(b.date_entered) - new Date(a.date_entered));
+      });
+      if (data.id === selectedIdRef.current) {
+        selectExpense(data);
+      }
+    }, onLogout);
+  }, [filter]);
+
   const loadExpenses = async () => {
     try {
       const filterStatus = filter === 'all' ? null : filter;
-      const data = await adminAPI.listExpenses(filterStatus);
+      const data = await adminAPI.listExpenses(filterStatus, LIST_FIELDS);
       // Sort by newest first
       const sortedData = data.sort((a, b) =>
         new Date(b.date_entered) - new Date(a.date_entered)
@@ -38,11 +67,10 @@ const AdminDashboard = ({ onLogout }) => {
       // Auto-select first expense if none selected or if selected expense is not in new list
       if (sortedData.length > 0) {
         if (!selectedExpense || !sortedData.find(e => e.id === selectedExpense.id)) {
-          setSelectedExpense(sortedData[0]);
+          await selectExpense(sortedData[0]);
         } else {
           // If the selected expense is still in the list, update it with fresh data
-          const updatedExpense = sortedData.find(e => e.id === selectedExpense.id);
-          setSelectedExpense(updatedExpense);
+          await selectExpense(selectedExpense);
         }
       } else {
         setSelectedExpense(null);
@@ -57,6 +85,14 @@ const AdminDashboard = ({ onLogout }) => {
     }
   };
 
+  const selectExpense = async (expense) => {
+    try {
+      setSelectedExpense(await adminAPI.getExpense(expense.id));
+    } catch (err) {
+      console.error('Failed to load expense:', err);
+    }
+  };
+
   const handleExpenseUpdate = async (expenseId, updateData) => {
     try {
       await adminAPI.updateExpense(expenseId, updateData);
@@ -68,338 +104,28 @@ const AdminDashboard = ({ onLogout }) => {
     }
   };
 
-  const loadFileAsArrayBuffer = async (url) => {
-    try {
-      const token = localStorage.getItem('admin_token');
-      const response = await fetch(url, {
-        headers: token ? { 'Authorization': `Bearer ${token}` } : {}
-      });
-      if (!response.ok) throw new Error('Failed to load');
-      return await response.arrayBuffer();
-    } catch (error) {
-      console.error('Failed to load file:', url, error);
-      return null;
-    }
-  };
-
   const handleExportPDF = async () => {
     if (!startDate || !endDate) {
       alert('Please select both start and end dates');
       return;
     }
 
-    // Filter expenses by date range and status
     const selectedStatuses = Object.keys(exportStatuses).filter(status => exportStatuses[status]);
-    const filteredExpenses = expenses.filter(expense => {
-      const expenseDate = new Date(expense.date_entered);
-      const inDateRange = expenseDate >= startDate && expenseDate <= endDate;
-      const matchesStatus = selectedStatuses.includes(expense.status);
-      return inDateRange && matchesStatus;
-    });
-
-    if (filteredExpenses.length === 0) {
-      alert('No expenses found in the selected date range with selected statuses');
+    if (selectedStatuses.length === 0) {
+      alert('Please select at least one status');
       return;
     }
 
-    try {
-      const pdfDoc = await PDFDocument.create();
-      const font = await pdfDoc.embedFont(StandardFonts.Helvetica);
-      const fontBold = await pdfDoc.embedFont(StandardFonts.HelveticaBold);
-      const margin = 40;
-      const lineHeight = 12;
-      const gray = rgb(0.4, 0.4, 0.4);
-      const black = rgb(0, 0, 0);
-
-      // Helper: wrap text to fit width
-      const wrapText = (text, maxWidth, fontSize) => {
-        const words = text.split(' ');
-        const lines = [];
-        let currentLine = '';
-        for (const word of words) {
-          const testLine = currentLine ? `${currentLine} ${word}` : word;
-          const testWidth = font.widthOfTextAtSize(testLine, fontSize);
-          if (testWidth > maxWidth && currentLine) {
-            lines.push(currentLine);
-            currentLine = word;
-          } else {
-            currentLine = testLine;
-          }
-        }
-        if (currentLine) lines.push(currentLine);
-        return lines;
-      };
-
-      // Helper: safe string (prevent null errors and strip emojis/unsupported chars)
-      const safe = (val) => {
-        if (!val) return '';
-        // Remove emojis and other non-WinAnsi characters (pdf-lib limitation)
-        return String(val).replace(/[\u{1F300}-\u{1F9FF}]|[\u{2600}-\u{26FF}]|[\u{2700}-\u{27BF}]|[\u{1F600}-\u{1F64F}]|[\u{1F680}-\u{1F6FF}]|[\u{1F1E0}-\u{1F1FF}]/gu, '');
-      };
-
-      // Helper: draw page footer
-      const drawFooter = (page, expenseIndex, totalExpenses, memberName) => {
-        const { width } = page.getSize();
-        page.drawText(`Expense ${expenseIndex + 1}/${totalExpenses} — ${safe(memberName)}`, {
-          x: margin,
-          y: 20,
-          size: 8,
-          font,
-          color: gray,
-        });
-        page.drawText(format(new Date(), 'yyyy-MM-dd'), {
-          x: width - margin - 60,
-          y: 20,
-          size: 8,
-          font,
-          color: gray,
-        });
-      };
-
-      // Calculate totals for cover page
-      const totalAmount = filteredExpenses.reduce((sum, e) => sum + parseFloat(e.amount), 0);
-      const statusCounts = filteredExpenses.reduce((acc, e) => {
-        acc[e.status] = (acc[e.status] || 0) + 1;
-        return acc;
-      }, {});
-
-      // Cover page
-      let page = pdfDoc.addPage();
-      let { width, height } = page.getSize();
-      let yPos = height - 80;
+    // The report is rendered server-side; date_entered_to is exclusive, so include the whole end date
+    const dayAfterEnd = new Date(endDate);
+    dayAfterEnd.setDate(dayAfterEnd.getDate() + 1);
 
-      page.drawText('Expense Report', { x: margin, y: yPos, size: 24, font: fontBold });
-      yPos -= 30;
-
-      page.drawText(`${format(startDate, 'yyyy/MM/dd')} — ${format(endDate, 'yyyy/MM/dd')}`, {
-        x: margin, y: yPos, size: 12, font, color: gray
-      });
-      yPos -= 40;
-
-      // Summary box
-      page.drawRectangle({
-        x: margin,
-        y: yPos - 80,
-        width: width - 2 * margin,
-        height: 90,
-        borderColor: rgb(0.8, 0.8, 0.8),
-        borderWidth: 1,
+    try {
+      const blob = await adminAPI.exportReportPdf({
+        date_entered_from: format(startDate, 'yyyy-MM-dd'),
+        date_entered_to: format(dayAfterEnd, 'yyyy-MM-dd'),
+        statuses: selectedStatuses,
       });
-
-      page.drawText('Summary', { x: margin + 10, y: yPos - 5, size: 11, font: fontBold });
-      yPos -= 25;
-      page.drawText(`Total Expenses: ${filteredExpenses.length}`, { x: margin + 10, y: yPos, size: 10, font });
-      yPos -= 15;
-      page.drawText(`Total Amount: €${totalAmount.toFixed(2)}`, { x: margin + 10, y: yPos, size: 10, font: fontBold });
-      yPos -= 15;
-      const statusText = Object.entries(statusCounts).map(([s, c]) => `${s}: ${c}`).join('  |  ');
-      page.drawText(`Status: ${statusText}`, { x: margin + 10, y: yPos, size: 10, font });
-      yPos -= 50;
-
-      // Table of contents
-      page.drawText('Contents', { x: margin, y: yPos, size: 11, font: fontBold });
-      yPos -= 18;
-
-      for (let i = 0; i < filteredExpenses.length; i++) {
-        const e = filteredExpenses[i];
-        if (yPos < 50) {
-          page = pdfDoc.addPage();
-          yPos = height - margin;
-        }
-        const tocLine = `${i + 1}. ${safe(e.member_name)} — €${parseFloat(e.amount || 0).toFixed(2)} — ${safe(e.status)}`;
-        page.drawText(tocLine, { x: margin + 10, y: yPos, size: 9, font });
-        yPos -= 14;
-      }
-
-      // Each expense
-      for (let i = 0; i < filteredExpenses.length; i++) {
-        const expense = filteredExpenses[i];
-        page = pdfDoc.addPage();
-        ({ width, height } = page.getSize());
-        yPos = height - margin;
-        const contentWidth = width - 2 * margin;
-
-        // Header line
-        page.drawLine({
-          start: { x: margin, y: yPos },
-          end: { x: width - margin, y: yPos },
-          thickness: 2,
-          color: rgb(0.2, 0.2, 0.2),
-        });
-        yPos -= 20;
-
-        // Title row: name + amount
-        page.drawText(safe(expense.member_name), { x: margin, y: yPos, size: 14, font: fontBold });
-        const amountText = `€${parseFloat(expense.amount || 0).toFixed(2)}`;
-        const amountWidth = fontBold.widthOfTextAtSize(amountText, 14);
-        page.drawText(amountText, { x: width - margin - amountWidth, y: yPos, size: 14, font: fontBold });
-        yPos -= 16;
-
-        // Subtitle row: email + date
-        page.drawText(safe(expense.member_email), { x: margin, y: yPos, size: 9, font, color: gray });
-        const dateText = format(new Date(expense.date_entered), 'yyyy/MM/dd');
-        const dateWidth = font.widthOfTextAtSize(dateText, 9);
-        page.drawText(dateText, { x: width - margin - dateWidth, y: yPos, size: 9, font, color: gray });
-        yPos -= 20;
-
-        // Description with wrapping
-        const descLines = wrapText(safe(expense.description), contentWidth, 10);
-        for (const line of descLines) {
-          page.drawText(line, { x: margin, y: yPos, size: 10, font });
-          yPos -= lineHeight;
-        }
-        yPos -= 10;
-
-        // Status badge
-        const statusColors = {
-          pending: rgb(0.9, 0.7, 0.1),
-          paid: rgb(0.2, 0.7, 0.3),
-          denied: rgb(0.8, 0.2, 0.2),
-        };
-        const statusColor = statusColors[expense.status] || black;
-        page.drawText(safe(expense.status).toUpperCase(), { x: margin, y: yPos, size: 10, font: fontBold, color: statusColor });
-        yPos -= 18;
-
-        // Admin details (condensed, two-column where possible)
-        if (expense.status !== 'pending') {
-          const adminFields = [];
-          if (expense.pay_date) adminFields.push(['Pay Date', format(new Date(expense.pay_date), 'yyyy/MM/dd')]);
-          if (expense.paid_from) adminFields.push(['From', expense.paid_from]);
-          if (expense.paid_to) adminFields.push(['To', expense.paid_to]);
-          if (expense.financial_responsible) adminFields.push(['Responsible', expense.financial_responsible]);
-
-          // Two-column layout for admin fields
-          const colWidth = contentWidth / 2;
-          for (let j = 0; j < adminFields.length; j += 2) {
-            const [label1, value1] = adminFields[j];
-            page.drawText(`${label1}: `, { x: margin, y: yPos, size: 9, font: fontBold, color: gray });
-            page.drawText(safe(value1), { x: margin + font.widthOfTextAtSize(`${label1}: `, 9), y: yPos, size: 9, font });
-
-            if (adminFields[j + 1]) {
-              const [label2, value2] = adminFields[j + 1];
-              page.drawText(`${label2}: `, { x: margin + colWidth, y: yPos, size: 9, font: fontBold, color: gray });
-              page.drawText(safe(value2), { x: margin + colWidth + font.widthOfTextAtSize(`${label2}: `, 9), y: yPos, size: 9, font });
-            }
-            yPos -= lineHeight;
-          }
-
-          // Message to user (full width, wrapped)
-          if (expense.admin_notes) {
-            yPos -= 5;
-            page.drawText('Message: ', { x: margin, y: yPos, size: 9, font: fontBold, color: gray });
-            const notesLines = wrapText(safe(expense.admin_notes), contentWidth - 40, 9);
-            const notesLabelWidth = font.widthOfTextAtSize('Message: ', 9);
-            page.drawText(notesLines[0] || '', { x: margin + notesLabelWidth, y: yPos, size: 9, font });
-            yPos -= lineHeight;
-            for (let k = 1; k < notesLines.length; k++) {
-              page.drawText(notesLines[k], { x: margin + notesLabelWidth, y: yPos, size: 9, font });
-              yPos -= lineHeight;
-            }
-          }
-        }
-        yPos -= 10;
-
-        // Attachments section
-        const allFiles = [expense.photo_paths, expense.attachment_paths]
-          .filter(Boolean)
-          .join(',')
-          .split(',')
-          .filter(p => p.trim());
-
-        if (allFiles.length > 0) {
-          page.drawLine({
-            start: { x: margin, y: yPos },
-            end: { x: width - margin, y: yPos },
-            thickness: 0.5,
-            color: rgb(0.8, 0.8, 0.8),
-          });
-          yPos -= 15;
-          page.drawText('Attachments', { x: margin, y: yPos, size: 10, font: fontBold });
-          yPos -= 15;
-
-          for (const filePath of allFiles) {
-            const trimmedPath = filePath.trim();
-            const fileName = trimmedPath.split('/').pop();
-            const isPDF = trimmedPath.toLowerCase().endsWith('.pdf');
-            const fileUrl = `${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/api/admin/files/${trimmedPath}`;
-
-            if (isPDF) {
-              const pdfBytes = await loadFileAsArrayBuffer(fileUrl);
-              if (pdfBytes) {
-                try {
-                  const attachedPdf = await PDFDocument.load(pdfBytes);
-                  const copiedPages = await pdfDoc.copyPages(attachedPdf, attachedPdf.getPageIndices());
-
-                  // Note on current page about the PDF
-                  page.drawText(`📄 ${fileName} (${copiedPages.length} page${copiedPages.length > 1 ? 's' : ''} follow)`, {
-                    x: margin + 5, y: yPos, size: 9, font, color: gray
-                  });
-                  yPos -= lineHeight;
-
-                  // Add the PDF pages with a header on each
-                  copiedPages.forEach((copiedPage, pageIdx) => {
-                    pdfDoc.addPage(copiedPage);
-                  });
-                } catch (pdfError) {
-                  console.error('Failed to merge PDF:', pdfError);
-                  page.drawText(`📄 ${fileName} (merge failed)`, { x: margin + 5, y: yPos, size: 9, font, color: rgb(0.8, 0.2, 0.2) });
-                  yPos -= lineHeight;
-                }
-              }
-            } else {
-              // Image
-              const imageBytes = await loadFileAsArrayBuffer(fileUrl);
-              if (imageBytes) {
-                try {
-                  let image;
-                  if (trimmedPath.toLowerCase().endsWith('.png')) {
-                    image = await pdfDoc.embedPng(imageBytes);
-                  } else {
-                    image = await pdfDoc.embedJpg(imageBytes);
-                  }
-
-                  const imgDims = image.scale(1);
-                  const maxWidth = contentWidth;
-                  const maxHeight = 350;
-
-                  let imgWidth = Math.min(imgDims.width, maxWidth);
-                  let imgHeight = imgWidth * (imgDims.height / imgDims.width);
-                  if (imgHeight > maxHeight) {
-                    imgHeight = maxHeight;
-                    imgWidth = imgHeight / (imgDims.height / imgDims.width);
-                  }
-
-                  // New page if needed
-                  if (yPos - imgHeight < margin + 30) {
-                    drawFooter(page, i, filteredExpenses.length, expense.member_name);
-                    page = pdfDoc.addPage();
-                    ({ width, height } = page.getSize());
-                    yPos = height - margin;
-                  }
-
-                  page.drawImage(image, {
-                    x: margin,
-                    y: yPos - imgHeight,
-                    width: imgWidth,
-                    height: imgHeight,
-                  });
-                  yPos -= imgHeight + 10;
-                } catch (imgError) {
-                  console.error('Failed to embed image:', imgError);
-                  page.drawText(`🖼 ${fileName} (embed failed)`, { x: margin + 5, y: yPos, size: 9, font, color: rgb(0.8, 0.2, 0.2) });
-                  yPos -= lineHeight;
-                }
-              }
-            }
-          }
-        }
-
-        drawFooter(page, i, filteredExpenses.length, expense.member_name);
-      }
-
-      // Save and download
-      const pdfBytes = await pdfDoc.save();
-      const blob = new Blob([pdfBytes], { type: 'application/pdf' });
       const link = document.createElement('a');
       link.href = URL.createObjectURL(blob);
       link.download = `expense-report-${format(startDate, 'yyyy-MM-dd')}-to-${format(endDate, 'yyyy-MM-dd')}.pdf`;
@@ -410,6 +136,10 @@ const AdminDashboard = ({ onLogout }) => {
       setStartDate(null);
       setEndDate(null);
     } catch (error) {
+      if (error.response?.status === 404) {
+        alert('No expenses found in the selected date range with selected statuses');
+        return;
+      }
       console.error('Error generating PDF:', error);
       alert('Failed to generate PDF: ' + error.message);
     }
@@ -521,7 +251,7 @@ const AdminDashboard = ({ onLogout }) => {
           <ExpenseList
             expenses={expenses}
             loading={loading}
-            onSelectExpense={setSelectedExpense}
+            onSelectExpense={selectExpense}
             selectedExpenseId={selectedExpense?.id}
           />
         </div>
@@ -155,7 +155,7 @@ const ExpenseView = () => {
                     rel="noopener noreferrer"
                   >
                     <img
-                      src={photoUrl}
+                      src={`${photoUrl}?size=thumb`}
                       alt={`Receipt ${idx + 1}`}
                       style={styles.photo}
                     />
@@ -134,10 +134,10 @@ const PhotoGallery = ({ photoPaths, title = "Photos", editable = false, onDelete
                 </div>
               ) : (
                 <AuthenticatedImage
-                  src={fileUrl}
+                  src={`${fileUrl}?size=thumb`}
                   alt={`${title} ${index + 1}`}
                   style={styles.image}
-                  onClick={() => setLightboxImage(fileUrl)}
+                  onClick={() => setLightboxImage(`${fileUrl}?size=preview`)}
                   onError={() => handleImageError(index)}
                 />
               )}
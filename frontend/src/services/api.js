@@ -35,8 +35,10 @@ export const adminAPI = {
     return response.data;
   },
 
-  listExpenses: async (status = null) => {
-    const params = status ? { status } : {};
+  listExpenses: async (status = null, fields = null) => {
+    const params = {};
+    if (status) params.status = status;
+    if (fields) params.fields = fields.join(',');
     const response = await api.get('/api/admin/expenses', { params });
     return response.data;
   },
@@ -77,6 +79,64 @@ export const adminAPI = {
   restoreExpense: async (expenseId) => {
     const response = await api.post(`/api/admin/expenses/${expenseId}/restore`);
     return response.data;
+  },
+
+  exportReportPdf: async (report) => {
+    const response = await api.post('/api/admin/reports/pdf', report, { responseType: 'blob' });
+    return response.data;
+  },
+
+  // Live change feed (Server-Sent Events). EventSource can't send the
+  // Authorization header, so the stream is read with fetch. Reconnects with
+  // Last-Event-ID until the returned function is called.
+  subscribeEvents: (onEvent, onUnauthorized) => {
+    const controller = new AbortController();
+    let lastEventId = null;
+    let retryMs = 3000;
+
+    const dispatch = (block) => {
+      let type = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('id:')) lastEventId = line.slice(3).trim();
+        else if (line.startsWith('event:')) type = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+        else if (line.startsWith('retry:')) retryMs = parseInt(line.slice(6), 10) || retryMs;
+      }
+      if (data) onEvent(type, JSON.parse(data));
+    };
+
+    const connect = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          const headers = { Authorization: `Bearer ${localStorage.getItem('admin_token')}` };
+          if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+          const response = await fetch(`${API_URL}/api/admin/events`, { headers, signal: controller.signal });
+          if (response.status === 401 || response.status === 403) {
+            onUnauthorized?.();
+            return;
+          }
+          const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+          let buffer = '';
+          while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            let end;
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+              dispatch(buffer.slice(0, end));
+              buffer = buffer.slice(end + 2);
+            }
+          }
+        } catch (err) {
+          if (controller.signal.aborted) return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, retryMs));
+      }
+    };
+
+    connect();
+    return () => controller.abort();
   }
 };
 
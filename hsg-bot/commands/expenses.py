@@ -2,10 +2,13 @@ import os
 import logging
 from services.tokens import generate_access_token
 from services.mattermost import send_dm_to_username
+from services.backend import get_member_ledger
 
 logger = logging.getLogger(__name__)
 
 PRIVATE_KEY = os.getenv('ACCESS_TOKEN_PRIVATE_KEY')
+KEY_ID = os.getenv('ACCESS_TOKEN_KEY_ID')
+TOKEN_FORMAT = os.getenv('ACCESS_TOKEN_FORMAT', 'binary')
 EXPENSE_URL = os.getenv('EXPENSE_URL', 'https://expenses.hackerspace.gent')
 
 
@@ -24,6 +27,10 @@ def handle_expenses(username: str, args: str) -> tuple[dict, str | None]:
 
     if args == 'help':
         return help_response(), None
+    if args == 'balance':
+        return balance_response(username), None
+    if args == 'list':
+        return list_response(username), None
 
     return generate_link_response(username)
 
@@ -36,6 +43,8 @@ def help_response() -> dict:
 
 **Commands:**
 - `/expenses` - Get a personal link to submit an expense note (valid for 7 days)
+- `/expenses balance` - Show your submitted, pending, paid and denied totals
+- `/expenses list` - Show your most recent expenses
 - `/expenses help` - Show this help message
 
 **How it works:**
@@ -50,6 +59,57 @@ _This message is only visible to you._"""
     }
 
 
+STATUS_EMOJI = {
+    "paid": ":white_check_mark:",
+    "denied": ":x:",
+    "pending": ":hourglass:"
+}
+
+
+def backend_error_response() -> dict:
+    return {
+        'response_type': 'ephemeral',
+        'text': "Sorry, your expenses could not be loaded right now. Please try again later."
+    }
+
+
+def balance_response(username: str) -> dict:
+    """Show the member's expense totals per status."""
+    ledger = get_member_ledger(username, limit=0)
+    if ledger is None:
+        return backend_error_response()
+
+    lines = ["**Your Expenses**", ""]
+    for key, label in (("submitted", "Submitted"), ("pending", "Pending"), ("paid", "Paid"), ("denied", "Denied")):
+        bucket = ledger[key]
+        lines.append(f"- {label}: **€{float(bucket['total']):.2f}** ({bucket['count']})")
+    lines += ["", "_This message is only visible to you._"]
+
+    return {'response_type': 'ephemeral', 'text': "\n".join(lines)}
+
+
+def list_response(username: str) -> dict:
+    """Show the member's most recent expenses."""
+    ledger = get_member_ledger(username)
+    if ledger is None:
+        return backend_error_response()
+
+    if not ledger['recent']:
+        return {'response_type': 'ephemeral', 'text': "You have no expenses yet. Use `/expenses` to submit one."}
+
+    lines = ["**Your Recent Expenses**", ""]
+    for expense in ledger['recent']:
+        description = expense['description']
+        desc_preview = description[:50] + "..." if len(description) > 50 else description
+        lines.append(
+            f"- {STATUS_EMOJI.get(expense['status'], '')} {expense['date_entered'][:10]} "
+            f"**€{float(expense['amount']):.2f}** {desc_preview}"
+        )
+    lines += ["", "_This message is only visible to you._"]
+
+    return {'response_type': 'ephemeral', 'text': "\n".join(lines)}
+
+
 def generate_link_response(username: str) -> tuple[dict, str | None]:
     """Generate expense link for user. Returns ephemeral response and DM message."""
     if not PRIVATE_KEY:
@@ -60,7 +120,7 @@ def generate_link_response(username: str) -> tuple[dict, str | None]:
         }, None
 
     try:
-        token = generate_access_token(PRIVATE_KEY, username)
+        token = generate_access_token(PRIVATE_KEY, username, key_id=KEY_ID, format=TOKEN_FORMAT)
         url = f"{EXPENSE_URL}?access={token}"
         logger.info(f"Generated expense link for {username}")
 
@@ -3,6 +3,7 @@ import hmac
 import logging
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from commands.expenses import handle_expenses, notify_status_change
@@ -42,7 +43,8 @@ async def slash_expenses(request: Request):
     username = form.get('user_name', 'unknown')
     text = form.get('text', '')
 
-    response, dm_message = handle_expenses(username, text)
+    # Handlers may call the backend; keep them off the event loop
+    response, dm_message = await run_in_threadpool(handle_expenses, username, text)
 
     # Send DM as backup for mobile users
     if dm_message:
@@ -0,0 +1,49 @@
+import os
+import logging
+import requests
+from services.token_format import SCOPE_MEMBER
+from services.tokens import generate_access_token
+
+logger = logging.getLogger(__name__)
+
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://backend:8000')
+PRIVATE_KEY = os.getenv('ACCESS_TOKEN_PRIVATE_KEY')
+KEY_ID = os.getenv('ACCESS_TOKEN_KEY_ID')
+TOKEN_FORMAT = os.getenv('ACCESS_TOKEN_FORMAT', 'binary')
+
+# Mattermost drops slash command responses after 3 seconds
+REQUEST_TIMEOUT = 2.0
+
+
+def get_member_ledger(username: str, limit: int = 10) -> dict:
+    """
+    Fetch a member's expense ledger and recent expenses from the backend.
+
+    The request is authenticated with a short-lived access token for the
+    member, scoped to the ledger endpoint so the backend only ever returns
+    that member's data. Submission links the bot DMs are not accepted there.
+
+    Returns:
+        Ledger dict, or None if the backend could not be reached
+    """
+    if not PRIVATE_KEY:
+        logger.error("Cannot fetch ledger: ACCESS_TOKEN_PRIVATE_KEY not configured")
+        return None
+
+    try:
+        token = generate_access_token(
+            PRIVATE_KEY, username, expires_seconds=60, key_id=KEY_ID, format=TOKEN_FORMAT,
+            scope=SCOPE_MEMBER
+        )
+        response = requests.get(
+            f"{BACKEND_URL.rstrip('/')}/api/expenses/member",
+            params={'access': token, 'limit': limit},
+            timeout=REQUEST_TIMEOUT
+        )
+        if response.status_code != 200:
+            logger.warning(f"Ledger request for {username} failed: {response.status_code} - {response.text}")
+            return None
+        return response.json()
+    except Exception as e:
+        logger.error(f"Failed to fetch ledger for {username}: {e}")
+        return None
@@ -1,11 +1,26 @@
 import base64
 import json
 import time
+from functools import lru_cache
 from typing import Optional
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from services import token_format
 
 
-def generate_access_token(private_key_b64: str, username: Optional[str] = None, expires_days: int = 7) -> str:
+@lru_cache(maxsize=4)
+def _load_private_key(private_key_b64: str) -> Ed25519PrivateKey:
+    return Ed25519PrivateKey.from_private_bytes(base64.b64decode(private_key_b64))
+
+
+def generate_access_token(
+    private_key_b64: str,
+    username: Optional[str] = None,
+    expires_days: int = 7,
+    expires_seconds: Optional[int] = None,
+    key_id: Optional[str] = None,
+    format: str = "binary",
+    scope: Optional[str] = None
+) -> str:
     """
     Generate a signed access token.
 
@@ -13,19 +28,35 @@ def generate_access_token(private_key_b64: str, username: Optional[str] = None,
         private_key_b64: Base64-encoded Ed25519 private key
         username: Username to embed in token
         expires_days: Token validity in days
+        expires_seconds: Token validity in seconds (overrides expires_days)
+        key_id: Key id the backend should verify with (for key rotation)
+        format: "binary" (see token_format) or "json" (the legacy layout)
+        scope: Restricts the token to endpoints requiring that scope, e.g.
+            token_format.SCOPE_MEMBER; None for submission links
 
     Returns:
         Base64url-encoded signed token
     """
-    private_key_bytes = base64.b64decode(private_key_b64)
-    private_key = Ed25519PrivateKey.from_private_bytes(private_key_bytes)
+    private_key = _load_private_key(private_key_b64)
 
     now = int(time.time())
-    payload = json.dumps({
-        "exp": now + (expires_days * 24 * 60 * 60),
+    if expires_seconds is None:
+        expires_seconds = expires_days * 24 * 60 * 60
+
+    if format == "binary":
+        payload = token_format.encode_payload(username or "unknown", now, now + expires_seconds, key_id, scope)
+        return token_format.b64encode(payload + private_key.sign(payload))
+
+    claims = {
+        "exp": now + expires_seconds,
         "iat": now,
         "u": username or "unknown"
-    }).encode('utf-8')
+    }
+    if key_id:
+        claims["k"] = key_id
+    if scope:
+        claims["s"] = scope
+    payload = json.dumps(claims).encode('utf-8')
 
     signature = private_key.sign(payload)
     token = base64.urlsafe_b64encode(signature + payload).decode('utf-8')
@@ -64,3 +95,7 @@ if __name__ == '__main__':
     print()
     print(f"Public key (for backend/.env):")
     print(f"ACCESS_TOKEN_PUBLIC_KEY={public_key}")
+    print()
+    print("To rotate without downtime, give the new key an id (ACCESS_TOKEN_KEY_ID")
+    print("in hsg-bot/.env) and list it next to the old one in backend/.env:")
+    print(f"ACCESS_TOKEN_PUBLIC_KEY=<old id>:<old public key>,<new id>:{public_key}")